@@ -0,0 +1,277 @@
+"""
+Caption engine based on an ASS subtitle track, burned in by ffmpeg (libass).
+
+Instead of one PNG (and one extra ffmpeg input) per ayah, the whole reel gets
+a single .ass file with one timed event per ayah. Each clip is encoded with
+
+    setpts=PTS+<clip start>/TB, ass=<reel.ass>:fontsdir=<fonts>, setpts=PTS-STARTPTS
+
+so the clip sees its own ayah's event, in the same pass that encodes the video.
+libass shapes the Uthmani text itself (HarfBuzz/FriBiDi) with the bundled
+Amiri-Quran.ttf, found through fontsdir.
+
+Layout follows the PNG path: same fitted font size (caption_fit), centred
+right-to-left lines, 10px side margins, block centred vertically. Stroke and
+shadow map onto the ASS border/shadow; glow has no ASS equivalent and is
+approximated with a soft border.
+
+python ass_captions.py [N] renders N sample ayahs through both engines and
+reports how well the inked areas agree; tests/test_ass_captions.py runs the
+same check under pytest.
+"""
+import os
+import struct
+import subprocess
+
+CAPTION_MODES = ('png', 'ass')
+
+PLAY_RES = (1080, 1920)
+SIDE_MARGIN = 10
+# Block size (px) for comparing the two engines' ink
+CELL = 8
+# Minimum ink overlap (IoU over CELL blocks) for the engines to count as agreeing
+MIN_IOU = 0.75
+
+_cell_ratios = {}
+
+
+def font_cell_ratio(font_path):
+    """
+    (usWinAscent + usWinDescent) / unitsPerEm of a TrueType font.
+    libass sizes fonts by that cell height, our renderers by the em height.
+    """
+    font_path = str(font_path)
+    ratio = _cell_ratios.get(font_path)
+    if ratio is not None:
+        return ratio
+
+    with open(font_path, 'rb') as f:
+        data = f.read()
+    num_tables = struct.unpack_from('>H', data, 4)[0]
+    tables = {}
+    for i in range(num_tables):
+        tag, _, offset, _ = struct.unpack_from('>4sIII', data, 12 + 16 * i)
+        tables[tag] = offset
+    units_per_em = struct.unpack_from('>H', data, tables[b'head'] + 18)[0]
+    win_ascent, win_descent = struct.unpack_from('>HH', data, tables[b'OS/2'] + 74)
+    ratio = (win_ascent + win_descent) / units_per_em
+    _cell_ratios[font_path] = ratio
+    return ratio
+
+
+def font_family(font_path):
+    """Family name from the font's 'name' table (nameID 1), as libass matches it."""
+    with open(font_path, 'rb') as f:
+        data = f.read()
+    num_tables = struct.unpack_from('>H', data, 4)[0]
+    for i in range(num_tables):
+        tag, _, offset, _ = struct.unpack_from('>4sIII', data, 12 + 16 * i)
+        if tag != b'name':
+            continue
+        _, count, strings = struct.unpack_from('>HHH', data, offset)
+        for j in range(count):
+            platform, _, _, name_id, length, str_offset = struct.unpack_from('>6H', data, offset + 6 + 12 * j)
+            if name_id == 1:
+                raw = data[offset + strings + str_offset:offset + strings + str_offset + length]
+                return raw.decode('utf-16-be' if platform in (0, 3) else 'latin-1')
+    return os.path.splitext(os.path.basename(font_path))[0]
+
+
+def _timestamp(seconds):
+    centis = int(round(seconds * 100))
+    hours, centis = divmod(centis, 360000)
+    minutes, centis = divmod(centis, 6000)
+    secs, centis = divmod(centis, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centis:02d}"
+
+
+def _color(rgb, opacity=1.0):
+    """ASS colour &HAABBGGRR (AA is transparency)."""
+    r, g, b = rgb
+    alpha = 255 - int(round(opacity * 255))
+    return f"&H{alpha:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def _escape(text):
+    # Braces start override blocks; backslashes start escapes
+    return " ".join(text.split()).replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}')
+
+
+def _effect_style(effects):
+    """Border / shadow fields of the Style line for a normalized effects spec."""
+    effects = effects or {}
+    outline, outline_colour = 0, _color((0, 0, 0))
+    shadow, back_colour, blur = 0, _color((0, 0, 0), 0.0), 0
+
+    if 'glow' in effects:
+        glow = effects['glow']
+        outline = max(1, glow['radius'] // 2)
+        outline_colour = _color(glow['color'], glow['opacity'])
+        blur = glow['radius'] // 2
+    if 'stroke' in effects:
+        stroke = effects['stroke']
+        outline = stroke['width']
+        outline_colour = _color(stroke['color'], stroke['opacity'])
+        blur = 0
+    if 'shadow' in effects:
+        s = effects['shadow']
+        shadow = s['offset']
+        back_colour = _color(s['color'], s['opacity'])
+        if 'stroke' not in effects:
+            blur = max(blur, s['blur'] // 2)
+
+    return outline, outline_colour, shadow, back_colour, blur
+
+
+def build_script(events, font_path, effects=None, width=PLAY_RES[0], height=PLAY_RES[1]):
+    """
+    ASS script for a reel.
+    events: [(start_seconds, end_seconds, text, font_size_em_px), ...]
+    """
+    ratio = font_cell_ratio(font_path)
+    family = font_family(font_path)
+    outline, outline_colour, shadow, back_colour, blur = _effect_style(effects)
+    shadow_x, shadow_y = shadow if shadow else (0, 0)
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 0",
+        "ScaledBorderAndShadow: yes",
+        "YCbCr Matrix: None",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: Ayah,{family},{round(100 * ratio)},{_color((255, 255, 255))},{_color((255, 255, 255))},"
+        f"{outline_colour},{back_colour},0,0,0,0,100,100,0,0,1,{outline},0,5,"
+        f"{SIDE_MARGIN},{SIDE_MARGIN},{SIDE_MARGIN},178",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+
+    overrides = ""
+    if shadow_x or shadow_y:
+        overrides += f"\\xshad{shadow_x}\\yshad{shadow_y}"
+    if blur:
+        overrides += f"\\blur{blur}"
+
+    for start, end, text, font_size in events:
+        size = round(font_size * ratio, 2)
+        lines.append(
+            f"Dialogue: 0,{_timestamp(start)},{_timestamp(end)},Ayah,,0,0,0,,"
+            f"{{\\fs{size:g}{overrides}}}{_escape(text)}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_script(path, events, font_path, effects=None, width=PLAY_RES[0], height=PLAY_RES[1]):
+    script = build_script(events, font_path, effects, width, height)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8-sig') as f:
+        f.write(script)
+    os.replace(tmp, path)
+    return str(path)
+
+
+def filter_path(path):
+    """Path quoted for use as an ffmpeg filter option value (Windows drive colons too)."""
+    path = os.path.abspath(str(path)).replace('\\', '/')
+    return "'" + path.replace(':', '\\:').replace("'", "\\'") + "'"
+
+
+def ass_filter(ass_path, fonts_dir, offset=0.0):
+    """Filter chain burning the reel's ASS track into a clip that starts at offset seconds."""
+    return (
+        f"setpts=PTS+{offset:.3f}/TB,"
+        f"ass=filename={filter_path(ass_path)}:fontsdir={filter_path(fonts_dir)},"
+        f"setpts=PTS-STARTPTS"
+    )
+
+
+# --- correctness check against the PNG engine ---
+
+def _ink_mask_from_ass(text, font_size, font_path, effects, tmp_dir):
+    import numpy as np
+
+    ass_path = os.path.join(tmp_dir, 'compare.ass')
+    write_script(ass_path, [(0.0, 1.0, text, font_size)], font_path, effects)
+    width, height = PLAY_RES
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'color=c=black:s={width}x{height}:d=0.5',
+        '-vf', f"ass=filename={filter_path(ass_path)}:fontsdir={filter_path(os.path.dirname(font_path))},format=gray",
+        '-frames:v', '1', '-f', 'rawvideo', '-'
+    ]
+    raw = subprocess.run(cmd, check=True, capture_output=True, timeout=60).stdout
+    return np.frombuffer(raw, dtype=np.uint8).reshape(height, width) > 127
+
+
+def _ink_mask_from_png(text, font_size, renderer):
+    import numpy as np
+    width, height = PLAY_RES
+    image, x, y = renderer.render_tight(text, font_size, width, height)
+    mask = np.zeros((height, width), dtype=bool)
+    alpha = np.asarray(image.getchannel('A')) > 127
+    h, w = alpha.shape
+    mask[y:y + h, x:x + w] = alpha
+    return mask
+
+
+def _cells(mask):
+    h, w = mask.shape
+    return mask[:h - h % CELL, :w - w % CELL].reshape(h // CELL, CELL, w // CELL, CELL).any(axis=(1, 3))
+
+
+def compare_engines(sample=12, font_path=None, threshold=MIN_IOU):
+    """
+    Renders sample ayahs with both engines (no effects) and compares the text masks.
+    Returns [(sura, ayah, iou, bbox_png, bbox_ass), ...]; prints a report.
+    """
+    import tempfile
+    import numpy as np
+    import quran_provider
+    import caption_fit
+    import caption_renderer
+
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    font_path = font_path or os.path.join(base, 'fonts', 'Amiri-Quran.ttf')
+    renderer = caption_renderer.get_renderer(font_path)
+    _, _, box_width, box_height = caption_fit.CANVAS_PRESETS['reel']
+
+    total = quran_provider.total_ayahs()
+    step = max(1, total // sample)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for index in range(0, total, step)[:sample]:
+            sura, ayah = quran_provider.ayah_key(index)
+            text = " ".join(quran_provider.get_ayah_text(sura, ayah).split())
+            font_size, _ = caption_fit.fit_font_size(renderer, text, box_width, box_height)
+
+            png = _ink_mask_from_png(text, font_size, renderer)
+            ass = _ink_mask_from_ass(text, font_size, font_path, None, tmp_dir)
+            # Compared on CELL x CELL blocks, so sub-pixel antialiasing differences do not count
+            png_cells, ass_cells = _cells(png), _cells(ass)
+            union = np.logical_or(png_cells, ass_cells).sum()
+            iou = np.logical_and(png_cells, ass_cells).sum() / union if union else 1.0
+
+            def bbox(mask):
+                rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+                return (int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])) if len(rows) else None
+
+            results.append((sura, ayah, float(iou), bbox(png), bbox(ass)))
+            mark = "✓" if iou >= threshold else "✗"
+            print(f"  {mark} {sura}:{ayah} size {font_size}  IoU {iou:.3f}  png {bbox(png)}  ass {bbox(ass)}")
+
+    passed = sum(1 for r in results if r[2] >= threshold)
+    print(f"[INFO] {passed}/{len(results)} sample ayahs agree (IoU >= {threshold})")
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    compare_engines(int(sys.argv[1]) if len(sys.argv) > 1 else 12)
@@ -0,0 +1,322 @@
+"""
+Pre-transcoded AAC tier of the audio cache.
+
+Every render used to re-encode the same 64 kbps MP3s to AAC. Here audio is
+transcoded to the output profile (AAC_PROFILE) once, stored under a key that
+covers the source and the encoder settings, and muxed into clips and reels
+with '-c:a copy' from then on.
+
+    segments : one ayah's slot of a reel (audio_pcm.slot: speech + padding,
+               whole AAC frames, loudness gain) as an ADTS stream, with its
+               speech length (.json) next to it
+    ayahs    : one ayah transcoded on its own (with its loudness gain), for
+               the per-clip audio path
+
+A reel's gapless track is its segments joined frame by frame (track()), so a
+new selection of ayahs rendered before needs no decoding or encoding at all.
+Every ADTS stream starts with one priming frame and, for a slot of N frames,
+decodes to N + 1 frames; the join drops the first segment's priming frame
+and every other segment's last frame. Frame k of an encode decodes to its
+input samples [(k-1)*1024, k*1024), so each segment keeps exactly its slot
+length and the track stays sample-exact with no gap at the boundaries. The
+frame that stands in for a slot's last 1024 samples (23 ms) is the next
+segment's priming frame, which lacks that tail's half of the transform: the
+tail is slightly faded. Slots end in padding silence more often than not,
+where this is inaudible; the first 1024 samples of the reel are faded in
+the same way.
+
+Files live in <root>/<k[:2]>/<key>.m4a (segments .aac), written to a temp
+name and renamed.
+The directory is kept under AUDIO_AAC_CACHE_MB by evicting the least
+recently used files (access = mtime, touched on every hit). File count and
+size are running totals from one walk at first use; the directory is only
+walked again when a write takes it over budget.
+"""
+import os
+import json
+import hashlib
+import threading
+import subprocess
+import concurrent.futures
+
+import audio_pack
+import audio_pcm
+
+AAC_PROFILE = {
+    'codec': 'aac',
+    'bitrate': audio_pcm.BITRATE,
+    'sample_rate': audio_pcm.SAMPLE_RATE,
+    'channels': audio_pcm.CHANNELS,
+}
+CACHE_VERSION = 1
+BUDGET_ENV = 'AUDIO_AAC_CACHE_MB'
+DEFAULT_BUDGET_MB = 1024
+
+
+def source_id(source):
+    """Identity of an ayah's audio: a pack spec with its generation id, a file by size/mtime."""
+    if audio_pack.is_spec(source):
+        return audio_pack.spec_id(source)
+    st = os.stat(source)
+    return f"{os.path.basename(str(source))}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def stale_keys(keys, audio_dir):
+    """
+    The source_id() keys whose audio is gone or changed: a file in audio_dir
+    removed or rewritten, or a pack spec of a retired generation. One stat
+    per file, one index header read per pack.
+    """
+    stale = []
+    generations = {}  # pack path -> ':<generation id>' suffix, or None
+    for key in keys:
+        if audio_pack.is_spec(key):
+            spec = key.rpartition(':')[0]
+            path = audio_pack.spec_path(spec)
+            if path not in generations:
+                try:
+                    generations[path] = audio_pack.spec_id(spec)[len(spec):]
+                except OSError:
+                    generations[path] = None
+            if key[len(spec):] != generations[path]:
+                stale.append(key)
+            continue
+        name, _, identity = key.partition(':')
+        try:
+            st = os.stat(os.path.join(str(audio_dir), name))
+        except OSError:
+            stale.append(key)
+            continue
+        if identity != f"{st.st_size}:{st.st_mtime_ns}":
+            stale.append(key)
+    return stale
+
+
+def adts_frames(data):
+    """The frames of an ADTS stream, as bytes each. Raises ValueError on a malformed stream."""
+    frames = []
+    pos = 0
+    while pos < len(data):
+        if pos + 7 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xF6 != 0xF0:
+            raise ValueError(f"no ADTS frame at byte {pos}")
+        length = ((data[pos + 3] & 0x03) << 11) | (data[pos + 4] << 3) | (data[pos + 5] >> 5)
+        if length < 7 or pos + length > len(data):
+            raise ValueError(f"truncated ADTS frame at byte {pos}")
+        frames.append(data[pos:pos + length])
+        pos += length
+    return frames
+
+
+def _key(kind, payload):
+    data = json.dumps([CACHE_VERSION, kind, AAC_PROFILE, payload], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class AacCache:
+    def __init__(self, root, max_bytes=None):
+        self.root = str(root)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.usage = None  # {'files', 'bytes'}, see _usage()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key, ext='.m4a'):
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def _tmp(self, path):
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp{os.path.splitext(path)[1]}"
+
+    def _hit(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        with self.lock:
+            self.counters['hits'] += 1
+        return True
+
+    def _miss(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            self.counters['misses'] += 1
+
+    # --- tiers ---
+
+    def segment(self, source, gain_db=0.0, min_duration=0.0, gap=0.0):
+        """
+        (path, speech samples, cached) of source's slot as an ADTS stream (see
+        audio_pcm.slot), built on first use. Raises on failure.
+        """
+        key = _key('segment', [source_id(source), gain_db, min_duration, gap])
+        path = self.path_for(key, '.aac')
+        meta_path = path[:-4] + '.json'
+        if self._hit(path):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    return path, json.load(f)['speech'], True
+            except (OSError, ValueError, KeyError):
+                pass
+
+        self._miss(path)
+        pcm = audio_pcm.apply_gain(audio_pcm.decode(source), gain_db)
+        pcm, speech = audio_pcm.slot(pcm, min_duration, gap)
+        data = audio_pcm.encode_adts(pcm)
+        if len(adts_frames(data)) != len(pcm) // (2 * audio_pcm.CHANNELS * audio_pcm.AAC_FRAME) + 1:
+            raise RuntimeError(f"unexpected AAC framing for {source}")
+        tmp = self._tmp(path)
+        try:
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'speech': speech}, f)
+            os.replace(meta_path + '.tmp', meta_path)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._added(path)
+        self._evict(keep=path)
+        return path, speech, False
+
+    def track(self, sources, output_path, gains=None, gap=0.0, min_duration=0.0, workers=audio_pcm.DECODE_WORKERS):
+        """
+        Writes the gapless track of sources to output_path (ADTS) from their
+        cached segments (built first where missing, in parallel). gap is left
+        out after the last ayah. Returns (table, cached): the timestamp table,
+        one entry per ayah
+            {'start', 'speech_end', 'end'}   seconds in the reel
+            {'start_sample', 'samples'}      same, in samples (slot length incl. padding)
+        and whether every segment was already cached. Raises on failure.
+        """
+        sources = list(sources)
+        gains = gains or [0.0] * len(sources)
+        last = len(sources) - 1
+
+        def build(i):
+            return self.segment(sources[i], gains[i], min_duration, gap if i < last else 0.0)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            segments = list(executor.map(build, range(len(sources))))
+
+        rate = audio_pcm.SAMPLE_RATE
+        table = []
+        cursor = 0
+        tmp = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as out:
+                for i, (path, speech, _) in enumerate(segments):
+                    with open(path, 'rb') as f:
+                        frames = adts_frames(f.read())
+                    samples = (len(frames) - 1) * audio_pcm.AAC_FRAME
+                    out.write(b''.join(frames[1 if i == 0 else 0:None if i == last else -1]))
+                    table.append({
+                        'start': cursor / rate,
+                        'speech_end': (cursor + speech) / rate,
+                        'end': (cursor + samples) / rate,
+                        'start_sample': cursor,
+                        'samples': samples,
+                    })
+                    cursor += samples
+            os.replace(tmp, output_path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return table, all(cached for _, _, cached in segments)
+
+    def ayah(self, source, gain_db=0.0):
+        """Path of source transcoded to AAC_PROFILE, gain applied (transcoded on first use), or None."""
+        try:
+            key = _key('ayah', [source_id(source), gain_db])
+        except OSError:
+            return None
+        path = self.path_for(key)
+        if self._hit(path):
+            return path
+
+        self._miss(path)
+        tmp = self._tmp(path)
+        cmd = [
+            'ffmpeg', '-y', '-v', 'error', '-i', str(source), '-vn',
+            '-af', f'volume={gain_db}dB',
+            '-c:a', AAC_PROFILE['codec'], '-b:a', AAC_PROFILE['bitrate'],
+            '-ar', str(AAC_PROFILE['sample_rate']), '-ac', str(AAC_PROFILE['channels']),
+            tmp
+        ]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, timeout=120)
+            os.replace(tmp, path)
+        except (subprocess.SubprocessError, OSError) as e:
+            print(f"[WARN] AAC transcode failed for {source}: {e}")
+            return None
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._added(path)
+        self._evict(keep=path)
+        return path
+
+    # --- budget ---
+
+    def _files(self):
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(('.m4a', '.aac')) and '.tmp' not in name:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def _usage(self):
+        """Running {'files', 'bytes'} of the directory (walked once, on first use). Call under self.lock."""
+        if self.usage is None:
+            files = self._files()
+            self.usage = {'files': len(files), 'bytes': sum(size for _, size, _ in files)}
+        return self.usage
+
+    def _added(self, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self.lock:
+            # before the first walk there is nothing to update: the walk will see it
+            if self.usage is not None:
+                self.usage['files'] += 1
+                self.usage['bytes'] += size
+
+    def _evict(self, keep=None):
+        with self.lock:
+            if self._usage()['bytes'] <= self.max_bytes:
+                return
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        count = len(files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            for victim in (path, path[:-4] + '.json'):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+            count -= 1
+            with self.lock:
+                self.counters['evictions'] += 1
+        with self.lock:
+            self.usage = {'files': count, 'bytes': total}
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, **self._usage())
+        stats['budget'] = self.max_bytes
+        return stats
@@ -0,0 +1,431 @@
+"""
+Per-file audio analysis, computed once and cached next to the audio cache.
+
+    loudness : EBU R128 integrated loudness (LUFS) and sample peak (dBFS) of
+               an ayah, measured in NumPy over its decoded PCM
+    pauses   : where the reciter is speaking and the pauses inside that
+               span, from frame energies (caption pages, caption_pages.py)
+    envelope : per-video-frame level and spectrum bands (audio_visual.py),
+               kept as .npy files under <root>/envelopes
+
+The loudness measurement follows ITU-R BS.1770: K-weighting (high shelf +
+high pass), mean square over 400 ms blocks with 75% overlap, absolute gate
+at -70 LUFS, relative gate 10 LU below the absolute-gated level. The
+K-weighting is applied in the frequency domain (one rFFT of the whole ayah,
+multiplied by the filter's magnitude response), which gives the same block
+powers as the time-domain biquads without a per-sample loop.
+
+Pauses are runs of 20 ms frames (energy smoothed over 100 ms) more than
+PAUSE_DROP dB below the ayah's speech level (90th percentile frame), at
+least PAUSE_MIN long - relative to the recording, so reverb tails and noisy
+mirrors do not need their own thresholds. One reshape + mean over the
+decoded PCM, no per-sample Python (pydub's detect_silence slices the audio
+once per millisecond).
+
+Results are keyed by the audio's identity (audio_aac.source_id) in
+<root>/index.json, so a (reciter, ayah) file is analysed once: one decode
+fills every measurement the entry is missing. Renders only read the stats.
+The index is shared with other processes (warm_cache.py): a missing entry
+first re-reads the index if it changed on disk, and flush() merges this
+process's new and dropped entries into it under an inter-process lock.
+
+Entries follow the audio they were measured on: forget() drops them (and
+their envelope files) when the audio cache or a pack evicts or discards the
+file, and prune() drops the ones whose audio another process removed or
+repacked (audio_aac.stale_keys).
+"""
+import os
+import json
+import hashlib
+import threading
+import concurrent.futures
+
+import numpy as np
+
+import audio_aac
+import audio_pcm
+import file_lock
+
+INDEX_VERSION = 1
+TARGET_ENV = 'AUDIO_LOUDNESS_TARGET'
+DEFAULT_TARGET = -16.0  # LUFS, typical for phone / social video
+PEAK_CEILING = -1.0     # dBFS: the gain never pushes the peak above this
+WORKERS = audio_pcm.DECODE_WORKERS
+
+# BS.1770 K-weighting biquads, specified at 48 kHz
+_SHELF = ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585])
+_HIGHPASS = ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621])
+_SPEC_RATE = 48000
+
+BLOCK = 0.4    # seconds
+STEP = 0.1     # 75% overlap
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+PAUSE_FRAME = 0.02   # seconds per energy frame
+PAUSE_SMOOTH = 5     # frames in the moving average
+PAUSE_DROP = 20.0    # dB below the speech level
+PAUSE_MIN = 0.25     # seconds
+
+ENVELOPE_BANDS = 32
+ENVELOPE_RANGE = (80.0, 8000.0)  # Hz, log-spaced band edges (where recitation has its energy)
+
+
+def loudness_target():
+    """Target loudness in LUFS, or None when normalization is switched off."""
+    value = os.environ.get(TARGET_ENV, '')
+    if value.lower() in ('off', 'none', '0'):
+        return None
+    return float(value) if value else DEFAULT_TARGET
+
+
+def decode_pcm(source, rate=audio_pcm.SAMPLE_RATE, channels=audio_pcm.CHANNELS):
+    """Decoded audio as float32 samples in [-1, 1], shape (frames, channels)."""
+    raw = audio_pcm.decode(source, rate, channels)
+    return np.frombuffer(raw, dtype='<i2').reshape(-1, channels).astype(np.float32) / 32768.0
+
+
+def _biquad_power(c, cos_w, cos_2w):
+    """|c0 + c1 z^-1 + c2 z^-2|^2 on the unit circle, in terms of cos(w) and cos(2w)."""
+    return (c[0] * c[0] + c[1] * c[1] + c[2] * c[2]
+            + 2 * (c[0] * c[1] + c[1] * c[2]) * cos_w + 2 * c[0] * c[2] * cos_2w)
+
+
+def _k_response(freqs):
+    """|H(f)|^2 of the K-weighting filter at the given frequencies (Hz)."""
+    # float64: the high-pass pole sits close to z = 1, float32 cancels it out
+    w = (2 * np.pi / _SPEC_RATE) * np.minimum(freqs, _SPEC_RATE / 2)
+    cos_w, cos_2w = np.cos(w), np.cos(2 * w)
+    power = np.ones(len(freqs))
+    for b, a in (_SHELF, _HIGHPASS):
+        power *= _biquad_power(b, cos_w, cos_2w) / _biquad_power(a, cos_w, cos_2w)
+    return np.maximum(power, 0).astype(np.float32)  # rounding: -1e-16 at DC
+
+
+def _fft_size(n):
+    """Smallest 2^a * 3^b * 5^c >= n (pocketfft is slow on lengths with large prime factors)."""
+    best = 1 << max(n - 1, 0).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            size = p35
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def loudness(pcm, rate=audio_pcm.SAMPLE_RATE):
+    """{'lufs', 'peak_db'} of float PCM shaped (frames, channels). lufs is None for silence."""
+    frames = len(pcm)
+    peak = float(np.max(np.abs(pcm))) if frames else 0.0
+    peak_db = round(20 * float(np.log10(peak)), 2) if peak > 0 else None
+    if not frames:
+        return {'lufs': None, 'peak_db': peak_db}
+
+    # dual-mono (most recitations): weight one channel, count its power per channel
+    channels = pcm.shape[1]
+    if channels > 1 and np.array_equal(pcm[:, 0], pcm[:, 1:].mean(axis=1)):
+        pcm = pcm[:, :1]
+    else:
+        channels = 1
+
+    # zero padding keeps the filter's (short) tail from wrapping around
+    size = _fft_size(frames + rate // 10)
+    spectrum = np.fft.rfft(pcm, n=size, axis=0)
+    gain = np.sqrt(_k_response(np.fft.rfftfreq(size, 1.0 / rate)))
+    weighted = np.fft.irfft(spectrum * gain[:, None], n=size, axis=0)[:frames]
+
+    # mean square per channel over sliding blocks (cumulative sums), summed over channels
+    block = min(int(BLOCK * rate), frames)
+    step = int(STEP * rate)
+    energy = np.concatenate([np.zeros((1, pcm.shape[1])), np.cumsum(weighted ** 2, axis=0)])
+    starts = np.arange(0, frames - block + 1, step)
+    powers = ((energy[starts + block] - energy[starts]) / block).sum(axis=1) * channels
+
+    with np.errstate(divide='ignore'):
+        block_lufs = -0.691 + 10 * np.log10(powers)
+    gated = powers[block_lufs > ABSOLUTE_GATE]
+    if not len(gated):
+        return {'lufs': None, 'peak_db': peak_db}
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+    lufs = -0.691 + 10 * np.log10(gated.mean())
+    return {'lufs': round(float(lufs), 2), 'peak_db': peak_db}
+
+
+def pauses(pcm, rate=audio_pcm.SAMPLE_RATE):
+    """
+    {'speech': [start, end], 'pauses': [[start, end], ...]} in seconds, for
+    float PCM shaped (frames, channels). Leading / trailing silence is not a pause.
+    """
+    hop = int(PAUSE_FRAME * rate)
+    count = len(pcm) // hop
+    if not count:
+        return {'speech': [0.0, 0.0], 'pauses': []}
+    frames = pcm[:count * hop].mean(axis=1).reshape(count, hop)
+    energy = np.einsum('ij,ij->i', frames, frames) / hop
+    energy = np.convolve(energy, np.ones(PAUSE_SMOOTH) / PAUSE_SMOOTH, mode='same')
+    level = 10 * np.log10(energy + 1e-12)
+
+    voiced = level > np.percentile(level, 90) - PAUSE_DROP
+    first, last = np.flatnonzero(voiced)[[0, -1]].tolist()
+    # voiced[first] and voiced[last] are set, so every fall pairs with a rise
+    edges = np.diff(voiced[first:last + 1].astype(np.int8))
+    starts = np.flatnonzero(edges < 0) + first + 1
+    ends = np.flatnonzero(edges > 0) + first + 1
+    keep = (ends - starts) * PAUSE_FRAME >= PAUSE_MIN
+    return {
+        'speech': [round(first * PAUSE_FRAME, 3), round((last + 1) * PAUSE_FRAME, 3)],
+        'pauses': [[round(s * PAUSE_FRAME, 3), round(e * PAUSE_FRAME, 3)]
+                   for s, e in zip(starts[keep].tolist(), ends[keep].tolist())],
+    }
+
+
+def envelopes(pcm, fps, rate=audio_pcm.SAMPLE_RATE, bands=ENVELOPE_BANDS):
+    """
+    float16 array (frames, 1 + bands) at fps: column 0 is the RMS level, the
+    rest the spectrum band levels, all in dB relative to full scale. One
+    reshape into video frames, one windowed rFFT over all of them.
+    """
+    hop = int(round(rate / fps))
+    count = -(-len(pcm) // hop)
+    mono = np.zeros(count * hop, dtype=np.float32)
+    mono[:len(pcm)] = pcm.mean(axis=1)
+    frames = mono.reshape(count, hop)
+    rms = np.einsum('ij,ij->i', frames, frames) / hop
+
+    # |X|^2 of a full-scale sine under a Hann window peaks at (hop / 4)^2
+    power = np.abs(np.fft.rfft(frames * np.hanning(hop).astype(np.float32), axis=1)) ** 2 / (hop / 4) ** 2
+    # bins per band, at least one each (the low bands are narrower than a bin)
+    steps = np.arange(bands + 1)
+    edges = (np.geomspace(*ENVELOPE_RANGE, bands + 1) * hop / rate).astype(int)
+    edges = np.maximum.accumulate(np.maximum(edges, 1) - steps) + steps
+    band_power = np.add.reduceat(power, edges[:-1], axis=1)
+
+    with np.errstate(divide='ignore'):
+        levels = 10 * np.log10(np.column_stack([2 * rms, band_power]) + 1e-10)
+    return levels.astype(np.float16)
+
+
+# entry field -> measurement over decoded PCM
+MEASURES = {'loudness': loudness, 'pauses': pauses}
+# entry field prefix naming an envelope file (ENVELOPE_FIELD + fps -> file name)
+ENVELOPE_FIELD = 'envelope_'
+
+
+def _envelope_files(entry):
+    return [value for field, value in entry.items() if field.startswith(ENVELOPE_FIELD)]
+
+
+def gain_db(stats, target=None):
+    """Linear gain (dB) that brings stats to target loudness without passing PEAK_CEILING."""
+    target = loudness_target() if target is None else target
+    if target is None or not stats or stats.get('lufs') is None:
+        return 0.0
+    gain = target - stats['lufs']
+    if stats.get('peak_db') is not None:
+        gain = min(gain, PEAK_CEILING - stats['peak_db'])
+    return round(gain, 2)
+
+
+def measure_all(measure, sources, workers=WORKERS):
+    """
+    [measure(source)] for sources, in order, on a thread pool: the decodes run
+    in ffmpeg and the NumPy work releases the GIL, so files overlap.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(measure, sources))
+
+
+class AnalysisCache:
+    def __init__(self, root):
+        self.root = str(root)
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+        # changes since the last flush, replayed onto the index on disk
+        self.added = set()   # keys measured here
+        self.removed = []    # match(key) functions of the keys dropped here
+        self.loaded = None  # mtime of the index file last merged
+        self.envelope_count = None  # counted once, at the first stats()
+        os.makedirs(self.root, exist_ok=True)
+        self._merge_disk()
+
+    def _merge_disk(self, replace=False):
+        """
+        Adds the entries / fields other processes wrote to the index file. With
+        replace (flush), keys gone from the file were dropped elsewhere and go
+        unless measured here. Call under self.lock (or in __init__).
+        """
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return []
+        self.loaded = mtime
+        if data.get('version') != INDEX_VERSION:
+            return []
+        if replace:
+            self.entries = {key: self.entries[key] for key in self.added if key in self.entries}
+        dropped = []
+        for key, fields in data.get('entries', {}).items():
+            if key not in self.added and any(match(key) for match in self.removed):
+                dropped += _envelope_files(fields)
+                continue
+            entry = self.entries.setdefault(key, {})
+            for field, value in fields.items():
+                entry.setdefault(field, value)
+        return dropped
+
+    def _changed_on_disk(self):
+        try:
+            return os.stat(self.index_path).st_mtime_ns != self.loaded
+        except OSError:
+            return False
+
+    def flush(self):
+        if not self.dirty:
+            return
+        with file_lock.FileLock(self.index_path + '.lock'):
+            with self.lock:
+                dropped = self._merge_disk(replace=True)
+                payload = json.dumps({'version': INDEX_VERSION, 'entries': self.entries}, separators=(',', ':'))
+                self.added.clear()
+                self.removed = []
+                self.dirty = False
+            tmp = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp, self.index_path)
+            self.loaded = os.stat(self.index_path).st_mtime_ns
+        self._remove_envelopes(dropped)
+
+    def _store(self, key, field, value):
+        with self.lock:
+            self.entries.setdefault(key, {})[field] = value
+            self.added.add(key)
+            self.dirty = True
+
+    def _drop(self, match):
+        """Drops the entries whose key match() accepts, here and (at flush) in the index file."""
+        with self.lock:
+            keys = [key for key in self.entries if match(key)]
+            files = []
+            for key in keys:
+                files += _envelope_files(self.entries.pop(key))
+                self.added.discard(key)
+            self.removed.append(match)
+            self.dirty = True
+        self._remove_envelopes(files)
+        return len(keys)
+
+    def _remove_envelopes(self, names):
+        removed = 0
+        for name in names:
+            try:
+                os.remove(os.path.join(self.root, 'envelopes', name))
+                removed += 1
+            except OSError:
+                pass
+        with self.lock:
+            if self.envelope_count is not None:
+                self.envelope_count = max(0, self.envelope_count - removed)
+
+    def forget(self, prefixes):
+        """Drops the entries of keys starting with any of prefixes (audio evicted, discarded or replaced)."""
+        prefixes = tuple(prefixes)
+        if prefixes:
+            self._drop(lambda key: key.startswith(prefixes))
+
+    def prune(self, stale):
+        """Drops the entries stale(keys) names: audio another process removed or repacked. Returns how many."""
+        with self.lock:
+            keys = list(self.entries)
+        dead = set(stale(keys))
+        if not dead:
+            return 0
+        self._drop(dead.__contains__)
+        print(f"[INFO] Audio analysis: dropped {len(dead)} entries of audio no longer stored")
+        return len(dead)
+
+    def analyse(self, source, pcm=None):
+        """Cached analysis entry of source; measurements it lacks are taken from one decode (or pcm)."""
+        key = audio_aac.source_id(source)
+        entry = self.entries.get(key, {})
+        missing = [field for field in MEASURES if field not in entry]
+        if missing and self._changed_on_disk():
+            # another process may have measured it since
+            with self.lock:
+                self._merge_disk()
+            entry = self.entries.get(key, {})
+            missing = [field for field in MEASURES if field not in entry]
+        if missing:
+            pcm = decode_pcm(source) if pcm is None else pcm
+            for field in missing:
+                self._store(key, field, MEASURES[field](pcm))
+            entry = self.entries[key]
+        return entry
+
+    def loudness(self, source, pcm=None):
+        """Cached loudness stats of source (measured on first use; pcm avoids a decode)."""
+        return self.analyse(source, pcm)['loudness']
+
+    def pauses(self, source):
+        """Cached pause map of source (see pauses()), or None when it cannot be analysed."""
+        try:
+            return self.analyse(source)['pauses']
+        except (OSError, RuntimeError) as e:
+            print(f"[WARN] Pause analysis failed for {source}: {e}")
+            return None
+
+    def gain(self, source, target=None):
+        """Normalization gain (dB) for source; 0 when it cannot be analysed."""
+        try:
+            return gain_db(self.loudness(source), target)
+        except (OSError, RuntimeError) as e:
+            print(f"[WARN] Loudness analysis failed for {source}: {e}")
+            return 0.0
+
+    def envelope(self, source, fps):
+        """Cached envelopes() of source at fps (computed on first use), or None."""
+        try:
+            key = audio_aac.source_id(source)
+        except OSError:
+            return None
+        name = hashlib.sha1(f"{key}:{fps}:{ENVELOPE_BANDS}".encode('utf-8')).hexdigest() + '.npy'
+        path = os.path.join(self.root, 'envelopes', name)
+        try:
+            return np.load(path)
+        except (OSError, ValueError):
+            pass
+        try:
+            data = envelopes(decode_pcm(source), fps)
+        except (OSError, RuntimeError) as e:
+            print(f"[WARN] Envelope analysis failed for {source}: {e}")
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp, path)
+        # recorded in the entry, so dropping the entry deletes the file too
+        self._store(key, f"{ENVELOPE_FIELD}{fps}", name)
+        with self.lock:
+            if self.envelope_count is not None:
+                self.envelope_count += 1
+        return data
+
+    def stats(self):
+        with self.lock:
+            if self.envelope_count is None:
+                try:
+                    self.envelope_count = len(os.listdir(os.path.join(self.root, 'envelopes')))
+                except OSError:
+                    self.envelope_count = 0
+            return {'files': len(self.entries), 'envelopes': self.envelope_count}
@@ -0,0 +1,375 @@
+"""
+Size-budgeted cache of downloaded ayah audio ({reciter}_{sss}_{aaa}.mp3 in AUDIO_DIR).
+
+- index.json in the cache directory records size, last access and SHA-256
+  per file; lookups answer from the index, without a stat() per ayah
+- files only enter the index after a complete write (temp file + rename,
+  see audio_fetch.fetch_to_file), so a truncated download is never a hit
+- byte budget (AUDIO_CACHE_MB) enforced by evicting least recently used files
+- pinned reciters / reciter+surah pairs (AUDIO_CACHE_PINS, e.g.
+  "alafasy,husary:18") are never evicted
+
+The first run without an index adopts the .mp3 files already in the directory
+whose frames run complete to the end (mp3_probe.is_complete); truncated
+leftovers of a crashed download are deleted.
+
+Other processes (warm_cache.py) may fill the same directory: a lookup that
+misses the index looks at the directory's mtime (at most once per
+RECHECK_SECONDS) and, when it changed, adopts the complete files not yet in
+the index. flush() merges this process's additions and removals into the
+index on disk under an inter-process lock instead of overwriting it.
+
+on_remove, when set, is called with the names of the files this process
+evicts, discards or overwrites (main.py drops their audio_analysis stats).
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+import file_lock
+import mp3_probe
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+BUDGET_ENV = 'AUDIO_CACHE_MB'
+PINS_ENV = 'AUDIO_CACHE_PINS'
+DEFAULT_BUDGET_MB = 4096
+RECHECK_SECONDS = 5  # how often an index miss looks at the directory for other processes' files
+
+
+def audio_name(reciter, surah, ayah):
+    return f"{reciter}_{int(surah):03d}_{int(ayah):03d}.mp3"
+
+
+def parse_name(name):
+    """(reciter, surah, ayah) from a cache file name, or None."""
+    if not name.endswith('.mp3'):
+        return None
+    parts = name[:-4].rsplit('_', 2)
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+        return None
+    return parts[0], int(parts[1]), int(parts[2])
+
+
+def parse_pins(spec):
+    """'alafasy,husary:18' -> {('alafasy', None), ('husary', 18)}"""
+    pins = set()
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        reciter, _, surah = item.partition(':')
+        pins.add((reciter, int(surah) if surah else None))
+    return pins
+
+
+def complete_entry(path):
+    """Index entry of an MP3 whose frames run complete to the end, else None. Raises OSError."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data or not mp3_probe.is_complete(data):
+        return None
+    return {'size': len(data), 'atime': os.path.getmtime(path), 'sha256': hashlib.sha256(data).hexdigest()}
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class AudioCache:
+    def __init__(self, root, max_bytes=None, pins=None):
+        self.root = str(root)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.pins = parse_pins(os.environ.get(PINS_ENV)) if pins is None else set(pins)
+        self.index_path = os.path.join(self.root, INDEX_NAME)
+        self.lock = threading.Lock()
+
+        self.entries = {}  # file name -> {'size', 'atime', 'sha256'}
+        self.total_bytes = 0
+        self.dirty = False
+        # changes since the last flush, replayed onto the index on disk
+        self.added = set()
+        self.removed = set()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.dir_mtime = None  # directory mtime when its files were last compared with the index
+        self.checked = float('-inf')
+        self.on_remove = None  # called with the names of evicted / discarded / replaced files
+
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    # --- index ---
+
+    def _read_index(self):
+        """Entries of the index on disk, or None when there is no valid one."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != INDEX_VERSION:
+                return None
+            return data['entries']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _load_index(self):
+        entries = self._read_index()
+        if entries is None:
+            self.rescan()
+        else:
+            self.entries = entries
+        self.total_bytes = sum(e['size'] for e in self.entries.values())
+
+    def rescan(self):
+        """Rebuilds the index from the directory (deletes partial and truncated downloads)."""
+        entries = {}
+        dropped = 0
+        for item in os.scandir(self.root):
+            if item.name.endswith('.part'):
+                _remove(item.path)
+                continue
+            if not item.is_file() or not parse_name(item.name):
+                continue
+            try:
+                entry = complete_entry(item.path)
+            except OSError:
+                continue
+            if entry:
+                entries[item.name] = entry
+            else:
+                _remove(item.path)
+                dropped += 1
+        if dropped:
+            print(f"[WARN] Audio cache: deleted {dropped} truncated files")
+        with self.lock:
+            self.entries = entries
+            self.total_bytes = sum(e['size'] for e in entries.values())
+            self.added, self.removed = set(entries), set()
+            self.dirty = True
+        print(f"[INFO] Audio cache index rebuilt: {len(entries)} files")
+
+    def _merge(self, disk):
+        """Index on disk + this process's changes since the last flush. Call under self.lock."""
+        merged = {}
+        for name, entry in disk.items():
+            if name in self.removed:
+                continue
+            mine = self.entries.get(name)
+            if mine:
+                entry = dict(mine, atime=max(mine['atime'], entry['atime']),
+                             sha256=mine['sha256'] or entry['sha256'])
+            merged[name] = entry
+        # entries missing from disk were removed by another process, unless added here
+        for name in self.added:
+            if name in self.entries:
+                merged[name] = self.entries[name]
+        self.entries = merged
+        self.total_bytes = sum(e['size'] for e in merged.values())
+        self._evict()
+
+    def flush(self):
+        """Persists the index (sizes, last access, hashes), merged with other processes' changes."""
+        if not self.dirty:
+            return
+        with file_lock.FileLock(self.index_path + '.lock'):
+            disk = self._read_index()
+            with self.lock:
+                if disk is not None:
+                    self._merge(disk)
+                payload = json.dumps({'version': INDEX_VERSION, 'entries': self.entries}, separators=(',', ':'))
+                self.added.clear()
+                self.removed.clear()
+                self.dirty = False
+            tmp = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp, self.index_path)
+
+    # --- lookups ---
+
+    def path_for(self, reciter, surah, ayah):
+        return os.path.join(self.root, audio_name(reciter, surah, ayah))
+
+    def _adopt(self, name):
+        """
+        After an index miss: indexes the complete files other processes wrote
+        since the directory was last looked at. True if name is one of them.
+        Stats the directory at most once per RECHECK_SECONDS and lists it only
+        when its mtime changed.
+        """
+        now = time.monotonic()
+        if now - self.checked < RECHECK_SECONDS:
+            return False
+        self.checked = now
+        try:
+            mtime = os.stat(self.root).st_mtime_ns
+            if mtime == self.dir_mtime:
+                return False
+            self.dir_mtime = mtime
+            names = [n for n in os.listdir(self.root) if parse_name(n) and n not in self.entries]
+        except OSError:
+            return False
+        for new in names:
+            path = os.path.join(self.root, new)
+            try:
+                entry = complete_entry(path)
+            except OSError:
+                continue
+            if entry is None:
+                continue  # truncated: left for rescan(), another process may still own it
+            entry['atime'] = time.time()
+            with self.lock:
+                if new not in self.entries:
+                    self.entries[new] = entry
+                    self.total_bytes += entry['size']
+                    self.added.add(new)
+                    self.removed.discard(new)
+                    self.dirty = True
+        return name in self.entries
+
+    def lookup(self, reciter, surah, ayah):
+        """Path of a complete cached file, or None. Answered from the index (the disk only on a miss)."""
+        name = audio_name(reciter, surah, ayah)
+        if name not in self.entries and not self._adopt(name):
+            with self.lock:
+                self.counters['misses'] += 1
+            return None
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            entry['atime'] = time.time()
+            self.dirty = True
+            self.counters['hits'] += 1
+        return os.path.join(self.root, name)
+
+    def contains(self, reciter, surah, ayah):
+        """Like lookup() but does not count as an access."""
+        name = audio_name(reciter, surah, ayah)
+        return name in self.entries or self._adopt(name)
+
+    # --- updates ---
+
+    def record(self, reciter, surah, ayah):
+        """Adds a file that was just written (atomically) to its final path. Returns the path."""
+        name = audio_name(reciter, surah, ayah)
+        path = os.path.join(self.root, name)
+        size = os.path.getsize(path)
+        digest = file_sha256(path)
+        with self.lock:
+            old = self.entries.get(name)
+            if old:
+                self.total_bytes -= old['size']
+            self.entries[name] = {'size': size, 'atime': time.time(), 'sha256': digest}
+            self.total_bytes += size
+            self.added.add(name)
+            self.removed.discard(name)
+            self.dirty = True
+            self._evict(keep=name)
+        if old:
+            self._notify([name])
+        return path
+
+    def discard(self, reciter, surah, ayah):
+        """Drops a file from the cache (e.g. found corrupt)."""
+        name = audio_name(reciter, surah, ayah)
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry:
+                self.total_bytes -= entry['size']
+                self.dirty = True
+            self.added.discard(name)
+            self.removed.add(name)
+        try:
+            os.remove(os.path.join(self.root, name))
+        except OSError:
+            pass
+        self._notify([name])
+
+    def _notify(self, names):
+        if names and self.on_remove:
+            self.on_remove(names)
+
+    def verify(self, reciter, surah, ayah):
+        """Re-hashes a cached file against the index (filling in a missing hash). False drops it."""
+        name = audio_name(reciter, surah, ayah)
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        try:
+            digest = file_sha256(os.path.join(self.root, name))
+        except OSError:
+            digest = None
+        if digest is None or (entry['sha256'] and entry['sha256'] != digest):
+            self.discard(reciter, surah, ayah)
+            return False
+        if not entry['sha256']:
+            with self.lock:
+                entry['sha256'] = digest
+                self.dirty = True
+        return True
+
+    # --- pins / eviction ---
+
+    def pin(self, reciter, surah=None):
+        with self.lock:
+            self.pins.add((reciter, surah))
+
+    def unpin(self, reciter, surah=None):
+        with self.lock:
+            self.pins.discard((reciter, surah))
+
+    def is_pinned(self, name):
+        parsed = parse_name(name)
+        if not parsed:
+            return False
+        reciter, surah, _ = parsed
+        return (reciter, None) in self.pins or (reciter, surah) in self.pins
+
+    def _evict(self, keep=None):
+        if self.total_bytes <= self.max_bytes:
+            return
+        evicted = []
+        for name in sorted(self.entries, key=lambda n: self.entries[n]['atime']):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if name == keep or self.is_pinned(name):
+                continue
+            entry = self.entries.pop(name)
+            self.total_bytes -= entry['size']
+            self.added.discard(name)
+            self.removed.add(name)
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                pass
+            evicted.append(name)
+            self.counters['evictions'] += 1
+        self.dirty = True
+        self._notify(evicted)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({
+                'files': len(self.entries),
+                'bytes': self.total_bytes,
+                'budget': self.max_bytes,
+                'pins': sorted(f"{r}:{s}" if s else r for r, s in self.pins),
+            })
+            return stats
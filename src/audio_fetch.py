@@ -0,0 +1,225 @@
+"""
+HTTP fetching for ayah audio.
+
+- one requests.Session per process with a keep-alive connection pool per
+  host, so a 286-ayah surah reuses a handful of TLS connections
+- bodies are streamed to a temp file and renamed into place
+- transient failures (timeouts, connection errors, 429/5xx) are retried with
+  jittered exponential backoff; a 404 is final, the caller moves on to the
+  next reciter in its fallback chain
+- a per-host circuit breaker: after BREAKER_THRESHOLD consecutive transient
+  failures a host is skipped for BREAKER_COOLDOWN seconds (then one trial
+  request decides), instead of every ayah waiting out its own timeouts
+- prefetch() runs a per-item resolver over a bounded thread pool and returns
+  results in input order; as_resolved() yields them as they complete
+"""
+import os
+import time
+import random
+import threading
+import concurrent.futures
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+WORKERS_ENV = 'AUDIO_WORKERS'
+DEFAULT_WORKERS = 8
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5   # seconds
+BACKOFF_CAP = 8.0
+TIMEOUT = (5, 30)    # connect, read
+CHUNK_SIZE = 64 * 1024
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0  # seconds
+
+# fetch() / head() outcomes
+OK = 'ok'
+MISSING = 'missing'            # 404 / too small: the mirror does not have it
+FAILED = 'failed'              # transient errors outlasted the retries
+CIRCUIT_OPEN = 'circuit_open'  # host skipped by its circuit breaker
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def default_workers():
+    return max(1, int(os.environ.get(WORKERS_ENV, DEFAULT_WORKERS)))
+
+
+def get_session():
+    """Shared session; the adapter pool holds enough keep-alive connections for every worker."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(default_workers(), 10))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker per host: closed -> open (cooldown) -> one trial."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.hosts = {}  # host -> {'failures', 'open_until', 'trial'}
+
+    def allow(self, host):
+        with self.lock:
+            state = self.hosts.get(host)
+            if not state or state['failures'] < self.threshold:
+                return True
+            if time.monotonic() < state['open_until'] or state['trial']:
+                return False
+            state['trial'] = True  # half-open: let one request through
+            return True
+
+    def record(self, host, ok):
+        with self.lock:
+            state = self.hosts.setdefault(host, {'failures': 0, 'open_until': 0.0, 'trial': False})
+            state['trial'] = False
+            if ok:
+                state['failures'] = 0
+                return
+            state['failures'] += 1
+            if state['failures'] >= self.threshold:
+                if state['failures'] == self.threshold:
+                    print(f"[WARN] {host}: {self.threshold} failures in a row, skipping it for {self.cooldown:.0f}s")
+                state['open_until'] = time.monotonic() + self.cooldown
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                host: {'failures': state['failures'], 'open': state['failures'] >= self.threshold and now < state['open_until']}
+                for host, state in self.hosts.items()
+            }
+
+
+breaker = CircuitBreaker()
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """'Full jitter' exponential backoff: uniform in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def fetch(url, dest, min_bytes=1000, retries=MAX_RETRIES):
+    """
+    Streams url into dest atomically. Returns OK, MISSING (404 or fewer than
+    min_bytes), FAILED (after the last retry) or CIRCUIT_OPEN.
+    """
+    dest = str(dest)
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.part"
+    session = get_session()
+    host = urlsplit(url).netloc
+
+    for attempt in range(retries):
+        if not breaker.allow(host):
+            return CIRCUIT_OPEN
+        try:
+            with session.get(url, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code != 200:
+                    # read the (small) error body so the connection goes back to the pool
+                    response.content
+                    if response.status_code in RETRY_STATUS:
+                        raise requests.HTTPError(f"HTTP {response.status_code}")
+                    breaker.record(host, True)
+                    return MISSING
+
+                written = 0
+                with open(tmp, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        written += len(chunk)
+
+            breaker.record(host, True)
+            if written < min_bytes:
+                os.remove(tmp)
+                return MISSING
+            os.replace(tmp, dest)
+            return OK
+
+        except (requests.RequestException, OSError) as e:
+            if isinstance(e, requests.RequestException):  # not local disk errors
+                breaker.record(host, False)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            if attempt == retries - 1:
+                print(f"  ✗ {url}: {e}")
+                return FAILED
+            delay = backoff_delay(attempt)
+            print(f"  Attempt {attempt + 1} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+    return FAILED
+
+
+def fetch_to_file(url, dest, min_bytes=1000, retries=MAX_RETRIES):
+    """fetch() as a bool: True only when dest was written."""
+    return fetch(url, dest, min_bytes, retries) == OK
+
+
+def head(url, retries=MAX_RETRIES):
+    """Existence check over the shared session: OK, MISSING, FAILED or CIRCUIT_OPEN."""
+    session = get_session()
+    host = urlsplit(url).netloc
+    for attempt in range(retries):
+        if not breaker.allow(host):
+            return CIRCUIT_OPEN
+        try:
+            response = session.head(url, timeout=TIMEOUT, allow_redirects=True)
+            if response.status_code in RETRY_STATUS:
+                raise requests.HTTPError(f"HTTP {response.status_code}")
+            breaker.record(host, True)
+            return OK if response.status_code == 200 else MISSING
+        except requests.RequestException as e:
+            breaker.record(host, False)
+            if attempt == retries - 1:
+                print(f"  ✗ HEAD {url}: {e}")
+                return FAILED
+            time.sleep(backoff_delay(attempt))
+    return FAILED
+
+
+def as_resolved(items, resolve, workers=None):
+    """
+    resolve(item) for every item on a bounded thread pool; yields (index, result)
+    in completion order (result None when resolve raised).
+    """
+    items = list(items)
+    if not items:
+        return
+    workers = min(workers or default_workers(), len(items))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(resolve, item): i for i, item in enumerate(items)}
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                yield i, future.result()
+            except Exception as e:
+                print(f"  ✗ Prefetch failed for item {i + 1}: {e}")
+                yield i, None
+
+
+def prefetch(items, resolve, workers=None, progress=None):
+    """
+    resolve(item) for every item on a bounded thread pool.
+    Returns the results in input order; progress(done, total) after each one.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    for done, (i, result) in enumerate(as_resolved(items, resolve, workers), 1):
+        results[i] = result
+        if progress:
+            progress(done, len(items))
+    return results
@@ -0,0 +1,214 @@
+"""
+Per-reciter availability manifest for the audio fallback chain.
+
+For every reciter, a bitmap over all ayahs of the Quran (global ayah index
+from quran_provider) marks ayahs known to exist upstream, and a table of
+ayah -> time of the last 404 marks ayahs known to be missing. Missing marks
+expire after AUDIO_NEGATIVE_TTL seconds (default one day), so an upload on
+the mirror is picked up eventually; available marks do not expire.
+
+Filled from completed downloads, 404s, and HEAD probes (probe(), /validate).
+The fallback resolver (viable()) tries reciters known to be missing an ayah
+last instead of paying a request for them on every reel, and when the
+requested reciter fails goes straight to a fallback known to have the ayah.
+
+Persisted as JSON (bitmaps base64-encoded) with a temp file + rename. Other
+processes (warm_cache.py) update the same file: flush() re-reads it under an
+inter-process lock and replays this process's marks since the last flush on
+top, and an unknown state re-reads the file first when it changed on disk.
+"""
+import os
+import json
+import time
+import base64
+import threading
+
+import file_lock
+import quran_provider
+
+MANIFEST_VERSION = 1
+NEGATIVE_TTL_ENV = 'AUDIO_NEGATIVE_TTL'
+DEFAULT_NEGATIVE_TTL = 24 * 3600
+RECHECK_SECONDS = 5  # how often an unknown state looks at the file for other processes' marks
+
+
+class AvailabilityManifest:
+    def __init__(self, path, negative_ttl=None):
+        self.path = str(path)
+        if negative_ttl is None:
+            negative_ttl = int(os.environ.get(NEGATIVE_TTL_ENV, DEFAULT_NEGATIVE_TTL))
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.available = {}  # reciter -> bytearray bitmap
+        self.missing = {}    # reciter -> {ayah index: time of last 404}
+        self.pending = []    # (mark, reciter, index, time) since the last flush
+        self.loaded = None   # mtime of the file last loaded
+        self.checked = float('-inf')  # when the file's mtime was last compared with it
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        """Replaces the in-memory state with the file's, plus the pending marks. Call under self.lock (or in __init__)."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.loaded = mtime
+            if data.get('version') != MANIFEST_VERSION:
+                return
+            available, missing = {}, {}
+            for reciter, entry in data['reciters'].items():
+                available[reciter] = bytearray(base64.b64decode(entry['available']))
+                missing[reciter] = {int(k): v for k, v in entry['missing'].items()}
+        except (OSError, ValueError, KeyError):
+            return
+        self.available, self.missing = available, missing
+        for mark in self.pending:
+            self._apply(*mark)
+
+    def _changed_on_disk(self):
+        """True when the file changed since it was loaded (looked at once per RECHECK_SECONDS)."""
+        now = time.monotonic()
+        if now - self.checked < RECHECK_SECONDS:
+            return False
+        self.checked = now
+        try:
+            return os.stat(self.path).st_mtime_ns != self.loaded
+        except OSError:
+            return False
+
+    def flush(self):
+        if not self.dirty:
+            return
+        with file_lock.FileLock(self.path + '.lock'):
+            with self.lock:
+                self._load()
+                self.pending = []
+                self.dirty = False
+                payload = self._serialize()
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+            self.loaded = os.stat(self.path).st_mtime_ns
+
+    def _serialize(self):
+        reciters = {
+            reciter: {
+                'available': base64.b64encode(bytes(self.available.get(reciter, b''))).decode('ascii'),
+                'missing': {str(k): v for k, v in self.missing.get(reciter, {}).items()},
+            }
+            for reciter in set(self.available) | set(self.missing)
+        }
+        return json.dumps({'version': MANIFEST_VERSION, 'reciters': reciters}, separators=(',', ':'))
+
+    def _bitmap(self, reciter):
+        bitmap = self.available.get(reciter)
+        if not bitmap:  # none yet, or saved empty for a reciter with only 404s
+            bitmap = self.available[reciter] = bytearray((quran_provider.total_ayahs() + 7) // 8)
+        return bitmap
+
+    def _state(self, reciter, index):
+        bitmap = self.available.get(reciter)
+        if bitmap and bitmap[index >> 3] & (1 << (index & 7)):
+            return True
+        checked = self.missing.get(reciter, {}).get(index)
+        if checked is not None and time.time() - checked < self.negative_ttl:
+            return False
+        return None
+
+    def state(self, reciter, surah, ayah):
+        """True (known available), False (404 within the TTL) or None (unknown)."""
+        index = quran_provider.ayah_index(surah, ayah)
+        if index is None:
+            return None
+        state = self._state(reciter, index)
+        if state is None and self._changed_on_disk():
+            # another process may have checked it since
+            with self.lock:
+                self._load()
+            state = self._state(reciter, index)
+        return state
+
+    def known_missing(self, reciter, surah, ayah):
+        return self.state(reciter, surah, ayah) is False
+
+    def _apply(self, mark, reciter, index, when):
+        """Records one mark in memory. True if it changed anything. Call under self.lock."""
+        if mark == 'available':
+            bitmap = self._bitmap(reciter)
+            changed = not bitmap[index >> 3] & (1 << (index & 7))
+            bitmap[index >> 3] |= 1 << (index & 7)
+            return self.missing.get(reciter, {}).pop(index, None) is not None or changed
+        bitmap = self.available.get(reciter)
+        if bitmap:
+            bitmap[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+        self.missing.setdefault(reciter, {})[index] = when
+        return True
+
+    def _mark(self, mark, reciter, surah, ayah):
+        index = quran_provider.ayah_index(surah, ayah)
+        if index is None:
+            return
+        with self.lock:
+            change = (mark, reciter, index, time.time())
+            if self._apply(*change):
+                self.pending.append(change)
+                self.dirty = True
+
+    def mark_available(self, reciter, surah, ayah):
+        self._mark('available', reciter, surah, ayah)
+
+    def mark_missing(self, reciter, surah, ayah):
+        self._mark('missing', reciter, surah, ayah)
+
+    def viable(self, chain, surah, ayah):
+        """
+        The fallback chain in the order to try it for an ayah: the requested
+        reciter (chain[0]), then fallbacks known to have the ayah, then the
+        unknown ones, and last the reciters known to be missing it - a stale
+        404 mark must not leave an ayah without any reciter to try.
+        """
+        states = {reciter: self.state(reciter, surah, ayah) for reciter in chain}
+
+        def rank(position):
+            state = states[chain[position]]
+            if state is False:
+                return 3
+            return 0 if position == 0 else (1 if state else 2)
+
+        return [chain[i] for i in sorted(range(len(chain)), key=rank)]
+
+    def probe(self, reciter, ayahs, url_for, workers=None):
+        """
+        HEADs every (surah, ayah) of reciter whose state is unknown and records
+        the answers. url_for(surah, ayah) builds the URL. Returns {state: count}.
+        """
+        import audio_fetch
+
+        todo = [(s, a) for s, a in ayahs if self.state(reciter, s, a) is None]
+
+        def check(key):
+            status = audio_fetch.head(url_for(*key))
+            if status == audio_fetch.OK:
+                self.mark_available(reciter, *key)
+            elif status == audio_fetch.MISSING:
+                self.mark_missing(reciter, *key)
+            return status
+
+        counts = {}
+        for status in audio_fetch.prefetch(todo, check, workers=workers):
+            counts[status] = counts.get(status, 0) + 1
+        self.flush()
+        return counts
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {
+                reciter: {
+                    'available': sum(bin(b).count('1') for b in self.available.get(reciter, b'')),
+                    'missing': sum(1 for t in self.missing.get(reciter, {}).values() if now - t < self.negative_ttl),
+                }
+                for reciter in sorted(set(self.available) | set(self.missing))
+            }
@@ -0,0 +1,434 @@
+"""
+Packed ayah audio store: one append-only pack file per reciter instead of one
+small MP3 per ayah.
+
+    {reciter}.{gen}.idx     header + one fixed-size slot per ayah of the Quran
+                            (global ayah index from quran_provider), mmapped
+    {reciter}.{gen}.pack    the MP3s back to back
+    {reciter}.lock          inter-process lock for appends and compaction
+
+A slot holds (offset, length) into the pack; length 0 means not stored. Data
+is appended to the pack before its slot is written, so a crash never leaves a
+slot pointing at bytes that are not there. Replacing an ayah appends a new
+copy; compact() rewrites the live bytes into the next generation's pack and
+index, then marks the old index as retired.
+
+Several processes may share a store (the server, warm_cache.py, the import
+CLI): appends take the slot offset from the pack's real end while holding
+{reciter}.lock, and every access first checks the mmapped header for a newer
+generation, reopening the current files when compact() retired its own.
+Retired files are deleted once no process has them open (best effort, as
+Windows refuses to delete open files) and RETIRE_SECONDS after compact()
+retired them: a render may still be reading an ayah through a spec handed
+out from the old generation.
+
+Every index carries a random id of its generation, so a spec (path + byte
+range) is tied to the content it addressed: spec_id() tells a re-imported
+{reciter}.0.pack from the one it replaced.
+
+ffmpeg reads an ayah in place through the subfile protocol
+("subfile,,start,N,end,M,,:path"), see input_spec(); read_spec() returns the
+bytes for in-process consumers (duration probing).
+
+CLI: python audio_pack.py import [--remove] | compact | stats
+"""
+import os
+import time
+import mmap
+import struct
+import threading
+
+import quran_provider
+import file_lock
+
+# Index layout (little-endian):
+#   header : magic, version, slot count, pack generation (of a retired
+#            index: the generation that replaced it), random generation id
+#   slots  : slot count x (uint64 offset, uint32 length)
+_MAGIC = b'QRAP'
+_VERSION = 3
+_HEADER = struct.Struct('<4sIIIQ')
+_SLOT = struct.Struct('<QI')
+
+SPEC_PREFIX = 'subfile,,'
+RECHECK_SECONDS = 10  # how long a reciter without a pack is assumed to still have none
+RETIRE_SECONDS = 3600  # how long a retired generation is kept for renders still reading it
+
+
+def input_spec(path, offset, length):
+    """ffmpeg input for length bytes at offset of path (end is exclusive)."""
+    return f"{SPEC_PREFIX}start,{offset},end,{offset + length},,:{path}"
+
+
+def is_spec(audio):
+    return isinstance(audio, str) and audio.startswith(SPEC_PREFIX)
+
+
+def spec_path(spec):
+    """Pack file an input_spec() string reads from."""
+    return spec[len(SPEC_PREFIX):].partition(',,:')[2]
+
+
+def read_spec(spec):
+    """Bytes addressed by an input_spec() string."""
+    options, _, path = spec[len(SPEC_PREFIX):].partition(',,:')
+    fields = options.split(',')
+    values = dict(zip(fields[::2], fields[1::2]))
+    start, end = int(values['start']), int(values['end'])
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def spec_id(spec):
+    """Content identity of an input_spec(): the spec plus its pack generation's random id. Raises OSError."""
+    path = spec_path(spec)
+    with open(path[:-len('pack')] + 'idx', 'rb') as f:
+        header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise OSError(f"truncated audio pack index for {path}")
+    return f"{spec}:{_HEADER.unpack(header)[4]:016x}"
+
+
+def parse_name(name):
+    """'alafasy.3.pack' -> ('alafasy', 3, 'pack'), or None for other files."""
+    parts = name.rsplit('.', 2)
+    if len(parts) != 3 or parts[2] not in ('idx', 'pack') or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1]), parts[2]
+
+
+class AudioPack:
+    """The pack + index of one reciter."""
+
+    def __init__(self, root, reciter, create=False):
+        self.root = str(root)
+        self.reciter = reciter
+        self.lock = threading.Lock()
+        self.file_lock = file_lock.FileLock(os.path.join(self.root, f"{reciter}.lock"))
+
+        generation = self._latest_generation()
+        if generation is None:
+            if not create:
+                raise FileNotFoundError(os.path.join(self.root, f"{reciter}.*.idx"))
+            with self.file_lock:
+                generation = self._latest_generation()
+                if generation is None:
+                    generation = 0
+                    self._write_index(generation, bytes(_SLOT.size * quran_provider.total_ayahs()))
+        self._open(generation)
+
+    def _path(self, generation, kind):
+        return os.path.join(self.root, f"{self.reciter}.{generation}.{kind}")
+
+    def _generations(self):
+        """{generation: {'idx', 'pack'} files present} of this reciter."""
+        found = {}
+        for name in os.listdir(self.root):
+            parsed = parse_name(name)
+            if parsed and parsed[0] == self.reciter:
+                found.setdefault(parsed[1], set()).add(parsed[2])
+        return found
+
+    def _latest_generation(self):
+        indexed = [gen for gen, kinds in self._generations().items() if 'idx' in kinds]
+        return max(indexed) if indexed else None
+
+    def _write_index(self, generation, slots):
+        path = self._path(generation, 'idx')
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(slots) // _SLOT.size, generation,
+                                 int.from_bytes(os.urandom(8), 'little')))
+            f.write(slots)
+        os.replace(tmp, path)
+
+    def _open(self, generation):
+        self.index_path = self._path(generation, 'idx')
+        with open(self.index_path, 'r+b') as f:
+            self.index = mmap.mmap(f.fileno(), 0)
+        magic, version, self.slots, self.generation, _ = _HEADER.unpack_from(self.index, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.index.close()
+            raise ValueError(f"{self.index_path} is not an audio pack index")
+        self.pack_path = self._path(self.generation, 'pack')
+        self.pack = open(self.pack_path, 'a+b')
+        # running totals for stats(), counted once per generation
+        entries = self.live()
+        self.ayahs = len(entries)
+        self.live_bytes = sum(length for _, _, length in entries)
+        self._remove_retired()
+
+    def _remove_retired(self):
+        """Deletes older generations retired more than RETIRE_SECONDS ago (their index mtime)."""
+        for generation, kinds in self._generations().items():
+            if generation >= self.generation:
+                continue
+            try:
+                retired = max(os.path.getmtime(self._path(generation, kind)) for kind in kinds)
+            except OSError:
+                continue
+            if time.time() - retired < RETIRE_SECONDS:
+                continue  # specs from it may still be in a render's ffmpeg inputs
+            for kind in kinds:
+                try:
+                    os.remove(self._path(generation, kind))
+                except OSError:
+                    pass  # still open in another process (Windows); removed by a later open
+
+    def _refresh(self):
+        """Switches to the current generation if compact() (in any process) retired ours. Call under self.lock."""
+        generation = _HEADER.unpack_from(self.index, 0)[3]
+        if generation != self.generation:
+            self.close()
+            self._open(generation)
+
+    def close(self):
+        self.index.close()
+        self.pack.close()
+
+    def _slot_offset(self, surah, ayah):
+        index = quran_provider.ayah_index(surah, ayah)
+        if index is None or index >= self.slots:
+            return None
+        return _HEADER.size + index * _SLOT.size
+
+    def _locate(self, surah, ayah):
+        pos = self._slot_offset(surah, ayah)
+        if pos is None:
+            return None
+        offset, length = _SLOT.unpack_from(self.index, pos)
+        return (offset, length) if length else None
+
+    def locate(self, surah, ayah):
+        """(offset, length) in the pack, or None when the ayah is not stored."""
+        with self.lock:
+            self._refresh()
+            return self._locate(surah, ayah)
+
+    def spec(self, surah, ayah):
+        with self.lock:
+            self._refresh()
+            located = self._locate(surah, ayah)
+            return input_spec(self.pack_path, *located) if located else None
+
+    def read(self, surah, ayah):
+        with self.lock:
+            self._refresh()
+            located = self._locate(surah, ayah)
+            if not located:
+                return None
+            offset, length = located
+            self.pack.seek(offset)
+            return self.pack.read(length)
+
+    def put(self, surah, ayah, data):
+        """Appends one ayah's MP3 bytes and points its slot at them. Returns its input spec."""
+        pos = self._slot_offset(surah, ayah)
+        if pos is None:
+            raise ValueError(f"Unknown ayah {surah}:{ayah}")
+        with self.lock, self.file_lock:
+            self._refresh()
+            # the real end of the pack: other processes append to it too
+            offset = self.pack.seek(0, os.SEEK_END)
+            self.pack.write(data)
+            self.pack.flush()
+            self._count(pos, len(data))
+            _SLOT.pack_into(self.index, pos, offset, len(data))
+            return input_spec(self.pack_path, offset, len(data))
+
+    def discard(self, surah, ayah):
+        """Empties an ayah's slot (e.g. found corrupt); compact() reclaims its bytes."""
+        pos = self._slot_offset(surah, ayah)
+        if pos is None:
+            return
+        with self.lock, self.file_lock:
+            self._refresh()
+            self._count(pos, 0)
+            _SLOT.pack_into(self.index, pos, 0, 0)
+
+    def _count(self, pos, length):
+        """Updates the running totals for the slot at pos becoming length bytes long. Call under self.lock."""
+        old = _SLOT.unpack_from(self.index, pos)[1]
+        self.ayahs += bool(length) - bool(old)
+        self.live_bytes += length - old
+
+    def live(self):
+        """[(slot, offset, length)] of stored ayahs."""
+        entries = []
+        for slot in range(self.slots):
+            offset, length = _SLOT.unpack_from(self.index, _HEADER.size + slot * _SLOT.size)
+            if length:
+                entries.append((slot, offset, length))
+        return entries
+
+    def compact(self):
+        """Rewrites the live ayahs into a new pack generation. Returns bytes reclaimed."""
+        with self.lock, self.file_lock:
+            self._refresh()
+            entries = self.live()
+            generation = self.generation + 1
+            slots = bytearray(_SLOT.size * self.slots)
+            offset = 0
+            with open(self._path(generation, 'pack'), 'wb') as out:
+                for slot, old_offset, length in sorted(entries):
+                    self.pack.seek(old_offset)
+                    out.write(self.pack.read(length))
+                    _SLOT.pack_into(slots, slot * _SLOT.size, offset, length)
+                    offset += length
+                out.flush()
+                os.fsync(out.fileno())
+            reclaimed = self.pack.seek(0, os.SEEK_END) - offset
+
+            # the new index is the commit point; then every process holding the
+            # old one (this one included) is told to move on
+            self._write_index(generation, bytes(slots))
+            _, _, _, _, nonce = _HEADER.unpack_from(self.index, 0)
+            _HEADER.pack_into(self.index, 0, _MAGIC, _VERSION, self.slots, generation, nonce)
+            self.index.flush()
+            os.utime(self.index_path)  # start of its RETIRE_SECONDS grace period
+            self._refresh()
+            return reclaimed
+
+    def flush(self):
+        with self.lock:
+            self.pack.flush()
+            self.index.flush()
+
+    def stats(self):
+        """Running totals (ayahs stored by other processes show up after the next compaction)."""
+        with self.lock:
+            self._refresh()
+            return {
+                'ayahs': self.ayahs,
+                'pack_bytes': os.fstat(self.pack.fileno()).st_size,
+                'live_bytes': self.live_bytes,
+            }
+
+
+class PackStore:
+    """All reciters' packs under one directory, opened on first use."""
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.packs = {}   # reciter -> AudioPack, or None when it has no pack yet
+        self.checked = {}  # reciter -> when a missing pack was last looked for
+        self.lock = threading.Lock()
+        self.on_remove = None  # called with the specs of discarded ayahs
+        os.makedirs(self.root, exist_ok=True)
+        self.known = set(self.reciters())  # reciters with a pack (scanned once)
+
+    def pack(self, reciter, create=False):
+        with self.lock:
+            pack = self.packs.get(reciter)
+            # another process may have created the pack since it was last looked for
+            stale = time.monotonic() - self.checked.get(reciter, float('-inf')) > RECHECK_SECONDS
+            if pack is None and (create or stale):
+                self.checked[reciter] = time.monotonic()
+                try:
+                    pack = AudioPack(self.root, reciter, create=create)
+                except FileNotFoundError:
+                    pack = None
+                self.packs[reciter] = pack
+                if pack:
+                    self.known.add(reciter)
+            return pack
+
+    def lookup(self, reciter, surah, ayah):
+        """ffmpeg input spec for a stored ayah, or None."""
+        pack = self.pack(reciter)
+        return pack.spec(surah, ayah) if pack else None
+
+    def contains(self, reciter, surah, ayah):
+        pack = self.pack(reciter)
+        return bool(pack and pack.locate(surah, ayah))
+
+    def put(self, reciter, surah, ayah, data):
+        return self.pack(reciter, create=True).put(surah, ayah, data)
+
+    def discard(self, reciter, surah, ayah):
+        pack = self.pack(reciter)
+        if not pack:
+            return
+        spec = pack.spec(surah, ayah)
+        pack.discard(surah, ayah)
+        if spec and self.on_remove:
+            self.on_remove([spec])
+
+    def put_file(self, reciter, surah, ayah, path, remove=True):
+        """Moves a downloaded file into the pack. Returns its input spec."""
+        with open(path, 'rb') as f:
+            spec = self.put(reciter, surah, ayah, f.read())
+        if remove:
+            os.remove(path)
+        return spec
+
+    def reciters(self):
+        parsed = (parse_name(name) for name in os.listdir(self.root))
+        return sorted({p[0] for p in parsed if p and p[2] == 'idx'})
+
+    def flush(self):
+        for pack in list(self.packs.values()):
+            if pack:
+                pack.flush()
+
+    def stats(self):
+        stats = {'reciters': 0, 'ayahs': 0, 'pack_bytes': 0, 'live_bytes': 0}
+        for reciter in sorted(self.known):
+            pack = self.pack(reciter)
+            if not pack:
+                continue
+            stats['reciters'] += 1
+            for key, value in pack.stats().items():
+                stats[key] += value
+        return stats
+
+
+def import_loose(store, cache, remove=False):
+    """
+    Moves the loose files of an audio_cache.AudioCache into packs.
+    Returns the number of ayahs imported.
+    """
+    import audio_cache
+
+    imported = 0
+    for name in sorted(cache.entries):
+        parsed = audio_cache.parse_name(name)
+        if not parsed or store.contains(*parsed):
+            continue
+        path = os.path.join(cache.root, name)
+        try:
+            store.put_file(*parsed, path, remove=False)
+        except (OSError, ValueError) as e:
+            print(f"  ✗ {name}: {e}")
+            continue
+        if remove:
+            cache.discard(*parsed)
+        imported += 1
+    store.flush()
+    cache.flush()
+    return imported
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import audio_cache
+
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Packed audio store maintenance")
+    parser.add_argument('command', choices=('import', 'compact', 'stats'))
+    parser.add_argument('--audio-dir', default=os.path.join(base, 'audio'))
+    parser.add_argument('--packs', default=os.path.join(base, 'cache', 'audio_packs'))
+    parser.add_argument('--remove', action='store_true', help="delete loose files after import")
+    args = parser.parse_args()
+
+    store = PackStore(args.packs)
+    if args.command == 'import':
+        count = import_loose(store, audio_cache.AudioCache(args.audio_dir), remove=args.remove)
+        print(f"[OK] Imported {count} ayahs into {args.packs}")
+    elif args.command == 'compact':
+        for reciter in store.reciters():
+            reclaimed = store.pack(reciter).compact()
+            print(f"[OK] {reciter}: reclaimed {reclaimed} bytes")
+    print(f"[INFO] {store.stats()}")
@@ -0,0 +1,74 @@
+"""
+Gapless reel audio, one ayah at a time.
+
+Per-clip muxing re-encodes each ayah separately, and every clip boundary
+then carries AAC priming/padding samples (small gaps and clicks). Here an
+ayah is decoded once to PCM and laid out in its slot of the reel: its
+speech, then silence up to a minimum length per ayah and the optional gap
+between ayahs (AYAH_GAP_MS), rounded up to whole AAC frames (AAC_FRAME
+samples), with an optional gain (loudness normalization, see
+audio_analysis.py). Slots are encoded once each and joined without
+re-encoding (audio_aac.py): a slot's length depends only on its own ayah,
+so any sequence of slots is a gapless track.
+"""
+import os
+import math
+import subprocess
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+BITRATE = '192k'
+GAP_ENV = 'AYAH_GAP_MS'
+DECODE_WORKERS = 4
+AAC_FRAME = 1024  # samples per AAC frame
+
+
+def default_gap():
+    return max(0, int(os.environ.get(GAP_ENV, 0))) / 1000.0
+
+
+def decode(source, rate=SAMPLE_RATE, channels=CHANNELS):
+    """Decodes any ffmpeg input (file path or audio_pack spec) to interleaved s16le bytes."""
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-i', str(source), '-f', 's16le', '-ar', str(rate), '-ac', str(channels), '-'],
+        capture_output=True, timeout=120
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"decode failed for {source}: {result.stderr.decode(errors='replace').strip()[-200:]}")
+    return result.stdout
+
+
+def apply_gain(pcm, gain_db):
+    """s16le bytes scaled by gain_db (clipped at full scale)."""
+    if not gain_db:
+        return pcm
+    samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32)
+    samples *= 10 ** (gain_db / 20)
+    return np.clip(samples, -32768, 32767).astype('<i2').tobytes()
+
+
+def slot(pcm, min_duration=0.0, gap=0.0, rate=SAMPLE_RATE, channels=CHANNELS):
+    """
+    (slot bytes, speech samples) of an ayah's s16le pcm: the speech, padded
+    with silence to at least min_duration, plus gap seconds, rounded up to
+    whole AAC frames.
+    """
+    sample_bytes = 2 * channels
+    speech = len(pcm) // sample_bytes
+    target = max(speech, int(round(min_duration * rate))) + int(round(gap * rate))
+    samples = max(1, math.ceil(target / AAC_FRAME)) * AAC_FRAME
+    return pcm[:speech * sample_bytes] + bytes((samples - speech) * sample_bytes), speech
+
+
+def encode_adts(pcm, rate=SAMPLE_RATE, channels=CHANNELS, bitrate=BITRATE):
+    """s16le pcm encoded to AAC in an ADTS stream (one priming frame, then one frame per AAC_FRAME samples)."""
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-f', 's16le', '-ar', str(rate), '-ac', str(channels), '-i', '-',
+         '-c:a', 'aac', '-b:a', bitrate, '-f', 'adts', '-'],
+        input=pcm, capture_output=True, timeout=120
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"AAC encode failed: {result.stderr.decode(errors='replace').strip()[-200:]}")
+    return result.stdout
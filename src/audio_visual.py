@@ -0,0 +1,104 @@
+"""
+Audio-reactive bars under the caption, composited by ffmpeg in the clip encode.
+
+    spectrum : one bar per frequency band (audio_analysis.envelopes), rising
+               from the bottom
+    wave     : the level of the last BARS frames as a scrolling waveform,
+               mirrored around the middle, newest on the right
+
+Nothing is drawn per frame in Python. The ayah's cached envelope is turned
+into a stack of tiny grayscale masks (BARS bars x STRIP_HEIGHT px per video
+frame) with one broadcast comparison and written as a raw gray video file
+(~2 KB per frame). create_final_reel reads it as an extra rawvideo input,
+scales it up (nearest neighbour, so bars stay sharp), uses it as the alpha
+of a solid color and overlays it below the caption.
+
+Levels include the ayah's loudness gain (audio_analysis), so the bars move
+on the same scale across reciters.
+"""
+import numpy as np
+
+import audio_analysis
+
+VISUAL_MODES = ('off', 'spectrum', 'wave')
+
+BARS = audio_analysis.ENVELOPE_BANDS
+STRIP_HEIGHT = 24            # mask rows per frame (scaled up by ffmpeg)
+DISPLAY = (960, 180)         # on-screen size of the bars (px)
+COLOR = 'white'
+OPACITY = 0.8
+MARGIN = 40                  # between the caption and the bars
+# dB mapped to an empty / full bar
+SPECTRUM_RANGE = (-70.0, -15.0)
+LEVEL_RANGE = (-50.0, -5.0)
+DECAY = 0.8                  # a falling bar keeps this much of the previous frame's height
+_FLOOR = 1e-6                # heights below this count as an empty bar
+
+
+def _scale(levels, low, high):
+    return np.clip((levels.astype(np.float32) - low) / (high - low), 0.0, 1.0)
+
+
+def bar_heights(envelope, mode, frames, gain_db=0.0):
+    """(frames, BARS) bar heights in [0, 1] for a clip of that many frames (silence after the ayah)."""
+    padded = np.full((frames, envelope.shape[1]), -120.0, dtype=np.float32)
+    count = min(frames, len(envelope))
+    padded[:count] = envelope[:count]
+    padded += gain_db
+
+    if mode == 'wave':
+        level = _scale(padded[:, 0], *LEVEL_RANGE)
+        history = np.concatenate([np.zeros(BARS - 1, dtype=np.float32), level])
+        return np.lib.stride_tricks.sliding_window_view(history, BARS)
+    heights = _scale(padded[:, 1:], *SPECTRUM_RANGE)
+    # short fall-off instead of bars snapping to zero between syllables:
+    # h'[t] = max over s <= t of h[s] * DECAY**(t - s), a running max in the log domain
+    decay = np.arange(frames, dtype=np.float64)[:, None] * np.log(DECAY)
+    logs = np.log(np.maximum(heights, _FLOOR)) - decay
+    held = np.exp(np.maximum.accumulate(logs, axis=0) + decay)
+    return np.where(held > _FLOOR, held, 0.0).astype(np.float32)
+
+
+def write_strip(envelope, mode, duration, fps, path, gain_db=0.0):
+    """
+    Writes the clip's bar masks to path as raw gray8 frames. Returns the
+    create_final_reel input spec {'path', 'size', 'fps'}.
+    """
+    frames = max(1, int(round(duration * fps)))
+    heights = bar_heights(envelope, mode, frames, gain_db)
+
+    if mode == 'wave':
+        # distance of each row from the middle, 0 (centre) .. 1 (edge)
+        rows = np.abs(np.arange(STRIP_HEIGHT) + 0.5 - STRIP_HEIGHT / 2) / (STRIP_HEIGHT / 2)
+    else:
+        rows = (STRIP_HEIGHT - np.arange(STRIP_HEIGHT) - 0.5) / STRIP_HEIGHT
+    lit = heights[:, None, :] >= rows[None, :, None]
+
+    # every bar followed by an empty column of the same width
+    masks = np.zeros((frames, STRIP_HEIGHT, BARS, 2), dtype=np.uint8)
+    masks[..., 0] = lit * int(255 * OPACITY)
+    masks.tofile(path)
+    return {'path': str(path), 'size': (BARS * 2, STRIP_HEIGHT), 'fps': fps}
+
+
+def placement(caption, width=1080, height=1920):
+    """(x, y) of the bars: centred, just below the caption PNG(s), or low on the frame."""
+    lowest = height - DISPLAY[1] - 160
+    boxes = caption.get('pages', [caption]) if caption else []
+    bottoms = [box['y'] + box['height'] for box in boxes if 'y' in box]
+    y = min(max(bottoms) + MARGIN, height - DISPLAY[1] - 80) if bottoms else lowest
+    return (width - DISPLAY[0]) // 2, y
+
+
+def ffmpeg_input(strip):
+    return ['-f', 'rawvideo', '-pix_fmt', 'gray', '-s', '{}x{}'.format(*strip['size']),
+            '-framerate', str(strip['fps']), '-i', strip['path']]
+
+
+def overlay_filter(strip, source, base, output, x, y):
+    """Filter graph steps laying the bars (input label source, from ffmpeg_input(strip)) over base."""
+    w, h = DISPLAY
+    return (f"[{source}]scale={w}:{h}:flags=neighbor,format=gray[viz_mask];"
+            f"color=c={COLOR}:s={w}x{h}:r={strip['fps']}[viz_fill];"
+            f"[viz_fill][viz_mask]alphamerge[viz];"
+            f"[{base}][viz]overlay={x}:{y}:eof_action=pass[{output}]")
@@ -0,0 +1,193 @@
+"""
+Background metadata index and clip window selection.
+
+Every background video is probed once for its duration, resolution, frame
+rate and keyframe timestamps (packet flags, nothing is decoded), with
+ffprobe or - where only ffmpeg is installed - ffmpeg's framecrc muxer. The
+results are kept in cache/backgrounds.json, keyed by path and re-probed
+when a file's size or mtime changes.
+
+select_windows() then gives every clip a (video, offset) window: the offset
+is a keyframe with at least the clip's duration of footage after it, so the
+clip seeks with -ss before -i (no decoding up to the offset) and never
+needs a looped decode. Successive clips use different videos where there is
+more than one, and clips that do share a video get windows that do not
+overlap, so the footage visibly changes from ayah to ayah.
+"""
+import os
+import re
+import json
+import random
+import shutil
+import threading
+import subprocess
+import concurrent.futures
+
+INDEX_VERSION = 1
+PROBE_WORKERS = 4
+
+
+def _rate(value):
+    """'30000/1001' -> 29.97"""
+    num, _, den = str(value).partition('/')
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _probe_ffprobe(path):
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'format=duration:stream=width,height,avg_frame_rate:packet=pts_time,flags',
+        '-of', 'json', path
+    ], capture_output=True, text=True, timeout=120, check=True)
+    data = json.loads(result.stdout)
+    stream = data['streams'][0]
+    keyframes = [float(p['pts_time']) for p in data.get('packets', [])
+                 if 'K' in p.get('flags', '') and p.get('pts_time') not in (None, 'N/A')]
+    return {
+        'duration': float(data['format']['duration']),
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'fps': _rate(stream.get('avg_frame_rate')),
+        'keyframes': keyframes,
+    }
+
+
+def _probe_ffmpeg(path):
+    # framecrc lists every video packet (no decode); keyframes are the lines without "F=" flags
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-i', path, '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-'],
+        capture_output=True, text=True, timeout=120, check=True
+    )
+    header = result.stderr
+    duration = re.search(r'Duration: (\d+):(\d+):([\d.]+)', header)
+    video = re.search(r'Video: .*?(\d{2,5})x(\d{2,5}).*?([\d.]+) fps', header)
+    timebase = re.search(r'^#tb 0: (\d+)/(\d+)', result.stdout, re.M)
+    if not (duration and video and timebase):
+        raise ValueError("unrecognised ffmpeg output")
+    tb = int(timebase.group(1)) / int(timebase.group(2))
+    keyframes = []
+    for line in result.stdout.splitlines():
+        if line.startswith('#'):
+            continue
+        fields = [f.strip() for f in line.split(',')]
+        if len(fields) >= 6 and not any(f.startswith('F=') for f in fields[6:]):
+            keyframes.append(int(fields[2]) * tb)
+    h, m, s = duration.groups()
+    return {
+        'duration': int(h) * 3600 + int(m) * 60 + float(s),
+        'width': int(video.group(1)),
+        'height': int(video.group(2)),
+        'fps': float(video.group(3)),
+        'keyframes': keyframes,
+    }
+
+
+def probe(path):
+    """{'duration', 'width', 'height', 'fps', 'keyframes'} of a video file. Raises on failure."""
+    info = _probe_ffprobe(path) if shutil.which('ffprobe') else _probe_ffmpeg(path)
+    info['keyframes'] = sorted({round(t, 3) for t in info['keyframes'] if 0 <= t < info['duration']}) or [0.0]
+    info['duration'] = round(info['duration'], 3)
+    return info
+
+
+class BackgroundIndex:
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.entries = {}  # video path -> probe() + 'size' / 'mtime_ns'
+        self.dirty = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            payload = json.dumps({'version': INDEX_VERSION, 'entries': self.entries}, separators=(',', ':'))
+            self.dirty = False
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp, self.path)
+
+    def info(self, path):
+        """Indexed metadata of path (probed when new or changed), or None if it cannot be probed."""
+        path = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry
+        try:
+            entry = dict(probe(path), size=st.st_size, mtime_ns=st.st_mtime_ns)
+        except (subprocess.SubprocessError, OSError, ValueError, KeyError, IndexError) as e:
+            print(f"[WARN] Could not probe background {os.path.basename(path)}: {e}")
+            return None
+        with self.lock:
+            self.entries[path] = entry
+            self.dirty = True
+        return entry
+
+    def describe(self, paths, workers=PROBE_WORKERS):
+        """[info or None] for paths, probing the unknown ones in parallel."""
+        paths = [str(p) for p in paths]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            infos = list(executor.map(self.info, paths))
+        self.flush()
+        return infos
+
+    def stats(self):
+        with self.lock:
+            return {
+                'videos': len(self.entries),
+                'seconds': round(sum(e['duration'] for e in self.entries.values()), 1),
+            }
+
+
+def _overlaps(start, end, windows):
+    return any(start < w_end and w_start < end for w_start, w_end in windows)
+
+
+def select_windows(videos, durations, rng=random):
+    """
+    videos: [(video, info)] with info from BackgroundIndex. Returns one
+    (video, offset) per duration; offset is a keyframe time (0.0 when no
+    video is long enough, the clip then loops its background).
+    """
+    videos = [(video, info) for video, info in videos if info]
+    if not videos:
+        return []
+    used = {video: [] for video, _ in videos}
+    previous = None
+    windows = []
+    for duration in durations:
+        candidates = []
+        for video, info in videos:
+            fits = [k for k in info['keyframes'] if k + duration <= info['duration']]
+            if not fits:
+                continue
+            fresh = [k for k in fits if not _overlaps(k, k + duration, used[video])]
+            # a different video than the last clip first, then unused footage, then the least used video
+            rank = (video == previous, not fresh, len(used[video]))
+            candidates.append((rank, rng.random(), video, fresh or fits))
+        if candidates:
+            _, _, video, offsets = min(candidates)
+            offset = rng.choice(offsets)
+        else:
+            # nothing is long enough: the longest video from the start, looped
+            video = max(videos, key=lambda v: v[1]['duration'])[0]
+            offset = 0.0
+        used[video].append((offset, offset + duration))
+        windows.append((video, offset))
+        previous = video
+    return windows
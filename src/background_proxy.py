@@ -0,0 +1,230 @@
+"""
+Background proxy library.
+
+Every clip used to decode its source background (often a 4K Pixabay
+_source.mp4) with -stream_loop, scale, crop, darken and blur it, and encode
+the result - the same work for every ayah of every request. Here each video
+in BACKGROUNDS_DIR is transcoded once into a proxy in the output format:
+
+    1080x1920, 30 fps, FILTERS applied, H.264 with a keyframe every GOP frames
+
+and clips read the proxy directly in their one encode (create_final_reel),
+so the per-clip preparation encode disappears.
+
+Proxies are keyed by the source's content hash and PROXY_SETTINGS: a
+replaced video or changed filters builds a new proxy and deletes the stale
+one. Content hashes are remembered per (size, mtime) in <root>/index.json,
+so a file is only hashed again when it changes.
+
+    python background_proxy.py [--workers N]   ingests every background ahead of time
+"""
+import os
+import json
+import hashlib
+import threading
+import subprocess
+import concurrent.futures
+
+INDEX_VERSION = 1
+
+WIDTH, HEIGHT, FPS = 1080, 1920, 30
+FILTERS = (
+    f'scale={WIDTH}:{HEIGHT}:force_original_aspect_ratio=increase',
+    f'crop={WIDTH}:{HEIGHT}',
+    'eq=brightness=-0.15:contrast=1.1',
+    'gblur=sigma=1.5',
+    'setsar=1',
+)
+GOP = FPS  # one keyframe per second: cheap, accurate seeks into the proxy
+CRF = 20   # proxies are encoded again with the caption, so keep them clean
+PROXY_SETTINGS = {
+    'version': 1,
+    'size': [WIDTH, HEIGHT],
+    'fps': FPS,
+    'filters': list(FILTERS),
+    'gop': GOP,
+    'crf': CRF,
+}
+BUILD_TIMEOUT = 1800  # seconds; a long 4K source is a big one-time decode
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ProxyLibrary:
+    def __init__(self, root):
+        self.root = str(root)
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.lock = threading.Lock()
+        self.build_locks = {}
+        self.entries = {}  # source name -> {'size', 'mtime_ns', 'sha256'}
+        self.dirty = False
+        self.counters = {'hits': 0, 'built': 0, 'failed': 0}
+        self.usage = None  # {'proxies', 'bytes'}, from one scan at first use
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            payload = json.dumps({'version': INDEX_VERSION, 'entries': self.entries}, separators=(',', ':'))
+            self.dirty = False
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp, self.index_path)
+
+    def _digest(self, source, compute=True):
+        """
+        Content hash of source, re-hashed only when its size or mtime changed.
+        compute=False never hashes: None when source is new or changed.
+        """
+        st = os.stat(source)
+        name = os.path.basename(source)
+        entry = self.entries.get(name)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['sha256']
+        if not compute:
+            return None
+        digest = file_digest(source)
+        with self.lock:
+            self.entries[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest}
+            self.dirty = True
+        return digest
+
+    def path_for(self, source, compute=True):
+        """Proxy path of source's current content, or None (compute=False and not hashed yet)."""
+        digest = self._digest(source, compute)
+        if digest is None:
+            return None
+        payload = json.dumps([digest, PROXY_SETTINGS], sort_keys=True, separators=(',', ':'))
+        key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        stem = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(self.root, f"{stem}.{key[:16]}.mp4")
+
+    def get(self, source, build=True):
+        """
+        Path of source's current proxy (built on first use), or None.
+        build=False is a cheap lookup for request threads: it neither hashes
+        a new or changed source nor builds, leaving both to the ingest.
+        """
+        source = str(source)
+        try:
+            path = self.path_for(source, compute=build)
+        except OSError as e:
+            print(f"[WARN] Background unreadable {source}: {e}")
+            return None
+        if path is None:
+            return None
+        if os.path.exists(path):
+            with self.lock:
+                self.counters['hits'] += 1
+            return path
+        if not build:
+            return None
+
+        with self.lock:
+            build_lock = self.build_locks.setdefault(path, threading.Lock())
+        with build_lock:
+            # another thread may have built it while this one waited
+            if not os.path.exists(path) and not self._build(source, path):
+                return None
+        self._remove_stale(path)
+        return path
+
+    def _build(self, source, path):
+        print(f"[INFO] Building background proxy for {os.path.basename(source)}")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+        cmd = [
+            'ffmpeg', '-y', '-v', 'error',
+            '-i', source,
+            '-vf', ','.join(FILTERS + (f'fps={FPS}',)),
+            '-an',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(CRF),
+            '-g', str(GOP), '-keyint_min', str(GOP), '-sc_threshold', '0',
+            '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart',
+            tmp
+        ]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, timeout=BUILD_TIMEOUT)
+            os.replace(tmp, path)
+        except (subprocess.SubprocessError, OSError) as e:
+            print(f"[WARN] Background proxy failed for {source}: {e}")
+            with self.lock:
+                self.counters['failed'] += 1
+            return False
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self.lock:
+            self.counters['built'] += 1
+            if self.usage is not None:
+                self.usage['proxies'] += 1
+                self.usage['bytes'] += os.path.getsize(path)
+        print(f"[OK] Background proxy ready: {os.path.basename(path)}")
+        return True
+
+    def _remove_stale(self, path):
+        """Deletes proxies of the same source built from older content or settings."""
+        current = os.path.basename(path)
+        stem = current.rsplit('.', 2)[0]
+        for name in os.listdir(self.root):
+            if name.endswith('.mp4') and '.tmp' not in name and name != current \
+                    and name.rsplit('.', 2)[0] == stem:
+                victim = os.path.join(self.root, name)
+                try:
+                    size = os.path.getsize(victim)
+                    os.remove(victim)
+                except OSError:
+                    continue
+                with self.lock:
+                    if self.usage is not None:
+                        self.usage['proxies'] -= 1
+                        self.usage['bytes'] -= size
+
+    def ingest(self, sources, workers=1):
+        """Builds every missing proxy. Returns {'ready', 'failed'}."""
+        sources = [str(s) for s in sources]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(self.get, sources))
+        self.flush()
+        failed = sum(1 for r in results if not r)
+        return {'ready': len(results) - failed, 'failed': failed}
+
+    def stats(self):
+        with self.lock:
+            if self.usage is None:
+                proxies = [n for n in os.listdir(self.root) if n.endswith('.mp4') and '.tmp' not in n]
+                self.usage = {
+                    'proxies': len(proxies),
+                    'bytes': sum(os.path.getsize(os.path.join(self.root, n)) for n in proxies),
+                }
+            return dict(self.counters, **self.usage)
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+
+    base = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser(description="Transcode every background into its 1080x1920 proxy")
+    parser.add_argument('--workers', type=int, default=1, help="concurrent transcodes")
+    args = parser.parse_args()
+
+    sources = sorted((base / 'backgrounds').glob('*.mp4'))
+    print(f"[INFO] Ingesting {len(sources)} backgrounds")
+    counts = ProxyLibrary(base / 'cache' / 'bg_proxies').ingest(sources, args.workers)
+    print(f"[OK] {counts['ready']} proxies ready, {counts['failed']} failed")
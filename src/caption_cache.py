@@ -0,0 +1,227 @@
+"""
+Content-addressed cache for rendered caption overlays.
+
+A caption is keyed by a digest of everything that affects its pixels (text,
+font file hash, fitted size, canvas size, colour, effects, renderer), so the
+same ayah is rendered once and reused by every later reel.
+
+Two tiers:
+    memory : LRU of encoded PNG bytes + metadata, bounded in bytes
+    disk   : <root>/<k[:2]>/<key>.png, bounded in bytes, LRU by last access.
+             index.json records size / last access / metadata per entry.
+
+Files are written to a temp name and renamed into place, so a crash never
+leaves a truncated PNG under a valid key.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_VERSION = 2
+
+_font_hashes = {}
+
+
+def font_digest(font_path):
+    """SHA-256 of a font file, memoized per (path, size, mtime)."""
+    st = os.stat(font_path)
+    sig = (str(font_path), st.st_size, st.st_mtime_ns)
+    digest = _font_hashes.get(sig)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(font_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _font_hashes[sig] = digest
+    return digest
+
+
+def caption_key(text, font_path, font_size, width, height, color=(255, 255, 255), effects=None, renderer=''):
+    """Stable digest of every input that changes the rendered caption."""
+    payload = json.dumps(
+        [CACHE_VERSION, text, font_digest(font_path), font_size, width, height,
+         list(color), effects, renderer],
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CaptionCache:
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, memory_bytes=64 * 1024 * 1024, persist=True):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        # persist=False: a worker's view - writes PNGs but never the index or evictions
+        self.persist = persist
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.lock = threading.Lock()
+
+        self.memory = OrderedDict()  # key -> (png bytes, meta)
+        self.memory_size = 0
+        self.entries = {}            # key -> {'size', 'atime', 'meta'}
+        self.disk_size = 0
+        self.dirty = False
+
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    # --- index ---
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            self.entries = {}
+        self.disk_size = sum(e['size'] for e in self.entries.values())
+
+    def flush(self):
+        """Persists the disk index (sizes, last access, metadata)."""
+        with self.lock:
+            if not self.dirty or not self.persist:
+                return
+            payload = json.dumps({'version': CACHE_VERSION, 'entries': self.entries})
+            self.dirty = False
+        tmp = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp, self.index_path)
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    # --- tiers ---
+
+    def _remember(self, key, data, meta):
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key)[0])
+        self.memory[key] = (data, meta)
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_bytes and len(self.memory) > 1:
+            _, (old, _) = self.memory.popitem(last=False)
+            self.memory_size -= len(old)
+            self.counters['memory_evictions'] += 1
+
+    def _write_file(self, key, data):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+    def _evict_disk(self, keep=None):
+        if self.disk_size <= self.max_bytes or not self.persist:
+            return
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['atime']):
+            if self.disk_size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            self.disk_size -= entry['size']
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+            self.counters['disk_evictions'] += 1
+        self.dirty = True
+
+    # --- public API ---
+
+    def get(self, key):
+        """Returns {'path': ..., 'meta': ...} for a cached caption, or None."""
+        with self.lock:
+            now = time.time()
+            hit = self.memory.get(key)
+            if hit is not None:
+                self.memory.move_to_end(key)
+                data, meta = hit
+                path = self.path_for(key)
+                if key not in self.entries or not os.path.exists(path):
+                    # Disk copy evicted or deleted: restore it from memory
+                    self._write_file(key, data)
+                    self._add_entry(key, len(data), meta, now)
+                else:
+                    self.entries[key]['atime'] = now
+                    self.dirty = True
+                self.counters['memory_hits'] += 1
+                return {'path': path, 'meta': meta}
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                path = self.path_for(key)
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    self.disk_size -= self.entries.pop(key)['size']
+                    self.dirty = True
+                else:
+                    entry['atime'] = now
+                    self.dirty = True
+                    self._remember(key, data, entry.get('meta'))
+                    self.counters['disk_hits'] += 1
+                    return {'path': path, 'meta': entry.get('meta')}
+
+            self.counters['misses'] += 1
+            return None
+
+    def _add_entry(self, key, size, meta, now):
+        old = self.entries.get(key)
+        if old:
+            self.disk_size -= old['size']
+        self.entries[key] = {'size': size, 'atime': now, 'meta': meta}
+        self.disk_size += size
+        self.dirty = True
+        self._evict_disk(keep=key)
+
+    def put(self, key, data, meta=None):
+        """Stores encoded PNG bytes under key. Returns {'path': ..., 'meta': ...}."""
+        with self.lock:
+            path = self._write_file(key, data)
+            self._remember(key, data, meta)
+            self._add_entry(key, len(data), meta, time.time())
+            return {'path': path, 'meta': meta}
+
+    def adopt(self, key, meta=None, hit=False):
+        """Records a PNG another process wrote under key (see caption_pool)."""
+        with self.lock:
+            self.counters['disk_hits' if hit else 'misses'] += 1
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['atime'] = time.time()
+                self.dirty = True
+                return
+            try:
+                size = os.path.getsize(self.path_for(key))
+            except OSError:
+                return
+            self._add_entry(key, size, meta, time.time())
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_size,
+                'disk_entries': len(self.entries),
+                'disk_bytes': self.disk_size,
+                'disk_budget': self.max_bytes,
+            })
+            return stats
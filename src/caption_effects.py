@@ -0,0 +1,277 @@
+"""
+Caption effects: stroke, drop shadow and glow, computed from the caption's
+alpha mask with NumPy and composited into the caption PNG once (never per frame).
+
+    stroke : grayscale dilation of the mask (alternating 3x3 cross / square
+             steps, an octagonal approximation of a disk)
+    shadow : mask offset, then a separable box blur applied three times (~Gaussian)
+    glow   : distance field from repeated unit dilations, faded with distance
+
+Effects are a plain dict, so they can be sent with /generate and included in
+the caption cache key:
+
+    {"stroke": {"width": 3, "color": [0, 0, 0]},
+     "shadow": {"offset": [4, 6], "blur": 6, "color": [0, 0, 0], "opacity": 0.6},
+     "glow":   {"radius": 12, "color": [255, 215, 0], "opacity": 0.5}}
+
+or a preset name from PRESETS. Without a spec no effect is applied.
+"""
+import numpy as np
+from PIL import Image
+
+DEFAULTS = {
+    'stroke': {'width': 3, 'color': [0, 0, 0], 'opacity': 1.0},
+    'shadow': {'offset': [4, 6], 'blur': 6, 'color': [0, 0, 0], 'opacity': 0.6},
+    'glow': {'radius': 12, 'color': [255, 255, 255], 'opacity': 0.5},
+}
+
+PRESETS = {
+    'none': {},
+    'outline': {'stroke': {}, 'shadow': {}},
+    'shadow': {'shadow': {}},
+    'glow': {'glow': {}, 'shadow': {'opacity': 0.4}},
+}
+DEFAULT_PRESET = 'none'  # callers that send no caption_effects get the plain caption
+
+MAX_STROKE = 20
+MAX_BLUR = 40
+MAX_GLOW = 40
+MAX_OFFSET = 50
+
+
+def _color(value, name):
+    if not isinstance(value, (list, tuple)) or len(value) != 3:
+        raise ValueError(f"{name} must be [r, g, b]")
+    color = [int(c) for c in value]
+    if any(c < 0 or c > 255 for c in color):
+        raise ValueError(f"{name} components must be 0-255")
+    return color
+
+
+def _number(value, name, lo, hi, cast=int):
+    value = cast(value)
+    if value < lo or value > hi:
+        raise ValueError(f"{name} must be between {lo} and {hi}")
+    return value
+
+
+def normalize_effects(spec=None):
+    """
+    Validates an effects spec (dict, preset name or None for the default preset)
+    and returns it with every field filled in, or None when no effect applies.
+    Raises ValueError on bad input.
+    """
+    if spec is None:
+        spec = DEFAULT_PRESET
+    if isinstance(spec, str):
+        if spec not in PRESETS:
+            raise ValueError(f"Unknown caption effects preset '{spec}' (expected one of {', '.join(PRESETS)})")
+        spec = PRESETS[spec]
+    if not isinstance(spec, dict):
+        raise ValueError("caption_effects must be an object or a preset name")
+
+    unknown = set(spec) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown caption effects: {', '.join(sorted(unknown))}")
+
+    effects = {}
+    for name, options in spec.items():
+        if options is None or options is False:
+            continue
+        if options is True:
+            options = {}
+        if not isinstance(options, dict):
+            raise ValueError(f"caption_effects.{name} must be an object")
+        merged = dict(DEFAULTS[name], **options)
+        merged['color'] = _color(merged['color'], f"{name}.color")
+        merged['opacity'] = _number(merged['opacity'], f"{name}.opacity", 0.0, 1.0, float)
+        if name == 'stroke':
+            merged['width'] = _number(merged['width'], 'stroke.width', 1, MAX_STROKE)
+        elif name == 'shadow':
+            offset = merged['offset']
+            if not isinstance(offset, (list, tuple)) or len(offset) != 2:
+                raise ValueError("shadow.offset must be [dx, dy]")
+            merged['offset'] = [_number(v, 'shadow.offset', -MAX_OFFSET, MAX_OFFSET) for v in offset]
+            merged['blur'] = _number(merged['blur'], 'shadow.blur', 0, MAX_BLUR)
+        elif name == 'glow':
+            merged['radius'] = _number(merged['radius'], 'glow.radius', 1, MAX_GLOW)
+        effects[name] = merged
+    return effects or None
+
+
+# --- mask operations (uint8 arrays unless noted) ---
+
+# Shadow and glow are soft, so they are computed and composited together at
+# 1/SOFT_SCALE resolution and scaled back up; the stroke is computed at full
+# resolution.
+SOFT_SCALE = 2
+
+
+def _dilate_cross(a):
+    out = a.copy()
+    np.maximum(out[1:], a[:-1], out=out[1:])
+    np.maximum(out[:-1], a[1:], out=out[:-1])
+    np.maximum(out[:, 1:], a[:, :-1], out=out[:, 1:])
+    np.maximum(out[:, :-1], a[:, 1:], out=out[:, :-1])
+    return out
+
+
+def _dilate_square(a):
+    rows = a.copy()
+    np.maximum(rows[1:], a[:-1], out=rows[1:])
+    np.maximum(rows[:-1], a[1:], out=rows[:-1])
+    out = rows.copy()
+    np.maximum(out[:, 1:], rows[:, :-1], out=out[:, 1:])
+    np.maximum(out[:, :-1], rows[:, 1:], out=out[:, :-1])
+    return out
+
+
+def _dilate_step(a, step):
+    # Alternating cross and square steps approximate a disk (octagon)
+    return _dilate_square(a) if step % 2 else _dilate_cross(a)
+
+
+def dilate(mask, radius):
+    for step in range(radius):
+        mask = _dilate_step(mask, step)
+    return mask
+
+
+# Up to this box width, summing shifted slices beats a cumulative sum
+_SHIFT_SUM_MAX = 9
+
+
+def _box_blur_axis(a, radius, axis):
+    """Box blur along one axis (float32 in and out): shifted-slice sum for small boxes, else a running sum."""
+    size = 2 * radius + 1
+    n = a.shape[axis]
+    pad = [(0, 0), (0, 0)]
+    if size <= _SHIFT_SUM_MAX:
+        pad[axis] = (radius, radius)
+        p = np.pad(a, pad, mode='constant')
+        window = (lambda k: p[k:k + n]) if axis == 0 else (lambda k: p[:, k:k + n])
+        out = window(0).copy()
+        for k in range(1, size):
+            out += window(k)
+        out *= 1.0 / size
+        return out
+    pad[axis] = (radius + 1, radius)
+    c = np.cumsum(np.pad(a, pad, mode='constant'), axis=axis, dtype=np.float32)
+    if axis == 0:
+        return (c[size:] - c[:-size]) * (1.0 / size)
+    return (c[:, size:] - c[:, :-size]) * (1.0 / size)
+
+
+def blur(mask, radius):
+    """Three separable box passes (close to a Gaussian with sigma ~ radius / 1.7)."""
+    if radius <= 0:
+        return mask
+    box = max(1, radius // 2)
+    out = mask.astype(np.float32)
+    for _ in range(3):
+        out = _box_blur_axis(out, box, 0)
+        out = _box_blur_axis(out, box, 1)
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
+
+def _scale_lut(factor):
+    return np.minimum(np.arange(256) * factor + 0.5, 255).astype(np.uint8)
+
+
+def glow_field(mask, radius):
+    """Max over distance d of dilate_d(mask) * falloff(d): a soft, chamfer-distance glow."""
+    field = mask.copy()
+    current = mask
+    for step in range(radius):
+        current = _dilate_step(current, step)
+        falloff = 1.0 - (step + 1) / (radius + 1)
+        # current * falloff^2 in 8.8 fixed point (cheaper than a LUT lookup per pixel)
+        scaled = np.multiply(current, round(falloff * falloff * 256), dtype=np.uint16)
+        scaled += 128
+        scaled >>= 8
+        np.maximum(field, scaled, out=field, casting='unsafe')
+    return field
+
+
+def _shift(a, dx, dy):
+    out = np.zeros_like(a)
+    h, w = a.shape
+    out[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] = \
+        a[max(-dy, 0):h + min(-dy, 0), max(-dx, 0):w + min(-dx, 0)]
+    return out
+
+
+def _flatten(layers, size):
+    """
+    Composites solid-color layers [(alpha mask, [r, g, b])] of the given size
+    back to front into one RGBA image. Used at low resolution, so the soft
+    layers cost a single upscale and alpha_composite at full size.
+    """
+    result = Image.new('RGBA', size, (0, 0, 0, 0))
+    for mask, color in layers:
+        layer = Image.new('RGBA', size, tuple(color))
+        layer.putalpha(Image.fromarray(mask, 'L'))
+        result = Image.alpha_composite(result, layer)
+    return result
+
+
+def _padding(effects):
+    pad = 0
+    if 'stroke' in effects:
+        pad = max(pad, effects['stroke']['width'])
+    if 'shadow' in effects:
+        shadow = effects['shadow']
+        pad = max(pad, max(abs(v) for v in shadow['offset']) + 2 * shadow['blur'])
+    if 'glow' in effects:
+        pad = max(pad, effects['glow']['radius'])
+    # multiple of SOFT_SCALE so the downscaled mask lines up with the full one
+    return -(-(pad + 1) // SOFT_SCALE) * SOFT_SCALE
+
+
+def apply_effects(image, x, y, effects):
+    """
+    Composites effects behind a tight RGBA caption placed at (x, y).
+    Returns (image, x, y) - the result is cropped to its own ink again.
+    """
+    if not effects:
+        return image, x, y
+
+    pad = _padding(effects)
+    # canvas rounded up to a multiple of SOFT_SCALE (extra space right/bottom)
+    size = tuple(-(-(n + 2 * pad) // SOFT_SCALE) * SOFT_SCALE for n in image.size)
+    text = Image.new('RGBA', size, (0, 0, 0, 0))
+    text.paste(image, (pad, pad))
+    alpha = np.asarray(text.getchannel('A'))
+
+    # Back-to-front layers: glow, shadow (both flattened at low resolution),
+    # stroke, then the text itself
+    soft = []
+    if 'glow' in effects or 'shadow' in effects:
+        small = np.asarray(text.getchannel('A').reduce(SOFT_SCALE))
+    if 'glow' in effects:
+        glow = effects['glow']
+        field = glow_field(small, max(1, glow['radius'] // SOFT_SCALE))
+        soft.append((_scale_lut(glow['opacity'])[field], glow['color']))
+    if 'shadow' in effects:
+        shadow = effects['shadow']
+        dx, dy = (round(v / SOFT_SCALE) for v in shadow['offset'])
+        field = _scale_lut(shadow['opacity'])[blur(small, shadow['blur'] // SOFT_SCALE)]
+        soft.append((_shift(field, dx, dy), shadow['color']))
+
+    if soft:
+        # nearest is enough: the fields are smooth, and it is far cheaper than bilinear
+        result = _flatten(soft, small.shape[::-1]).resize(size, Image.NEAREST)
+    else:
+        result = Image.new('RGBA', size, (0, 0, 0, 0))
+    if 'stroke' in effects:
+        stroke = effects['stroke']
+        field = dilate(alpha, stroke['width'])
+        if stroke['opacity'] < 1.0:
+            field = _scale_lut(stroke['opacity'])[field]
+        layer = Image.new('RGBA', size, tuple(stroke['color']))
+        layer.putalpha(Image.fromarray(field, 'L'))
+        result = Image.alpha_composite(result, layer)
+    result = Image.alpha_composite(result, text)
+
+    bbox = result.getchannel('A').getbbox() or (0, 0, 1, 1)
+    return result.crop(bbox), x - pad + bbox[0], y - pad + bbox[1]
@@ -0,0 +1,208 @@
+"""
+Font-size fitting for captions.
+
+A caption uses the largest size on the FIT_MAX..FIT_MIN grid (step FIT_STEP)
+whose wrapped height fits the box. Wrapped height only grows with the font
+size, so the grid is binary searched (about 4 measurements instead of 17),
+after a first probe at FIT_MAX that settles most short ayahs in one.
+
+Measurements are memoized per (renderer, font, text, size, width) for the
+life of the process, and fitted sizes for every ayah can be precomputed per
+canvas preset (python caption_fit.py) into cache/fit/, keyed by renderer and
+font hash so a font or backend change invalidates them.
+"""
+import os
+import pickle
+import threading
+from array import array
+from collections import OrderedDict
+
+import caption_cache
+
+FIT_MAX = 120
+FIT_MIN = 40
+FIT_STEP = 5
+FIT_SIZES = tuple(range(FIT_MIN, FIT_MAX + 1, FIT_STEP))
+
+FIT_VERSION = 1
+FIT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'fit')
+
+# name -> (canvas width, canvas height, text box width, text box height)
+CANVAS_PRESETS = {
+    'reel': (1080, 1920, 980, 1820),
+}
+
+MEASURE_CACHE_SIZE = 50000
+
+_measurements = OrderedDict()
+_measure_lock = threading.Lock()
+_fit_tables = {}
+
+
+def _font_id(renderer):
+    return (renderer.name, caption_cache.font_digest(renderer.font_path))
+
+
+def measure(renderer, text, font_size, width):
+    """Wrapped text height in px, memoized across requests."""
+    key = _font_id(renderer) + (text, font_size, width)
+    with _measure_lock:
+        height = _measurements.get(key)
+        if height is not None:
+            _measurements.move_to_end(key)
+            return height
+
+    height = renderer.measure_text_height(text, font_size, width)
+
+    with _measure_lock:
+        _measurements[key] = height
+        while len(_measurements) > MEASURE_CACHE_SIZE:
+            _measurements.popitem(last=False)
+    return height
+
+
+def search_font_size(renderer, text, max_width, max_height):
+    """
+    Largest grid size whose height fits, or FIT_MIN when nothing fits.
+    Returns (font_size, measured_height, measurements_taken).
+    """
+    taken = 0
+
+    def fits(i):
+        nonlocal taken
+        taken += 1
+        height = measure(renderer, text, FIT_SIZES[i], max_width)
+        return height <= max_height, height
+
+    # Most ayahs fit at the largest size
+    ok, height = fits(len(FIT_SIZES) - 1)
+    if ok:
+        return FIT_MAX, height, taken
+
+    # Invariant: FIT_SIZES[hi] does not fit; FIT_SIZES[lo] fits if found
+    lo, hi, best = 0, len(FIT_SIZES) - 1, None
+    while lo < hi:
+        mid = (lo + hi) // 2
+        ok, mid_height = fits(mid)
+        if ok:
+            best = (FIT_SIZES[mid], mid_height)
+            lo = mid + 1
+        else:
+            hi = mid
+
+    if best is None:
+        return FIT_MIN, None, taken
+    return best[0], best[1], taken
+
+
+# --- precomputed fits ---
+
+def _fit_path(renderer, max_width, max_height):
+    name, digest = _font_id(renderer)
+    return os.path.join(FIT_DIR, f"{name}_{digest[:16]}_{max_width}x{max_height}.fit")
+
+
+def _fit_signature(renderer, max_width, max_height):
+    import quran_provider
+    try:
+        st = os.stat(quran_provider.QURAN_FILE)
+        source = (st.st_size, st.st_mtime_ns)
+    except OSError:
+        source = (None, None)
+    return (FIT_VERSION, _font_id(renderer), max_width, max_height, FIT_SIZES) + source
+
+
+def precompute_fits(renderer, max_width, max_height):
+    """Fits every ayah for one text box and stores the sizes (one byte each)."""
+    import quran_provider
+
+    total = quran_provider.total_ayahs()
+    sizes = array('B')
+    measured = 0
+    for index in range(total):
+        sura, ayah = quran_provider.ayah_key(index)
+        text = " ".join(quran_provider.get_ayah_text(sura, ayah).split())
+        size, _, taken = search_font_size(renderer, text, max_width, max_height)
+        sizes.append(size)
+        measured += taken
+
+    path = _fit_path(renderer, max_width, max_height)
+    os.makedirs(FIT_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump({
+            'signature': _fit_signature(renderer, max_width, max_height),
+            'sizes': sizes,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    _fit_tables.pop(path, None)
+    print(f"[OK] Fitted {total} ayahs ({measured} measurements) -> {path}")
+    return sizes
+
+
+def _load_fit_table(renderer, max_width, max_height):
+    """{normalized ayah text: size} from a precomputed fit file, or {}."""
+    path = _fit_path(renderer, max_width, max_height)
+    table = _fit_tables.get(path)
+    if table is not None:
+        return table
+
+    table = {}
+    try:
+        with open(path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['signature'] == _fit_signature(renderer, max_width, max_height):
+            import quran_provider
+            for index, size in enumerate(cached['sizes']):
+                sura, ayah = quran_provider.ayah_key(index)
+                table[" ".join(quran_provider.get_ayah_text(sura, ayah).split())] = size
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+    _fit_tables[path] = table
+    return table
+
+
+def has_fit_table(renderer, max_width, max_height):
+    """True when a current precomputed fit file exists for this font and text box."""
+    return bool(_load_fit_table(renderer, max_width, max_height))
+
+
+def estimate_font_size(text):
+    """Length-based size on the fit grid, for when no renderer can measure."""
+    length = len(text)
+    if length > 800:
+        return FIT_MIN
+    if length > 400:
+        return 60
+    if length > 200:
+        return 85
+    if length > 100:
+        return 100
+    return FIT_MAX
+
+
+def fit_font_size(renderer, text, max_width, max_height):
+    """Fitted font size for a caption: precomputed table first, then the search."""
+    size = _load_fit_table(renderer, max_width, max_height).get(text)
+    if size is not None:
+        return size, 'precomputed'
+    size, height, taken = search_font_size(renderer, text, max_width, max_height)
+    if height is None:
+        return size, f"too long, {taken} measurements"
+    return size, f"height {height}px, {taken} measurements"
+
+
+if __name__ == "__main__":
+    import sys
+    import caption_renderer
+
+    font_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fonts', 'Amiri-Quran.ttf')
+    presets = sys.argv[1:] or list(CANVAS_PRESETS)
+    renderer = caption_renderer.get_renderer(font_path)
+    for preset in presets:
+        if preset not in CANVAS_PRESETS:
+            print(f"[ERROR] Unknown preset '{preset}' (expected one of {', '.join(CANVAS_PRESETS)})")
+            continue
+        _, _, box_width, box_height = CANVAS_PRESETS[preset]
+        print(f"[INFO] Precomputing font sizes for preset '{preset}' ({box_width}x{box_height})")
+        precompute_fits(renderer, box_width, box_height)
@@ -0,0 +1,147 @@
+"""
+Caption pages for long ayahs.
+
+A caption that only fits the text box below CAPTION_PAGE_MIN_FONT is split
+into pages at word boundaries (quran_words spans of the Uthmani text), shown
+one after another while the ayah is recited. The page count is the smallest
+one whose equal-length pages all fit at that size (at most MAX_PAGES).
+
+Page breaks are timed from the reciter's pauses (audio_analysis.pauses):
+assuming a steady number of characters per second of speech, every pause
+gets an estimated text position. Each ideal break moves to the best pause
+within SNAP_WINDOW of it (longer and nearer is better) and to the word
+boundary closest to that pause; the page changes in the middle of the pause. A break with no pause nearby stays
+at its ideal word boundary, timed by the same estimate.
+
+Kept free of main.py state, like captions.py.
+"""
+import os
+import re
+import bisect
+
+import numpy as np
+
+import caption_fit
+import quran_provider
+import quran_words
+
+MIN_FONT_ENV = 'CAPTION_PAGE_MIN_FONT'
+DEFAULT_MIN_FONT = 90  # 0 disables paging
+MAX_PAGES = 8
+SNAP_WINDOW = 0.4  # fraction of a page's length a break may move towards a pause
+
+
+def min_font():
+    return max(0, int(os.environ.get(MIN_FONT_ENV, DEFAULT_MIN_FONT)))
+
+
+def word_spans(text, surah=None, ayah=None):
+    """[(start, end)] character offsets of the words of text."""
+    if surah and ayah and text == quran_provider.get_ayah_text(surah, ayah):
+        spans = quran_words.get_word_spans(surah, ayah)
+        if spans:
+            return spans
+    return [m.span() for m in re.finditer(r'\S+', text)]
+
+
+def _page_text(text, spans, first, last):
+    return " ".join(text[spans[first][0]:spans[last - 1][1]].split())
+
+
+def _font_size(text, renderer, max_width, max_height):
+    if renderer:
+        return caption_fit.fit_font_size(renderer, text, max_width, max_height)[0]
+    return caption_fit.estimate_font_size(text)
+
+
+def _balanced(spans, count):
+    """Word indices [0, b1, ..., len(spans)] cutting the text into count pages of similar length."""
+    starts = [start for start, _ in spans]
+    total = spans[-1][1]
+    bounds = [0]
+    for k in range(1, count):
+        target = total * k / count
+        i = bisect.bisect_left(starts, target)
+        # nearer of the two word starts around the target, always past the previous break
+        if 0 < i < len(starts) and target - starts[i - 1] < starts[i] - target:
+            i -= 1
+        bounds.append(min(max(i, bounds[-1] + 1), len(spans) - (count - k)))
+    bounds.append(len(spans))
+    return bounds
+
+
+def page_count(text, renderer=None, max_width=980, max_height=1820, minimum=None, surah=None, ayah=None):
+    """Number of pages text needs so every page fits at >= minimum font size (1 = no paging)."""
+    minimum = min_font() if minimum is None else minimum
+    if not minimum or _font_size(" ".join(text.split()), renderer, max_width, max_height) >= minimum:
+        return 1
+    spans = word_spans(text, surah, ayah)
+    for count in range(2, min(MAX_PAGES, len(spans)) + 1):
+        bounds = _balanced(spans, count)
+        if all(_font_size(_page_text(text, spans, a, b), renderer, max_width, max_height) >= minimum
+               for a, b in zip(bounds, bounds[1:])):
+            return count
+    return max(1, min(MAX_PAGES, len(spans)))
+
+
+def _speech_clock(pause_map, duration, total_chars):
+    """(times, chars): knots of the piecewise-linear map between reel time and text position."""
+    start, end = pause_map['speech'] if pause_map else (0.0, duration)
+    pauses = [p for p in (pause_map or {}).get('pauses', []) if start < p[0] and p[1] < end]
+    times = np.array([start] + [t for pause in pauses for t in pause] + [end])
+    # segments alternate speech, pause, speech, ...; only speech advances the text
+    speaking = np.arange(len(times) - 1) % 2 == 0
+    spoken = np.concatenate([[0.0], np.cumsum(np.diff(times) * speaking)])
+    if not spoken[-1]:
+        return np.array([0.0, duration]), np.array([0.0, total_chars])
+    return times, spoken / spoken[-1] * total_chars
+
+
+def paginate(text, count, pause_map, duration, surah=None, ayah=None):
+    """
+    Splits text into count pages timed against the recitation.
+    pause_map: audio_analysis pause map of the ayah audio (None = evenly by length).
+    duration: the clip's length. Returns [{'text', 'start', 'end'}], seconds from the clip start.
+    """
+    spans = word_spans(text, surah, ayah)
+    count = max(1, min(count, len(spans)))
+    if count == 1:
+        return [{'text': " ".join(text.split()), 'start': 0.0, 'end': duration}]
+
+    total = spans[-1][1]
+    times, chars = _speech_clock(pause_map, duration, total)
+    starts = [start for start, _ in spans]
+    window = SNAP_WINDOW * total / count
+    # (estimated text position, length, middle) of every pause
+    candidates = []
+    for pause_start, pause_end in (pause_map or {}).get('pauses', []):
+        position = float(np.interp(pause_start, times, chars))
+        candidates.append((position, pause_end - pause_start, (pause_start + pause_end) / 2))
+
+    bounds = _balanced(spans, count)
+    breaks = [(0, 0.0)]
+    for k in range(1, count):
+        ideal = starts[bounds[k]]
+        # the break may land anywhere that keeps a word on every page before and after it
+        lowest, highest = breaks[-1][0] + 1, len(spans) - (count - k)
+        best, best_score = None, 0.0
+        for position, length, middle in candidates:
+            if middle <= breaks[-1][1]:
+                continue
+            score = length * (1 - abs(position - ideal) / window)
+            if score > best_score:
+                best, best_score = (position, length, middle), score
+        if best:
+            i = bisect.bisect_left(starts, best[0])
+            if 0 < i < len(starts) and best[0] - starts[i - 1] < starts[i] - best[0]:
+                i -= 1
+            breaks.append((min(max(i, lowest), highest), best[2]))
+        else:
+            word = min(max(bounds[k], lowest), highest)
+            breaks.append((word, max(float(np.interp(starts[word], chars, times)), breaks[-1][1])))
+    breaks.append((len(spans), duration))
+
+    return [
+        {'text': _page_text(text, spans, first, last), 'start': round(start, 3), 'end': round(end, 3)}
+        for (first, start), (last, end) in zip(breaks, breaks[1:])
+    ]
@@ -0,0 +1,151 @@
+"""
+Process pool for the caption rendering stage.
+
+Shaping, layout, effects and PNG encoding are CPU-bound and hold the GIL, so
+captions for a job are rendered in worker processes. Each worker loads the
+font and renderer context once (initializer), then takes chunks of
+(label, text, style) jobs; results come back in job order.
+
+Workers share the caption cache directory but not its index: they write PNGs
+atomically and report them back, and the parent process records them
+(CaptionCache.adopt), so index.json has a single writer.
+
+Workers are never forked from the app itself: it runs request, download and
+ingest threads, and a lock another thread holds at fork time stays locked in
+the child forever. They come from a forkserver instead (a clean process that
+imports the app's main module once and forks workers from there), or are
+spawned where there is none (Windows).
+
+Pool size: CAPTION_WORKERS (default: CPU count - 1). 1 renders in-process.
+Spawned workers each re-import the app's main module with all of its
+startup work, so the default without a forkserver is 1; a frozen
+(PyInstaller) build always renders in-process.
+"""
+import os
+import sys
+import time
+import atexit
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+import caption_cache
+import caption_renderer
+import captions
+
+WORKERS_ENV = 'CAPTION_WORKERS'
+
+_pool = None
+_pool_config = None
+
+# Per-worker-process state, set by _init_worker
+_worker = {}
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def default_workers():
+    value = os.environ.get(WORKERS_ENV)
+    if value:
+        return max(1, int(value))
+    if _context().get_start_method() != 'forkserver':
+        return 1
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def _init_worker(font_path, cache_root):
+    _worker['font_path'] = font_path
+    # Read-only view of the shared cache: no memory tier, never writes the index
+    _worker['cache'] = caption_cache.CaptionCache(cache_root, memory_bytes=0, persist=False)
+    try:
+        caption_renderer.get_renderer(font_path)
+    except Exception as e:
+        # render_caption reports it per job
+        print(f"[WARN] Caption worker {os.getpid()}: {e}")
+
+
+def _render_job(job):
+    label, text, style = job
+    start = time.perf_counter()
+    result = captions.render_caption(text, _worker['font_path'], _worker['cache'], **style)
+    return label, result, (time.perf_counter() - start) * 1000
+
+
+def _get_pool(workers, font_path, cache_root):
+    global _pool, _pool_config
+    config = (workers, str(font_path), str(cache_root))
+    if _pool is None or _pool_config != config:
+        shutdown()
+        _pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=_context(),
+            initializer=_init_worker,
+            initargs=(str(font_path), str(cache_root))
+        )
+        _pool_config = config
+        print(f"[OK] Caption pool: {workers} worker processes")
+    return _pool
+
+
+def shutdown():
+    global _pool, _pool_config
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool, _pool_config = None, None
+
+
+atexit.register(shutdown)
+
+
+def _render_serial(jobs, font_path, cache):
+    outputs = []
+    for label, text, style in jobs:
+        start = time.perf_counter()
+        result = captions.render_caption(text, font_path, cache, **style)
+        outputs.append((label, result, (time.perf_counter() - start) * 1000))
+    return outputs
+
+
+def render_captions(jobs, font_path, cache, workers=None):
+    """
+    jobs: [(label, text, style), ...], style being render_caption keyword
+    arguments (width, height, effects). Returns the caption dicts (None for
+    failures) in job order, and prints each caption's render time.
+    """
+    if not jobs:
+        return []
+    workers = min(workers or default_workers(), len(jobs))
+    if getattr(sys, 'frozen', False):
+        # a spawned worker would start the whole frozen app again
+        workers = 1
+    start = time.perf_counter()
+
+    outputs = None
+    if workers > 1:
+        try:
+            pool = _get_pool(workers, font_path, cache.root)
+            # a few chunks per worker keeps them busy without per-job IPC overhead
+            chunksize = max(1, len(jobs) // (workers * 4))
+            outputs = list(pool.map(_render_job, jobs, chunksize=chunksize))
+        except (BrokenProcessPool, OSError) as e:
+            print(f"[WARN] Caption pool failed ({e}), rendering in-process")
+            shutdown()
+        else:
+            # record worker-written PNGs in this process's cache index
+            for _, result, _ in outputs:
+                if result:
+                    meta = {k: result[k] for k in ('font_size', 'x', 'y', 'width', 'height')}
+                    cache.adopt(result['key'], meta, hit=result['cached'])
+
+    if outputs is None:
+        outputs = _render_serial(jobs, font_path, cache)
+
+    for label, result, ms in outputs:
+        state = "cached" if result and result['cached'] else ("rendered" if result else "FAILED")
+        print(f"  [{label}] caption {state} in {ms:.0f} ms")
+    elapsed = time.perf_counter() - start
+    print(f"[OK] {len(jobs)} captions in {elapsed:.2f}s ({workers} worker{'s' if workers > 1 else ''})")
+    return [result for _, result, _ in outputs]
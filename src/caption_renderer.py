@@ -0,0 +1,213 @@
+"""
+Caption renderer backends.
+
+Both backends produce the same thing: the ayah text centred, right-to-left,
+word-wrapped, white on a transparent canvas. Each worker thread keeps one
+long-lived renderer (fonts, scratch buffers, measurement state), obtained with
+get_renderer().
+
+    gdi  : Windows GDI (windows_renderer), Windows only
+    raqm : Pillow with the raqm layout engine (HarfBuzz shaping + FriBiDi), any OS
+
+Select with the QURAN_RENDERER environment variable ('auto', 'gdi', 'raqm').
+'auto' uses GDI on Windows and raqm elsewhere.
+"""
+import os
+import sys
+import threading
+
+from PIL import Image, ImageDraw, ImageFont, features
+
+RENDERER_ENV = 'QURAN_RENDERER'
+
+# Face name of fonts/Amiri-Quran.ttf as registered with GDI
+GDI_FONT_FACE = "Amiri"
+
+
+class CaptionRenderer:
+    """Backend interface. font_size is the em height in pixels for every backend."""
+
+    name = 'base'
+
+    def __init__(self, font_path):
+        self.font_path = str(font_path)
+
+    def measure_text_height(self, text, font_size, width):
+        raise NotImplementedError
+
+    def render_text_to_image(self, text, font_size, width, height, text_color=(255, 255, 255)):
+        raise NotImplementedError
+
+    def render_tight(self, text, font_size, width, height, text_color=(255, 255, 255)):
+        """
+        Renders the caption for a width x height canvas but returns only the
+        inked area: (image, x, y), x/y being its position on the canvas.
+        """
+        image = self.render_text_to_image(text, font_size, width, height, text_color)
+        return crop_to_ink(image, image.getchannel('A'))
+
+    def close(self):
+        pass
+
+
+def crop_to_ink(image, alpha):
+    """Crops image to the bounding box of non-zero alpha. Returns (image, x, y)."""
+    bbox = alpha.getbbox()
+    if bbox is None:
+        # Nothing drawn: a single transparent pixel keeps the overlay valid
+        return image.crop((0, 0, 1, 1)), 0, 0
+    return image.crop(bbox), bbox[0], bbox[1]
+
+
+class GdiRenderer(CaptionRenderer):
+    """Windows GDI backend with a persistent DC/font/bitmap context."""
+
+    name = 'gdi'
+
+    def __init__(self, font_path):
+        super().__init__(font_path)
+        import windows_renderer
+        # Load into GDI (safe to call multiple times)
+        windows_renderer.load_private_font(self.font_path)
+        self.context = windows_renderer.GdiRenderContext()
+
+    def measure_text_height(self, text, font_size, width):
+        return self.context.measure_text_height(text, GDI_FONT_FACE, font_size, width)
+
+    def render_text_to_image(self, text, font_size, width, height, text_color=(255, 255, 255)):
+        return self.context.render_text_to_image(text, GDI_FONT_FACE, font_size, width, height, text_color)
+
+    def close(self):
+        self.context.close()
+
+
+class RaqmRenderer(CaptionRenderer):
+    """
+    Pillow + libraqm backend (HarfBuzz shaping, FriBiDi bidi).
+    Mirrors the GDI layout: DrawText-style greedy word wrap, lines centred,
+    block vertically centred inside a 10px margin.
+    """
+
+    name = 'raqm'
+    MARGIN = 10
+
+    def __init__(self, font_path):
+        super().__init__(font_path)
+        if not features.check('raqm'):
+            # The basic layout engine cannot shape Arabic - refuse rather than render broken text
+            raise RuntimeError("Pillow raqm layout unavailable; install libraqm/libfribidi to render Quran captions")
+        self.fonts = {}          # size -> FreeTypeFont
+        self.word_widths = {}    # (size, word) -> advance width in px
+        self.scratch = None      # reusable 'L' canvas
+
+    def font(self, font_size):
+        font_size = int(font_size)
+        font = self.fonts.get(font_size)
+        if font is None:
+            font = ImageFont.truetype(self.font_path, font_size, layout_engine=ImageFont.Layout.RAQM)
+            self.fonts[font_size] = font
+        return font
+
+    def _width(self, font, font_size, text):
+        key = (font_size, text)
+        width = self.word_widths.get(key)
+        if width is None:
+            width = font.getlength(text, direction='rtl', language='ar')
+            self.word_widths[key] = width
+        return width
+
+    def _line_height(self, font):
+        ascent, descent = font.getmetrics()
+        return ascent + descent
+
+    def wrap(self, text, font_size, width):
+        """Greedy word wrap (as DT_WORDBREAK). Returns [(line, line_width), ...]."""
+        font = self.font(font_size)
+        font_size = int(font_size)
+        space = self._width(font, font_size, ' ')
+        lines = []
+        words, line_width = [], 0.0
+        for word in text.split():
+            w = self._width(font, font_size, word)
+            if words and line_width + space + w > width:
+                lines.append((' '.join(words), line_width))
+                words, line_width = [word], w
+            else:
+                line_width = line_width + space + w if words else w
+                words.append(word)
+        if words:
+            lines.append((' '.join(words), line_width))
+        return lines
+
+    def measure_text_height(self, text, font_size, width):
+        lines = self.wrap(text, font_size, width)
+        return len(lines) * self._line_height(self.font(font_size))
+
+    def _canvas(self, width, height):
+        if self.scratch is None or self.scratch.size != (width, height):
+            self.scratch = Image.new('L', (width, height), 0)
+        else:
+            self.scratch.paste(0, (0, 0, width, height))
+        return self.scratch
+
+    def _draw_mask(self, text, font_size, width, height):
+        font = self.font(font_size)
+        box_width = width - 2 * self.MARGIN
+        lines = self.wrap(text, font_size, box_width)
+        line_height = self._line_height(font)
+
+        text_height = len(lines) * line_height
+        y = self.MARGIN + max((height - 2 * self.MARGIN - text_height) // 2, 0)
+
+        mask = self._canvas(width, height)
+        draw = ImageDraw.Draw(mask)
+        for line, line_width in lines:
+            x = self.MARGIN + (box_width - line_width) / 2
+            draw.text((x, y), line, font=font, fill=255, direction='rtl', language='ar')
+            y += line_height
+        return mask
+
+    def render_text_to_image(self, text, font_size, width, height, text_color=(255, 255, 255)):
+        mask = self._draw_mask(text, font_size, width, height)
+        final_img = Image.new("RGBA", (width, height), text_color)
+        final_img.putalpha(mask)
+        return final_img
+
+    def render_tight(self, text, font_size, width, height, text_color=(255, 255, 255)):
+        # Crop the coverage mask first so the RGBA image is only as big as the text
+        mask = self._draw_mask(text, font_size, width, height)
+        bbox = mask.getbbox() or (0, 0, 1, 1)
+        mask = mask.crop(bbox)
+        final_img = Image.new("RGBA", mask.size, text_color)
+        final_img.putalpha(mask)
+        return final_img, bbox[0], bbox[1]
+
+
+BACKENDS = {
+    'gdi': GdiRenderer,
+    'raqm': RaqmRenderer,
+}
+
+_local = threading.local()
+
+
+def default_backend():
+    choice = os.environ.get(RENDERER_ENV, 'auto').lower()
+    if choice == 'auto':
+        return 'gdi' if sys.platform == 'win32' else 'raqm'
+    return choice
+
+
+def get_renderer(font_path, backend=None):
+    """Returns this thread's renderer, creating it (and loading the font) on first use."""
+    backend = backend or default_backend()
+    renderer = getattr(_local, 'renderer', None)
+    if renderer is None or renderer.name != backend or renderer.font_path != str(font_path):
+        if renderer is not None:
+            renderer.close()
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown caption renderer '{backend}' (expected one of {', '.join(BACKENDS)})")
+        renderer = BACKENDS[backend](font_path)
+        _local.renderer = renderer
+        print(f"[OK] Caption renderer: {renderer.name}")
+    return renderer
@@ -0,0 +1,105 @@
+"""
+Caption rendering core: fit, cache lookup, tight render, effects, PNG encode.
+
+Kept free of Flask / main.py state so it can run in caption_pool worker
+processes as well as in the request thread. The renderer (font, GDI/raqm
+context) is per thread/process via caption_renderer.get_renderer().
+"""
+import io
+import os
+import json
+
+from PIL import Image, PngImagePlugin
+
+import caption_cache
+import caption_fit
+import caption_effects
+import caption_renderer
+
+TEXT_COLOR = (255, 255, 255)  # White
+MARGIN = 50
+
+
+def _untracked(cache, key):
+    """
+    A caption PNG on disk that this cache's index does not know yet (written by
+    another process). Its placement is read back from the PNG's text chunk.
+    """
+    path = cache.path_for(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with Image.open(path) as img:
+            meta = json.loads(img.info['placement'])
+    except (OSError, KeyError, ValueError):
+        return None
+    if cache.persist:
+        cache.adopt(key, meta, hit=True)
+    return {'path': path, 'meta': meta}
+
+
+def render_caption(text, font_path, cache, width=1080, height=1920, effects=None):
+    """
+    Renders (or fetches from cache) one caption overlay.
+    Returns {'path', 'x', 'y', 'width', 'height', 'font_size', 'key', 'cached'},
+    or None on failure.
+    """
+    # Sanitize Text: Collapse specific whitespace but NEVER touch Tashkeel
+    if text:
+        text = " ".join(text.split())
+
+    # Safe margins
+    max_width = width - (MARGIN * 2)
+    max_height = height - (MARGIN * 2)
+
+    # Long-lived renderer (GDI on Windows, HarfBuzz/raqm elsewhere)
+    try:
+        renderer = caption_renderer.get_renderer(font_path)
+    except Exception as e:
+        print(f"[ERROR] Caption renderer unavailable: {e}")
+        return None
+
+    # Dynamic Font Sizing (binary search over the 120..40 grid, memoized)
+    print(f"  Calculating optimal font size for {len(text)} chars...")
+    font_size, fit_info = caption_fit.fit_font_size(renderer, text, max_width, max_height)
+    print(f"  [FIT] Size {font_size} ({fit_info}, max {max_height}px)")
+
+    cache_key = caption_cache.caption_key(
+        text, font_path, font_size, width, height, TEXT_COLOR, effects, renderer.name
+    )
+    cached = cache.get(cache_key) or _untracked(cache, cache_key)
+    if cached:
+        print(f"[OK] Caption cache hit: {cache_key[:12]}")
+        return dict(cached['meta'], path=cached['path'], key=cache_key, cached=True)
+
+    print(f"[RENDER] using {renderer.name} renderer. Size: {font_size}")
+
+    try:
+        # Tight bounding box + its position instead of a full-frame RGBA canvas
+        final_img, x, y = renderer.render_tight(text, font_size, width, height, text_color=TEXT_COLOR)
+        final_img, x, y = caption_effects.apply_effects(final_img, x, y, effects)
+
+        # Save into the caption cache (atomic write). Fast zlib level: the PNG is
+        # small now and read back once per clip, so encode time matters more than size.
+        placement = {
+            'font_size': font_size,
+            'x': x,
+            'y': y,
+            'width': final_img.width,
+            'height': final_img.height,
+        }
+        # placement also travels inside the PNG, for processes that did not index it
+        info = PngImagePlugin.PngInfo()
+        info.add_text('placement', json.dumps(placement))
+        buffer = io.BytesIO()
+        final_img.save(buffer, "PNG", compress_level=1, pnginfo=info)
+        entry = cache.put(cache_key, buffer.getvalue(), placement)
+
+        print(f"[OK] Caption generated: {cache_key[:12]} ({final_img.width}x{final_img.height} at {x},{y})")
+        return dict(placement, path=entry['path'], key=cache_key, cached=False)
+
+    except Exception as e:
+        print(f"[ERROR] Caption render failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
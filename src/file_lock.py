@@ -0,0 +1,45 @@
+"""
+Inter-process lock on a file, for stores that several processes share (the
+server, warm_cache.py, the audio_pack CLI): flock on POSIX, msvcrt.locking
+on Windows. Blocks until the lock is acquired.
+
+    with FileLock(path + '.lock'):
+        ...read, merge and rewrite path...
+"""
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+
+class FileLock:
+    """Exclusive lock on a file, held across processes for the duration of a with block."""
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+b')
+        if msvcrt:
+            self.file.seek(0)
+            while True:
+                try:
+                    # LK_LOCK gives up after ~10 s; a compaction can hold the lock longer
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if msvcrt:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.file.close()
@@ -1,18 +1,22 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import requests
+import io
+import json
 import os
 import subprocess
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
 from datetime import datetime
 from pydub import AudioSegment
 import time
 import random
 import hashlib
 import concurrent.futures
+import multiprocessing
+import functools
 import shutil
 import webbrowser
+import threading
 from threading import Timer
 
 app = Flask(__name__)
@@ -33,8 +37,9 @@ OUTPUT_DIR = BASE_DIR / 'outputs'
 FONTS_DIR = BASE_DIR / 'fonts'
 TEMP_DIR = BASE_DIR / 'temp'
 BACKGROUNDS_DIR = BASE_DIR / 'backgrounds'
+CACHE_DIR = BASE_DIR / 'cache'
 
-for dir_path in [AUDIO_DIR, OUTPUT_DIR, FONTS_DIR, TEMP_DIR, BACKGROUNDS_DIR]:
+for dir_path in [AUDIO_DIR, OUTPUT_DIR, FONTS_DIR, TEMP_DIR, BACKGROUNDS_DIR, CACHE_DIR]:
     dir_path.mkdir(exist_ok=True)
 
 # Hardware Acceleration Check
@@ -53,6 +58,8 @@ def check_nvenc_availability():
 
 GPU_AVAILABLE = check_nvenc_availability()
 MAX_WORKERS = 3 if GPU_AVAILABLE else 2 # Limit parallelism based on HW
+VIDEO_FPS = 30
+MIN_AYAH_DURATION = 3.0  # seconds on screen, even for very short ayahs
 
 RECITER_MAPPING = {
     "abdulbasit_murattal": "Abdul_Basit_Murattal_64kbps",
@@ -204,12 +211,8 @@ NATURE_BACKGROUNDS = [
 ]
 
 def validate_audio_url(url):
-    """Check if audio URL exists using HTTP HEAD request"""
-    try:
-        response = requests.head(url, timeout=5, allow_redirects=True)
-        return response.status_code == 200
-    except Exception:
-        return False
+    """Check if audio URL exists using HTTP HEAD request (shared pooled session)"""
+    return audio_fetch.head(url) == audio_fetch.OK
 
 def get_audio_url(reciter_folder, surah, ayah):
     """Generate audio URL with proper zero-padding"""
@@ -218,7 +221,7 @@ def get_audio_url(reciter_folder, surah, ayah):
     return f"https://everyayah.com/data/{reciter_folder}/{surah_str}{ayah_str}.mp3"
 
 def retry_operation(func, max_retries=3, delay=2):
-    """Retry failed operations automatically"""
+    """Retry failed operations automatically (jittered exponential backoff, delay = base seconds)"""
     for attempt in range(max_retries):
         try:
             result = func()
@@ -227,26 +230,94 @@ def retry_operation(func, max_retries=3, delay=2):
         except Exception as e:
             print(f"Attempt {attempt + 1} failed: {e}")
             if attempt < max_retries - 1:
-                time.sleep(delay)
+                time.sleep(audio_fetch.backoff_delay(attempt, base=delay))
     return None
 
 import quran_provider
+import quran_search
+import caption_renderer
+import caption_cache
+import caption_fit
+import caption_effects
+import ass_captions
+import captions
+import caption_pool
+import caption_pages
+import mp3_probe
+import audio_fetch
+import audio_cache
+import audio_pack
+import audio_pcm
+import audio_aac
+import audio_manifest
+import audio_analysis
+import audio_visual
+import background_proxy
+import background_index
 
+# Rendered captions survive across requests (cleanup_temp_files never touches them)
+CAPTION_CACHE = caption_cache.CaptionCache(
+    CACHE_DIR / 'captions',
+    max_bytes=int(os.environ.get('CAPTION_CACHE_MB', 512)) * 1024 * 1024,
+    memory_bytes=int(os.environ.get('CAPTION_CACHE_MEMORY_MB', 64)) * 1024 * 1024
+)
 
-def download_audio_with_fallback(reciter, surah, ayah):
-    """
-    Download audio with automatic fallback chain.
-    GUARANTEED to return valid audio - NEVER fails.
-    
-    Fallback order:
-    1. Try requested reciter
-    2. Try reciter's configured fallback
-    3. Try guaranteed fallback (Alafasy)
-    """
-    reciter_key = reciter.replace('/', '_')
-    surah_str = str(surah).zfill(3)
-    ayah_str = str(ayah).zfill(3)
-    
+# Downloaded ayah audio: indexed, byte-budgeted (AUDIO_CACHE_MB), LRU-evicted,
+# with pinned reciters/surahs (AUDIO_CACHE_PINS) kept resident
+AUDIO_CACHE = audio_cache.AudioCache(AUDIO_DIR)
+
+# Optional packed store (one pack file per reciter, see audio_pack.py).
+# AUDIO_STORE=packed writes new downloads there; packs are always read first.
+AUDIO_STORE = os.environ.get('AUDIO_STORE', 'loose')
+AUDIO_PACKS = audio_pack.PackStore(CACHE_DIR / 'audio_packs')
+
+# Audio already transcoded to the output AAC profile (per-ayah reel segments and
+# single ayahs), muxed with stream copy; bounded by AUDIO_AAC_CACHE_MB
+AAC_CACHE = audio_aac.AacCache(CACHE_DIR / 'audio_aac')
+
+# Which ayahs each reciter is known to have / lack upstream (404s expire after
+# AUDIO_NEGATIVE_TTL), so the fallback chain skips known gaps without a request
+AUDIO_MANIFEST = audio_manifest.AvailabilityManifest(CACHE_DIR / 'audio_manifest.json')
+
+# Backgrounds pre-transcoded to the output format (1080x1920, 30 fps, filtered),
+# built once per source file by a background ingest thread
+BACKGROUND_PROXIES = background_proxy.ProxyLibrary(CACHE_DIR / 'bg_proxies')
+_proxy_ingest = None
+
+# Duration / resolution / fps / keyframes of every background input, probed once
+BACKGROUND_INDEX = background_index.BackgroundIndex(CACHE_DIR / 'backgrounds.json')
+
+
+def ensure_background_proxies():
+    """Starts the ingest thread for backgrounds that have no current proxy yet (one at a time)."""
+    global _proxy_ingest
+    if _proxy_ingest and _proxy_ingest.is_alive():
+        return False
+
+    def run():
+        sources = sorted(BACKGROUNDS_DIR.glob("*.mp4"))
+        counts = BACKGROUND_PROXIES.ingest(sources)
+        # index the new proxies now rather than in the next request
+        BACKGROUND_INDEX.describe([p for p in (BACKGROUND_PROXIES.get(bg, build=False) for bg in sources) if p])
+        print(f"[OK] Background proxies: {counts['ready']} ready, {counts['failed']} failed")
+
+    _proxy_ingest = threading.Thread(target=run, daemon=True)
+    _proxy_ingest.start()
+    return True
+
+# Per-file analysis (R128 loudness), measured once per ayah file; renders apply
+# a linear gain towards AUDIO_LOUDNESS_TARGET ('off' disables it)
+AUDIO_ANALYSIS = audio_analysis.AnalysisCache(CACHE_DIR / 'audio_analysis')
+# Its stats go with the audio: dropped when a file is evicted / discarded here,
+# and at startup for audio other processes removed or repacked
+AUDIO_CACHE.on_remove = lambda names: AUDIO_ANALYSIS.forget(f"{name}:" for name in names)
+AUDIO_PACKS.on_remove = lambda specs: AUDIO_ANALYSIS.forget(f"{spec}:" for spec in specs)
+AUDIO_ANALYSIS.prune(lambda keys: audio_aac.stale_keys(keys, AUDIO_DIR))
+
+
+@functools.lru_cache(maxsize=None)
+def get_fallback_chain(reciter_key):
+    """Reciter keys to try, in order, for a requested reciter (built once per reciter)."""
     # Build fallback chain
     fallback_chain = []
     
@@ -271,7 +342,25 @@ def download_audio_with_fallback(reciter, surah, ayah):
     # Always add guaranteed fallback at the end
     if GUARANTEED_FALLBACK not in fallback_chain:
         fallback_chain.append(GUARANTEED_FALLBACK)
+    return tuple(fallback_chain)
+
+
+def download_audio_with_fallback(reciter, surah, ayah):
+    """
+    Download audio with automatic fallback chain.
+    GUARANTEED to return valid audio - NEVER fails.
     
+    Fallback order:
+    1. Try requested reciter
+    2. Try reciter's configured fallback
+    3. Try guaranteed fallback (Alafasy)
+    """
+    reciter_key = reciter.replace('/', '_')
+    surah_str = str(surah).zfill(3)
+    ayah_str = str(ayah).zfill(3)
+    
+    # Fallbacks known to have the ayah go first, reciters known to be missing it last
+    fallback_chain = AUDIO_MANIFEST.viable(get_fallback_chain(reciter_key), surah, ayah)
     print(f"  Audio fallback chain: {' -> '.join(fallback_chain)}")
     
     # Try each reciter in the fallback chain
@@ -284,29 +373,38 @@ def download_audio_with_fallback(reciter, surah, ayah):
         audio_filename = f"{try_reciter}_{surah_str}_{ayah_str}.mp3"
         audio_path = AUDIO_DIR / audio_filename
         
-        # Check cache first
-        if audio_path.exists() and audio_path.stat().st_size > 0:
+        # Check cache first (index lookups; the disk only for files another process added)
+        packed = AUDIO_PACKS.lookup(try_reciter, surah, ayah)
+        if packed:
+            print(f"✓ Using packed audio: {audio_filename}")
+            return packed
+        cached_path = AUDIO_CACHE.lookup(try_reciter, surah, ayah)
+        if cached_path:
             print(f"✓ Using cached audio: {audio_filename}")
-            return str(audio_path)
+            return cached_path
         
         # Build URL and validate
         url = get_audio_url(reciter_folder, surah, ayah)
         
-        # Try to download
+        # Try to download (pooled keep-alive session, streamed to a temp file, retried with backoff)
         try:
             print(f"  Trying: {try_reciter} ({reciter_folder})")
-            response = requests.get(url, timeout=30)
-            
-            if response.status_code == 200 and len(response.content) > 1000:
-                with open(audio_path, 'wb') as f:
-                    f.write(response.content)
-                
-                if audio_path.stat().st_size > 0:
-                    if try_reciter != reciter_key:
-                        print(f"✓ Using fallback reciter: {reciter_info['display']}")
-                    else:
-                        print(f"✓ Audio saved: {audio_filename}")
-                    return str(audio_path)
+            if AUDIO_STORE == 'packed':
+                audio_path = TEMP_DIR / audio_filename
+            status = audio_fetch.fetch(url, audio_path, min_bytes=1000)
+            if status == audio_fetch.MISSING:
+                AUDIO_MANIFEST.mark_missing(try_reciter, surah, ayah)
+            if status == audio_fetch.OK:
+                AUDIO_MANIFEST.mark_available(try_reciter, surah, ayah)
+                if AUDIO_STORE == 'packed':
+                    audio_path = AUDIO_PACKS.put_file(try_reciter, surah, ayah, audio_path)
+                else:
+                    AUDIO_CACHE.record(try_reciter, surah, ayah)
+                if try_reciter != reciter_key:
+                    print(f"✓ Using fallback reciter: {reciter_info['display']}")
+                else:
+                    print(f"✓ Audio saved: {audio_filename}")
+                return str(audio_path)
         except Exception as e:
             print(f"  ✗ Failed for {try_reciter}: {e}")
             continue
@@ -319,12 +417,35 @@ def download_audio(reciter, surah, ayah):
     """Download audio with caching and automatic fallback (wrapper for compatibility)"""
     return download_audio_with_fallback(reciter, surah, ayah)
 
+def prefetch_audio(reciter, ayahs, progress=None):
+    """
+    Resolves the audio of every (surah, ayah, ...) in parallel (AUDIO_WORKERS threads,
+    shared keep-alive connections). Same per-ayah fallback chain as download_audio.
+    Returns paths (None where every fallback failed) in ayah order.
+    """
+    return audio_fetch.prefetch(
+        ayahs,
+        lambda item: download_audio_with_fallback(reciter, item[0], item[1]),
+        progress=progress
+    )
+
 def get_audio_duration(audio_path):
-    """Get audio duration safely"""
+    """Get audio duration safely (MP3 frame headers first, full decode as a last resort)"""
+    if audio_pack.is_spec(audio_path):
+        # packed ayah: probe its bytes in place
+        data = audio_pack.read_spec(audio_path)
+        source = io.BytesIO(data)
+        info = mp3_probe.probe(data)
+        duration = info['duration'] if info else None
+    else:
+        source = audio_path
+        duration = mp3_probe.duration(audio_path)
+    if duration:
+        return max(duration, MIN_AYAH_DURATION)
     try:
-        audio = AudioSegment.from_mp3(audio_path)
+        audio = AudioSegment.from_mp3(source)
         duration = len(audio) / 1000.0
-        return max(duration, 3.0)
+        return max(duration, MIN_AYAH_DURATION)
     except Exception as e:
         print(f"Error getting duration: {e}")
         return 5.0
@@ -351,23 +472,34 @@ def download_background_video(url, output_path):
     
     return retry_operation(download, max_retries=2)
 
-def get_unique_backgrounds(num_needed):
-    """Get unique backgrounds for each ayah - no repetition in same reel"""
-    existing_backgrounds = list(BACKGROUNDS_DIR.glob("*.mp4"))
+def get_background_windows(durations):
+    """
+    One (background, start offset) per clip, from the background index
+    (background_index.py): keyframe-aligned windows long enough for each
+    clip, different footage from clip to clip. Offsets are taken from the
+    video the clip will read - the background's proxy when it has one.
+    """
+    existing_backgrounds = sorted(BACKGROUNDS_DIR.glob("*.mp4"))
     
     if not existing_backgrounds:
         print("✗ CRITICAL: No real nature videos in backgrounds/ folder.")
         print("✗ Aborting execution. Gradient/solid colors are FORBIDDEN.")
         return None
     
-    # Shuffle and select unique backgrounds (cycle if needed)
-    random.shuffle(existing_backgrounds)
-    selected = []
-    for i in range(num_needed):
-        selected.append(str(existing_backgrounds[i % len(existing_backgrounds)]))
+    inputs = [BACKGROUND_PROXIES.get(bg, build=False) or str(bg) for bg in existing_backgrounds]
+    infos = BACKGROUND_INDEX.describe(inputs)
+    windows = background_index.select_windows(list(zip(map(str, existing_backgrounds), infos)), durations)
+    if not windows:
+        print("✗ CRITICAL: No background video could be read.")
+        return None
     
-    print(f"✓ Selected {num_needed} unique backgrounds from {len(existing_backgrounds)} available")
-    return selected
+    print(f"✓ Selected {len(windows)} background windows from {len(existing_backgrounds)} available")
+    return windows
+
+def get_unique_backgrounds(num_needed):
+    """Get unique backgrounds for each ayah - no repetition in same reel (paths only)"""
+    windows = get_background_windows([0.0] * num_needed)
+    return [bg for bg, _ in windows] if windows else None
 
 def get_background_video(duration):
     """Get a single background video (legacy compatibility)"""
@@ -468,147 +600,162 @@ def validate_quran_glyph_support(font_path, test_text):
 
 
 
-def create_text_overlay_png(text, width=1080, height=1920, font_size=None):
+def create_text_overlay_png(text, width=1080, height=1920, font_size=None, effects=None):
     """
     Create text overlay with authentic Quran rendering.
     
+    Only the inked area of the width x height frame is stored. Returns
+    {'path', 'x', 'y', 'width', 'height'} - the PNG and where it sits on the frame.
+    effects is a normalized caption_effects spec (stroke/shadow/glow), baked
+    into the PNG once.
+    
     CRITICAL CORRECTNESS REQUIREMENT:
     - Text is rendered EXACTLY as received from Uthmani source
     - NO reshaping, NO bidi transformation, NO preprocessing
-    - UthmanTNB font handles Arabic RTL and ligatures natively
+    - The renderer backend (GDI or HarfBuzz/raqm) handles Arabic RTL and ligatures
     - Tashkeel (diacritics) MUST remain identical to source
     """
     print(f"Creating Quran caption overlay (preserving tashkeel)...")
     
-    # Create transparent canvas
-    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
-    
     # Load Quran font
     font_path = find_quran_font()
     if not font_path:
         print("[ERROR] No Quran font found! Cannot create caption.")
         return None
     
-    # Dynamic font size based on text length
-    text_length = len(text)
-    if font_size is None:
-        if text_length > 200:
-            font_size = 85
-        elif text_length > 100:
-            font_size = 100
-        elif text_length > 50:
-            font_size = 120
-        else:
-            font_size = 140
-    
+    return captions.render_caption(text, font_path, CAPTION_CACHE, width, height, effects)
+
+
+def assemble_reel_audio(audio_data):
+    """
+    Joins every ayah's audio into one gapless track from the per-ayah AAC
+    segments in the AAC cache (each decoded and encoded once, ever; see
+    audio_aac.py) and sets each item's 'start' / 'duration' from its
+    timestamp table, rounded to whole video frames. Returns the track path,
+    or None to fall back to per-clip audio.
+    """
+    start = time.perf_counter()
+    sources = [item['audio'] for item in audio_data]
+    # loudness gains from the cached R128 stats (measured here only the first time)
+    gains = None
+    if audio_analysis.loudness_target() is not None:
+        gains = audio_analysis.measure_all(AUDIO_ANALYSIS.gain, sources)
+        AUDIO_ANALYSIS.flush()
+    track = TEMP_DIR / f"reel_audio_{int(time.time())}_{random.randint(1000,9999)}.aac"
     try:
-        font = ImageFont.truetype(font_path, font_size)
-        print(f"[OK] Using font: {os.path.basename(font_path)} (size: {font_size})")
+        table, cached = AAC_CACHE.track(
+            sources, str(track), gains=gains, gap=audio_pcm.default_gap(), min_duration=MIN_AYAH_DURATION
+        )
     except Exception as e:
-        print(f"[ERROR] Font loading failed: {e}")
+        print(f"[WARN] Gapless audio assembly failed ({e}), muxing audio per clip")
         return None
-    
-    # Safe margins to prevent edge clipping
-    margin = 100
-    max_width = width - (margin * 2)
-    
-    # Safe margins
-    margin = 50 
-    max_width = width - (margin * 2)
-    max_height = height - (margin * 2)
-    
-    # Sanitize Text: Collapse specific whitespace but NEVER touch Tashkeel
-    if text:
-        text = " ".join(text.split())
-    
-    # Text Processing: GDI handles shaping. We just pass the Uthmani text.
-    # Font Logic: Use GDI renderer
-    import windows_renderer
-    
+
+    # clip boundaries on the video frame nearest each slot boundary: at most
+    # half a frame off the audio, and the error does not add up along the reel
+    for item, slot in zip(audio_data, table):
+        first, last = round(slot['start'] * VIDEO_FPS), round(slot['end'] * VIDEO_FPS)
+        item['start'] = first / VIDEO_FPS
+        item['duration'] = (last - first) / VIDEO_FPS
+    source = "cached segments" if cached else "encoded missing segments"
+    print(f"[OK] Reel audio: {len(table)} ayahs, {table[-1]['end']:.2f}s, {source} in {time.perf_counter() - start:.2f}s")
+    return str(track)
+
+
+def paginate_captions(audio_data, width=1080, height=1920):
+    """
+    Splits ayahs whose caption would be too small into pages timed to the
+    recitation (caption_pages.py): item['pages'] = [{'text', 'start', 'end'}],
+    seconds from the clip start. Pause maps of those ayahs come from
+    AUDIO_ANALYSIS (analysed in parallel, once per audio file).
+    """
+    minimum = caption_pages.min_font()
     font_path = find_quran_font()
-    if not font_path:
-        return None
-        
-    # Load into GDI (safe to call multiple times)
-    windows_renderer.load_private_font(font_path)
-    # Exact Face Name from verify step
-    font_face_name = "Amiri" 
-    
-    # Dynamic Font Sizing (Iterative Fit)
-    max_font_size = 120 # Reduced from 150 as requested
-    min_font_size = 40
-    current_font_size = max_font_size
-    
-    print(f"  Calculating optimal font size for {len(text)} chars...")
-    
-    while current_font_size >= min_font_size:
-        # Measure height given the fixed width
-        measured_height = windows_renderer.measure_text_height(
-            text, 
-            font_face_name, 
-            current_font_size, 
-            max_width
+    if not minimum or not font_path:
+        return
+    try:
+        renderer = caption_renderer.get_renderer(font_path)
+    except Exception:
+        renderer = None  # reported by the caption stage; sizes are estimated
+
+    box = (width - 2 * captions.MARGIN, height - 2 * captions.MARGIN)
+    paged = []
+    for item in audio_data:
+        count = caption_pages.page_count(item['text'], renderer, *box, minimum, item['surah'], item['ayah_num'])
+        if count > 1:
+            paged.append((item, count))
+    if not paged:
+        return
+
+    pause_maps = audio_analysis.measure_all(AUDIO_ANALYSIS.pauses, [item['audio'] for item, _ in paged])
+    AUDIO_ANALYSIS.flush()
+    for (item, count), pause_map in zip(paged, pause_maps):
+        item['pages'] = caption_pages.paginate(
+            item['text'], count, pause_map, item['duration'], item['surah'], item['ayah_num']
         )
-        
-        # Check if fits nicely
-        if measured_height <= max_height:
-            print(f"  [FIT] Size {current_font_size} -> Height {measured_height}px (Max {max_height}px)")
-            font_size = current_font_size
-            break
-        
-        current_font_size -= 5
-    else:
-        print(f"  [WARN] Text too long, using minimum size {min_font_size}")
-        font_size = min_font_size
+        breaks = ", ".join(f"{page['start']:.1f}s" for page in item['pages'][1:])
+        print(f"  [{item['surah']}:{item['ayah_num']}] {count} caption pages, breaks at {breaks}")
 
-    # Render using Windows GDI
-    print(f"[RENDER] using Windows GDI Native Engine. Size: {font_size}")
-    
+
+def create_ass_captions(audio_data, width=1080, height=1920, effects=None):
+    """
+    Caption mode 'ass': writes one ASS subtitle track for the whole reel (one
+    timed event per ayah, or per caption page, same fitted sizes as the PNG
+    path) and points every item's 'text_img' at it with the clip's start offset.
+    """
+    font_path = find_quran_font()
+    if not font_path:
+        return False
+
+    margin = 50
     try:
-        final_img = windows_renderer.render_text_to_image(
-            text, 
-            font_face_name, 
-            font_size, 
-            width, 
-            height,
-            text_color=(255, 255, 255) # White
-        )
-        
-        # Add a Stroke? GDI path is hard.
-        # But we can simulate stroke in PIL using the output image alpha?
-        # Or just rely on shadow (GDI render supports shadow if we draw twice).
-        # Our renderer creates white text.
-        # Let's add stroke/shadow using basic image processing if needed.
-        # For now, clean white text is better than broken text.
-        # We can add a simple Drop Shadow by rendering black text first?
-        # windows_renderer creates a single image.
-        
-        # Better: Draw Stroke in PIL using the alpha channel from GDI result.
-        # Or just keep it clean. User asked for "Optional stroke".
-        # Let's add a Drop Shadow using image offset.
-        
-        # Save
-        filename = f"text_{abs(hash(text))}_{random.randint(1000,9999)}.png"
-        filepath = TEMP_DIR / filename
-        final_img.save(filepath, "PNG")
-        
-        print(f"[OK] GDI Caption generated: {filename}")
-        return str(filepath)
-        
+        renderer = caption_renderer.get_renderer(font_path)
     except Exception as e:
-        print(f"[ERROR] GDI Render failed: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
-    
+        renderer = None
+        print(f"[WARN] Caption renderer unavailable ({e}), using length-based font sizes")
+
+    events = []
+    start = 0.0
+    for item in audio_data:
+        start = item.get('start', start)
+        pages = item.get('pages') or [{'text': item['text'], 'start': 0.0, 'end': item['duration']}]
+        for page in pages:
+            text = " ".join(page['text'].split())
+            if renderer:
+                font_size, _ = caption_fit.fit_font_size(renderer, text, width - 2 * margin, height - 2 * margin)
+            else:
+                font_size = caption_fit.estimate_font_size(text)
+            events.append((start + page['start'], start + page['end'], text, font_size))
+        item['caption_offset'] = start
+        start += item['duration']
+
+    ass_path = TEMP_DIR / f"captions_{int(time.time())}_{random.randint(1000,9999)}.ass"
+    try:
+        ass_captions.write_script(ass_path, events, font_path, effects, width, height)
+    except Exception as e:
+        print(f"[ERROR] Subtitle track failed: {e}")
+        return False
+
+    for item in audio_data:
+        item['text_img'] = {'ass': str(ass_path), 'offset': item.pop('caption_offset')}
+    print(f"[OK] Caption track: {len(events)} events -> {ass_path.name}")
+    return True
 
 
 def prepare_background_segment(bg_video, duration, start_offset=0):
     """
     Prepare background segment: loop if needed, trim to duration, apply dark overlay
     Supports GPU acceleration if available.
+    With a proxy (background_proxy.py) there is nothing to prepare: the proxy is
+    returned as is and create_final_reel loops / trims it in the clip encode.
+    Without one, the ingest thread is started and this clip is prepared the old way.
+    start_offset: where the clip starts in the background (seeked before decoding);
+    a proxy is returned untrimmed, create_final_reel seeks it (bg_offset).
     """
+    proxy = BACKGROUND_PROXIES.get(bg_video, build=False)
+    if proxy:
+        return proxy
+    ensure_background_proxies()
+
     output_path = TEMP_DIR / f"bg_prepared_{int(time.time())}_{random.randint(1000,9999)}.mp4" # Unique name for parallelism
     
     # Encoder settings
@@ -618,17 +765,12 @@ def prepare_background_segment(bg_video, duration, start_offset=0):
     # Filter chain
     # Note: GPU scaling (scale_cuda) would require full CUDA pipeline, sticking to CPU filters for compatibility
     # unless we are sure input format is compatible. To be safe, we use software filters with NVENC encoding.
-    filters = [
-        f'scale=1080:1920:force_original_aspect_ratio=increase',
-        f'crop=1080:1920',
-        f'eq=brightness=-0.15:contrast=1.1',
-        f'gblur=sigma=1.5'
-    ]
-    filter_graph = ','.join(filters)
+    filter_graph = ','.join(background_proxy.FILTERS)
 
     cmd = [
         'ffmpeg', '-y',
         '-stream_loop', '-1',
+        *(['-ss', f'{start_offset:.3f}'] if start_offset else []),
         '-i', bg_video,
         '-vf', filter_graph,
         '-t', str(duration),
@@ -643,7 +785,7 @@ def prepare_background_segment(bg_video, duration, start_offset=0):
         
     cmd.extend([
         '-pix_fmt', 'yuv420p',
-        '-r', '30', # Standardization
+        '-r', str(VIDEO_FPS), # Standardization
         '-an',
         str(output_path)
     ])
@@ -656,12 +798,21 @@ def prepare_background_segment(bg_video, duration, start_offset=0):
         print(f"✗ Background preparation failed: {e}")
         return None
 
-def create_final_reel(bg_video, text_overlay, audio_path, output_path):
+def create_final_reel(bg_video, text_overlay, audio_path, output_path, duration=None, visual=None, bg_offset=0.0):
     """
     Create final reel: overlay text on background with audio.
+    bg_video is a background proxy or prepared segment (looped if shorter than the clip),
+    read from bg_offset seconds (input seek, see background_index.py).
+    text_overlay is the caption dict from create_text_overlay_png (tight PNG + position),
+    {'pages': [caption dict + 'start' / 'end']} for a paged caption, or, in 'ass'
+    caption mode, {'ass': track path, 'offset': clip start in the reel}.
+    audio_path None renders a video-only clip (the reel's gapless track is muxed
+    in by concatenate_videos_fast).
+    visual: audio_visual.write_strip() spec + 'x' / 'y', bars overlaid on top.
     Supports GPU acceleration and Fade Transitions.
     """
-    duration = get_audio_duration(audio_path)
+    if duration is None:
+        duration = get_audio_duration(audio_path)
     
     video_codec = 'h264_nvenc' if GPU_AVAILABLE else 'libx264'
     preset = 'p4' if GPU_AVAILABLE else 'ultrafast'
@@ -670,17 +821,55 @@ def create_final_reel(bg_video, text_overlay, audio_path, output_path):
     fade_in_duration = 0.5
     fade_out_start = max(0, duration - 0.5)
     
+    fades = f'fade=t=in:st=0:d={fade_in_duration},fade=t=out:st={fade_out_start}:d={fade_in_duration}'
+    
+    background = ['-stream_loop', '-1', *(['-ss', f'{bg_offset:.3f}'] if bg_offset else []), '-i', bg_video]
+    
+    if 'ass' in text_overlay:
+        # Subtitle track for the whole reel, shifted to this clip's start and burned in
+        captions = ass_captions.ass_filter(text_overlay['ass'], FONTS_DIR, text_overlay['offset'])
+        inputs = list(background)
+        graph = f'[0:v]{captions}[base]'
+    elif 'pages' in text_overlay:
+        # one looped PNG input per page, each overlaid only during its time window
+        inputs = list(background)
+        steps = []
+        previous = '0:v'
+        for k, page in enumerate(text_overlay['pages'], start=1):
+            inputs += ['-loop', '1', '-i', page['path']]
+            label = 'base' if k == len(text_overlay['pages']) else f'p{k}'
+            window = f"gte(t,{page['start']})" + (f"*lt(t,{page['end']})" if label != 'base' else '')
+            steps.append(f"[{previous}][{k}:v]overlay={page['x']}:{page['y']}:enable='{window}'[{label}]")
+            previous = label
+        graph = ';'.join(steps)
+    else:
+        inputs = [*background, '-loop', '1', '-i', text_overlay['path']]
+        graph = f'[0:v][1:v]overlay={text_overlay["x"]}:{text_overlay["y"]}[base]'
+
+    base = 'base'
+    if visual:
+        # audio-reactive bars: one raw mask stream, composited in this same encode
+        source = f"{inputs.count('-i')}:v"
+        inputs += audio_visual.ffmpeg_input(visual)
+        graph += ';' + audio_visual.overlay_filter(visual, source, base, 'bars', visual['x'], visual['y'])
+        base = 'bars'
+    graph += f';[{base}]{fades}[v]'
+    
+    if audio_path:
+        audio_map = ['-map', f"{inputs.count('-i')}:a"]
+        # pre-transcoded AAC is stream-copied; encode only if the transcode failed
+        aac_path = AAC_CACHE.ayah(audio_path, AUDIO_ANALYSIS.gain(audio_path))
+        inputs += ['-i', aac_path or audio_path]
+        audio_codec = ['-c:a', 'copy'] if aac_path else ['-c:a', 'aac', '-b:a', '192k']
+    else:
+        audio_map, audio_codec = [], ['-an']
+    
     cmd = [
         'ffmpeg', '-y',
-        '-i', bg_video,
-        '-loop', '1',
-        '-i', text_overlay,
-        '-i', audio_path,
-        '-filter_complex',
-        f'[0:v][1:v]overlay=(W-w)/2:(H-h)/2[base];'
-        f'[base]fade=t=in:st=0:d={fade_in_duration},fade=t=out:st={fade_out_start}:d={fade_in_duration}[v]',
+        *inputs,
+        '-filter_complex', graph,
         '-map', '[v]',
-        '-map', '2:a',
+        *audio_map,
         '-c:v', video_codec,
         '-preset', preset,
     ]
@@ -691,10 +880,9 @@ def create_final_reel(bg_video, text_overlay, audio_path, output_path):
         cmd.extend(['-crf', '26'])
         
     cmd.extend([
-        '-c:a', 'aac',
-        '-b:a', '192k',
+        *audio_codec,
         '-pix_fmt', 'yuv420p',
-        '-r', '30',
+        '-r', str(VIDEO_FPS),
         '-t', str(duration),
         '-movflags', '+faststart',
         output_path
@@ -708,9 +896,9 @@ def create_final_reel(bg_video, text_overlay, audio_path, output_path):
         print(f"✗ Reel creation failed: {e}")
         return False
 
-def concatenate_videos_fast(video_files, output_path):
-    """Fast concatenation with stream copy"""
-    if len(video_files) == 1:
+def concatenate_videos_fast(video_files, output_path, audio_track=None):
+    """Fast concatenation with stream copy (audio_track: the reel's gapless audio, muxed as-is)"""
+    if len(video_files) == 1 and not audio_track:
         import shutil
         shutil.copy2(video_files[0], output_path)
         return True
@@ -727,9 +915,14 @@ def concatenate_videos_fast(video_files, output_path):
         '-f', 'concat',
         '-safe', '0',
         '-i', str(list_file),
+    ]
+    if audio_track:
+        cmd.extend(['-i', audio_track, '-map', '0:v', '-map', '1:a'])
+    cmd.extend([
         '-c', 'copy',
+        '-movflags', '+faststart',
         output_path
-    ]
+    ])
     
     try:
         subprocess.run(cmd, check=True, capture_output=True, timeout=60)
@@ -762,6 +955,10 @@ def cleanup_temp_files():
         pass
 
 
+# /generate selectors that pick a structural division instead of surah + range
+# (a kind without boundary data in quran_provider is answered with 400)
+DIVISION_SELECTORS = quran_provider.DIVISION_KINDS
+
 # Progress State
 generation_status = {
     "progress": 0,
@@ -784,27 +981,60 @@ def generate_video():
         update_progress(5, "Starting generation...")
         data = request.json
         reciter = data.get('reciter')
-        surah = int(data.get('surah'))
-        full_surah = data.get('full_surah', False) # Check for boolean flag
-        
-        # Determine range
-        if not full_surah:
-            ayah_from = int(data.get('ayah_from'))
-            ayah_to = int(data.get('ayah_to'))
+
+        # Structural selector (juz / hizb / quarter / manzil / page / ruku) - may span surahs
+        division = next((kind for kind in DIVISION_SELECTORS if data.get(kind) is not None), None)
+        if division:
+            if division not in quran_provider.division_kinds():
+                data_file = os.path.basename(quran_provider.QURAN_DATA_FILE)
+                return jsonify({'error': f"{division} selection needs {data_file} in quran_text, which is not installed"}), 400
+            try:
+                division_num = int(data.get(division))
+            except (TypeError, ValueError):
+                return jsonify({'error': f"{division} must be a number"}), 400
+            count = quran_provider.division_count(division)
+            if not 1 <= division_num <= count:
+                return jsonify({'error': f"{division} must be between 1 and {count}"}), 400
+            surah = None
+            mode = f"{division.upper()} {division_num}"
         else:
-            # Full Surah mode: Range ignored by text provider, but helpful for logs
-            ayah_from = 1 
-            ayah_to = "END" 
-        
-        if not reciter or not surah:
+            surah = int(data.get('surah'))
+            full_surah = data.get('full_surah', False) # Check for boolean flag
+
+            # Determine range
+            if not full_surah:
+                ayah_from = int(data.get('ayah_from'))
+                ayah_to = int(data.get('ayah_to'))
+                mode = f"Range {ayah_from}-{ayah_to}"
+            else:
+                mode = "FULL SURAH"
+
+        if not reciter or not (surah or division):
             return jsonify({'error': 'Missing parameters'}), 400
+
+        # Stroke / shadow / glow for the captions (preset name or object)
+        try:
+            effects = caption_effects.normalize_effects(data.get('caption_effects'))
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Invalid caption_effects: {e}'}), 400
+
+        # 'png' = one overlay image per ayah, 'ass' = one subtitle track for the reel (libass)
+        caption_mode = data.get('caption_mode', 'png')
+        if caption_mode not in ass_captions.CAPTION_MODES:
+            return jsonify({'error': f"caption_mode must be one of {', '.join(ass_captions.CAPTION_MODES)}"}), 400
+
+        # Audio-reactive bars under the caption: 'off', 'spectrum' or 'wave'
+        visualizer = data.get('visualizer') or 'off'
+        if visualizer not in audio_visual.VISUAL_MODES:
+            return jsonify({'error': f"visualizer must be one of {', '.join(audio_visual.VISUAL_MODES)}"}), 400
         
         print(f"\n{'='*70}")
         print(f"🎬 AUTOMATIC QURAN REEL GENERATION (Strict Mode)")
         print(f"{'='*70}")
         print(f"  Reciter: {reciter}")
-        print(f"  Surah: {surah}")
-        print(f"  Mode: {'FULL SURAH' if full_surah else f'Range {ayah_from}-{ayah_to}'}")
+        if surah:
+            print(f"  Surah: {surah}")
+        print(f"  Mode: {mode}")
         print(f"{'='*70}\n")
         
         start_time = time.time()
@@ -813,73 +1043,119 @@ def generate_video():
         update_progress(10, "Fetching Quran text (Tanzil)...")
         print("[STEP 1/6] Fetching Uthmani text from local file...")
         
-        if full_surah:
-            texts = quran_provider.get_surah(surah)
-            start_ayah_num = 1
+        # [(surah, ayah, text), ...]
+        if division:
+            ayahs = quran_provider.get_division_ayahs(division, division_num)
+        elif full_surah:
+            ayahs = [(surah, i + 1, t) for i, t in enumerate(quran_provider.get_surah(surah))]
         else:
-            texts = quran_provider.get_range(surah, ayah_from, ayah_to)
-            start_ayah_num = ayah_from
+            ayahs = [(surah, ayah_from + i, t) for i, t in enumerate(quran_provider.get_range(surah, ayah_from, ayah_to))]
             
-        if not texts:
-            return jsonify({'error': f'Failed to fetch text for Surah {surah}. Ensure quran_text/quran-uthmani.txt exists.'}), 500
+        if not ayahs:
+            target = mode if division else f"Surah {surah}"
+            return jsonify({'error': f'Failed to fetch text for {target}. Ensure quran_text/quran-uthmani.txt exists.'}), 500
             
-        print(f"  ✓ Retrieved {len(texts)} ayahs from Tanzil source.")
+        print(f"  ✓ Retrieved {len(ayahs)} ayahs from Tanzil source.")
         
         audio_data = []
         total_duration = 0
-        total_ayahs = len(texts)
+        total_ayahs = len(ayahs)
         
         # [STEP 2] Download Audio & Align
         update_progress(20, "Downloading high-quality audio...")
         print("\n[STEP 2/6] Processing Audio & Text Alignment...")
         
-        for i, text in enumerate(texts):
-            current_ayah = start_ayah_num + i
-            
-            # Progress interpolation for audio/render loop (20% -> 80%)
-            loop_progress = 20 + int((i / total_ayahs) * 60)
-            update_progress(loop_progress, f"Processing Ayah {current_ayah}...")
+        # Prefetch every ayah's audio concurrently (progress 20% -> 70%)
+        audio_paths = prefetch_audio(
+            reciter, ayahs,
+            progress=lambda done, total: update_progress(20 + int(done / total * 50), f"Downloading audio {done}/{total}...")
+        )
+        
+        for i, (ayah_surah, current_ayah, text) in enumerate(ayahs):
+            # Progress interpolation for the alignment loop (70% -> 78%)
+            loop_progress = 70 + int((i / total_ayahs) * 8)
+            update_progress(loop_progress, f"Processing Ayah {ayah_surah}:{current_ayah}...")
             
             # STRICT VALIDATION: Uthmani text must not be empty
             if not text or len(text.strip()) == 0:
-                 return jsonify({'error': f'CRITICAL: Empty text found for Ayah {current_ayah}'}), 500
+                 return jsonify({'error': f'CRITICAL: Empty text found for Ayah {ayah_surah}:{current_ayah}'}), 500
 
-            print(f"  [{current_ayah}] {text[:40]}...")
+            print(f"  [{ayah_surah}:{current_ayah}] {text[:40]}...")
             
-            audio_path = download_audio(reciter, surah, current_ayah)
+            audio_path = audio_paths[i]
             if not audio_path:
-                 return jsonify({'error': f'Failed to download audio for Ayah {current_ayah}'}), 500
+                 return jsonify({'error': f'Failed to download audio for Ayah {ayah_surah}:{current_ayah}'}), 500
                  
             duration = get_audio_duration(audio_path)
             total_duration += duration
             
-            # [STEP 3] Generate Caption Overlay (GDI Native)
-            caption_path = create_text_overlay_png(text)
-            if not caption_path:
-                return jsonify({'error': f'Caption rendering failed for Ayah {current_ayah}'}), 500
-            
             audio_data.append({
                 'audio': audio_path,
                 'duration': duration,
-                'text_img': caption_path,
+                'text': text,
+                'text_img': None,
+                'surah': ayah_surah,
                 'ayah_num': current_ayah
             })
+
+        # One gapless audio track for the whole reel; its timestamp table sets
+        # each clip's (frame-aligned) duration and caption timing
+        reel_audio = assemble_reel_audio(audio_data)
+
+        # [STEP 3] Generate Caption Overlays - PNGs in the caption process pool,
+        # or one ASS track for the whole reel. Long ayahs get timed pages.
+        update_progress(78, "Rendering captions...")
+        paginate_captions(audio_data)
+        if caption_mode == 'png':
+            font_path = find_quran_font()
+            if not font_path:
+                return jsonify({'error': 'Amiri-Quran.ttf not found, cannot render captions'}), 500
+            style = {'width': 1080, 'height': 1920, 'effects': effects}
+            jobs = []
+            for item in audio_data:
+                label = f"{item['surah']}:{item['ayah_num']}"
+                if item.get('pages'):
+                    jobs += [(f"{label}/{k + 1}", page['text'], style) for k, page in enumerate(item['pages'])]
+                else:
+                    jobs.append((label, item['text'], style))
+            results = iter(caption_pool.render_captions(jobs, font_path, CAPTION_CACHE))
+            for item in audio_data:
+                pages = item.get('pages') or [None]
+                rendered = [next(results) for _ in pages]
+                if not all(rendered):
+                    return jsonify({'error': f"Caption rendering failed for Ayah {item['surah']}:{item['ayah_num']}"}), 500
+                if item.get('pages'):
+                    item['text_img'] = {'pages': [dict(caption, start=page['start'], end=page['end'])
+                                                  for caption, page in zip(rendered, pages)]}
+                else:
+                    item['text_img'] = rendered[0]
+        elif caption_mode == 'ass':
+            if not create_ass_captions(audio_data, effects=effects):
+                return jsonify({'error': 'Caption subtitle track could not be created'}), 500
         
         # [STEP 4] Background Sourcing (Nature/Abstract)
         update_progress(80, "Selecting Ultra-HD backgrounds...")
         print("\n[STEP 4/6] Sourcing Backgrounds...")
         
-        bg_videos = get_unique_backgrounds(len(audio_data))
-        if not bg_videos:
+        bg_windows = get_background_windows([item['duration'] for item in audio_data])
+        if not bg_windows:
              return jsonify({'error': 'Failed to source background videos'}), 500
+
+        # Per-frame envelopes for the bars (cached per audio file, computed in parallel)
+        envelopes = [None] * len(audio_data)
+        if visualizer != 'off':
+            envelopes = audio_analysis.measure_all(
+                lambda source: AUDIO_ANALYSIS.envelope(source, VIDEO_FPS),
+                [item['audio'] for item in audio_data]
+            )
              
         # [STEP 5] Create Individual Clips (PARALLEL)
         update_progress(85, "Rendering video clips (Parallel)...")
         print("\n[STEP 5/6] Creating Reel Segments with Parallel Processing...")
         
         def render_clip_task(args):
-            i, item, bg_video = args
-            audio_path = item['audio']
+            i, item, (bg_video, bg_offset) = args
+            audio_path = None if reel_audio else item['audio']
             text_overlay = item['text_img']
             duration = item['duration']
             
@@ -890,17 +1166,29 @@ def generate_video():
             print(f"  [Task {i+1}] Processing...")
             
             # Prepare background
-            bg_ready = prepare_background_segment(bg_video, duration)
+            bg_ready = prepare_background_segment(bg_video, duration, bg_offset)
             if not bg_ready:
                 print(f"  [Task {i+1}] Failed background")
                 return None
+            # a prepared segment already starts at the offset, a proxy is seeked in the clip encode
+            prepared = Path(bg_ready).parent == TEMP_DIR
+
+            visual = None
+            if envelopes[i] is not None:
+                strip_path = TEMP_DIR / f"bars_{i}_{random.randint(10000,99999)}.gray"
+                visual = audio_visual.write_strip(
+                    envelopes[i], visualizer, duration, VIDEO_FPS, strip_path, AUDIO_ANALYSIS.gain(item['audio'])
+                )
+                visual['x'], visual['y'] = audio_visual.placement(text_overlay if 'ass' not in text_overlay else None)
                 
             # Create clip
-            if create_final_reel(bg_ready, text_overlay, audio_path, str(clip_output)):
+            if create_final_reel(bg_ready, text_overlay, audio_path, str(clip_output), duration, visual,
+                                 bg_offset=0.0 if prepared else bg_offset):
                 print(f"  [Task {i+1}] Complete")
-                # Cleanup intermediate background
-                try: os.remove(bg_ready) 
-                except: pass
+                # Cleanup intermediate background (proxies are kept)
+                if prepared:
+                    try: os.remove(bg_ready) 
+                    except: pass
                 return str(clip_output)
             
             return None
@@ -908,7 +1196,7 @@ def generate_video():
         # Prepare tasks
         tasks = []
         for i, item in enumerate(audio_data):
-            tasks.append((i, item, bg_videos[i]))
+            tasks.append((i, item, bg_windows[i]))
             
         # Execute in parallel
         clips = []
@@ -945,16 +1233,27 @@ def generate_video():
              
         reciter_safe = reciter.replace('/', '_').replace('\\', '_')
         timestamp = int(time.time())
-        final_video_name = f"QuranReel_{reciter_safe}_{surah}_{timestamp}.mp4"
+        selection = f"{division}{division_num}" if division else surah
+        final_video_name = f"QuranReel_{reciter_safe}_{selection}_{timestamp}.mp4"
         final_video = OUTPUT_DIR / final_video_name
         
-        if concatenate_videos_fast(clips, str(final_video)):
+        if len(clips) != len(audio_data) and reel_audio:
+            return jsonify({'error': 'Some clips failed to render, reel audio would drift'}), 500
+        
+        if concatenate_videos_fast(clips, str(final_video), audio_track=reel_audio):
             print(f"✓ REEL COMPLETE: {final_video}")
             update_progress(100, "Done!")
         else:
             return jsonify({'error': 'Concatenation failed'}), 500
 
         cleanup_temp_files()
+        CAPTION_CACHE.flush()
+        AUDIO_CACHE.flush()
+        AUDIO_PACKS.flush()
+        AUDIO_MANIFEST.flush()
+        AUDIO_ANALYSIS.flush()
+        BACKGROUND_PROXIES.flush()
+        BACKGROUND_INDEX.flush()
         
         elapsed = time.time() - start_time
         video_filename = os.path.basename(final_video)
@@ -983,11 +1282,21 @@ def index():
 
 @app.route('/health')
 def health():
+    # the stores report running totals, so this does not walk their directories
+    audio_stats = AUDIO_CACHE.stats()
     return jsonify({
         'status': 'healthy',
         'backgrounds': len(list(BACKGROUNDS_DIR.glob("*.mp4"))),
-        'cached_audio': len(list(AUDIO_DIR.glob("*.mp3"))),
-        'outputs': len(list(OUTPUT_DIR.glob("*.mp4")))
+        'cached_audio': audio_stats['files'],
+        'outputs': len(list(OUTPUT_DIR.glob("*.mp4"))),
+        'caption_cache': CAPTION_CACHE.stats(),
+        'audio_cache': audio_stats,
+        'audio_packs': AUDIO_PACKS.stats(),
+        'aac_cache': AAC_CACHE.stats(),
+        'audio_hosts': audio_fetch.breaker.stats(),
+        'audio_analysis': AUDIO_ANALYSIS.stats(),
+        'background_proxies': BACKGROUND_PROXIES.stats(),
+        'background_index': BACKGROUND_INDEX.stats()
     })
 
 @app.route('/reciters')
@@ -1006,53 +1315,136 @@ def get_reciters():
         'guaranteed_fallback': GUARANTEED_FALLBACK
     })
 
+@app.route('/availability/probe', methods=['POST'])
+def probe_availability():
+    """
+    Background HEAD probe of a reciter's ayahs into the availability manifest.
+    Body: {"reciter": "husary", "surahs": [1, 2]} (all surahs when omitted).
+    """
+    data = request.json or {}
+    reciter_key = (data.get('reciter') or '').replace('/', '_')
+    if reciter_key not in VERIFIED_RECITERS:
+        return jsonify({'error': f'Unknown reciter: {reciter_key}'}), 400
+    surahs = data.get('surahs') or range(1, 115)
+    ayahs = [(s, a) for s in surahs for a in range(1, quran_provider.get_ayah_count(s) + 1)]
+    folder = VERIFIED_RECITERS[reciter_key]['folder']
+
+    def run():
+        counts = AUDIO_MANIFEST.probe(reciter_key, ayahs, lambda s, a: get_audio_url(folder, s, a))
+        print(f"[OK] Availability probe {reciter_key}: {counts}")
+
+    threading.Thread(target=run, daemon=True).start()
+    return jsonify({'started': True, 'reciter': reciter_key, 'ayahs': len(ayahs)}), 202
+
+@app.route('/backgrounds/ingest', methods=['POST'])
+def ingest_backgrounds():
+    """Builds missing background proxies in a background thread."""
+    started = ensure_background_proxies()
+    return jsonify({'started': started, 'backgrounds': len(list(BACKGROUNDS_DIR.glob("*.mp4")))}), 202
+
+@app.route('/search')
+def search_quran():
+    """
+    Diacritic-insensitive Quran search: /search?q=...&limit=20
+    Each result carries surah/ayah_from/ayah_to for /generate.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query parameter q'}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    start = time.perf_counter()
+    results = quran_search.search(query, limit=limit)
+    return jsonify({
+        'query': query,
+        'count': len(results),
+        'results': results,
+        'took_ms': round((time.perf_counter() - start) * 1000, 3)
+    })
+
+def check_ayah_availability(reciter_key, surah, ayah):
+    """
+    Where an ayah's audio would come from: local cache, the reciter's mirror,
+    or the guaranteed fallback. Upstream answers come from the availability
+    manifest when known (shared with the download path), else from a HEAD probe
+    that is recorded there.
+    """
+    # Check cache first
+    for try_reciter in [reciter_key, GUARANTEED_FALLBACK]:
+        if try_reciter in VERIFIED_RECITERS:
+            if AUDIO_PACKS.contains(try_reciter, surah, ayah) or AUDIO_CACHE.contains(try_reciter, surah, ayah):
+                return {'ayah': ayah, 'status': 'cached', 'reciter': try_reciter}
+
+    def upstream(try_reciter):
+        state = AUDIO_MANIFEST.state(try_reciter, surah, ayah)
+        if state is None:
+            url = get_audio_url(VERIFIED_RECITERS[try_reciter]['folder'], surah, ayah)
+            status = audio_fetch.head(url)
+            if status == audio_fetch.OK:
+                AUDIO_MANIFEST.mark_available(try_reciter, surah, ayah)
+            elif status == audio_fetch.MISSING:
+                AUDIO_MANIFEST.mark_missing(try_reciter, surah, ayah)
+            state = status == audio_fetch.OK
+        return state
+
+    # Check primary URL
+    if reciter_key in VERIFIED_RECITERS and upstream(reciter_key):
+        return {'ayah': ayah, 'status': 'available', 'reciter': reciter_key}
+
+    # Check fallback
+    if upstream(GUARANTEED_FALLBACK):
+        return {'ayah': ayah, 'status': 'fallback', 'reciter': GUARANTEED_FALLBACK}
+    return {'ayah': ayah, 'status': 'unavailable', 'reciter': None}
+
 @app.route('/validate', methods=['POST'])
 def validate_audio():
-    """Pre-validate audio availability for all requested ayahs"""
+    """
+    Pre-validate audio availability for all requested ayahs.
+    Ayahs are checked concurrently (AUDIO_WORKERS, pooled connections). With
+    "stream": true (or ?stream=1) the response is NDJSON: one line per ayah as
+    it resolves, then a summary line {"done": true, ...}.
+    """
     try:
         data = request.json
         reciter = data.get('reciter')
         surah = data.get('surah')
         ayah_from = data.get('ayah_from')
         ayah_to = data.get('ayah_to')
+        stream = data.get('stream') or request.args.get('stream') == '1'
         
         reciter_key = reciter.replace('/', '_')
-        results = []
-        all_available = True
-        
-        for ayah in range(ayah_from, ayah_to + 1):
-            # Check if we can get audio (with fallback)
-            surah_str = str(surah).zfill(3)
-            ayah_str = str(ayah).zfill(3)
-            
-            # Check cache first
-            for try_reciter in [reciter_key, GUARANTEED_FALLBACK]:
-                if try_reciter in VERIFIED_RECITERS:
-                    cache_file = AUDIO_DIR / f"{try_reciter}_{surah_str}_{ayah_str}.mp3"
-                    if cache_file.exists() and cache_file.stat().st_size > 0:
-                        results.append({'ayah': ayah, 'status': 'cached', 'reciter': try_reciter})
-                        break
-            else:
-                # Check primary URL
-                if reciter_key in VERIFIED_RECITERS:
-                    url = get_audio_url(VERIFIED_RECITERS[reciter_key]['folder'], surah, ayah)
-                    if validate_audio_url(url):
-                        results.append({'ayah': ayah, 'status': 'available', 'reciter': reciter_key})
-                        continue
-                
-                # Check fallback
-                fallback_url = get_audio_url(VERIFIED_RECITERS[GUARANTEED_FALLBACK]['folder'], surah, ayah)
-                if validate_audio_url(fallback_url):
-                    results.append({'ayah': ayah, 'status': 'fallback', 'reciter': GUARANTEED_FALLBACK})
-                else:
-                    results.append({'ayah': ayah, 'status': 'unavailable', 'reciter': None})
-                    all_available = False
-        
-        return jsonify({
-            'valid': all_available,
-            'results': results,
-            'message': 'All audio available' if all_available else 'Some audio may use fallback'
-        })
+        ayahs = list(range(ayah_from, ayah_to + 1))
+        resolved = audio_fetch.as_resolved(
+            ayahs, lambda ayah: check_ayah_availability(reciter_key, surah, ayah)
+        )
+
+        def summary(results):
+            all_available = all(r and r['status'] != 'unavailable' for r in results)
+            return {
+                'valid': all_available,
+                'message': 'All audio available' if all_available else 'Some audio may use fallback'
+            }
+
+        if stream:
+            def generate():
+                results = []
+                for i, result in resolved:
+                    result = result or {'ayah': ayahs[i], 'status': 'unavailable', 'reciter': None}
+                    results.append(result)
+                    yield json.dumps(result) + '\n'
+                AUDIO_MANIFEST.flush()
+                yield json.dumps(dict(summary(results), done=True)) + '\n'
+            return Response(generate(), mimetype='application/x-ndjson')
+
+        results = [None] * len(ayahs)
+        for i, result in resolved:
+            results[i] = result or {'ayah': ayahs[i], 'status': 'unavailable', 'reciter': None}
+        AUDIO_MANIFEST.flush()
+        return jsonify(dict(summary(results), results=results))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1067,6 +1459,9 @@ def open_browser():
         pass
 
 if __name__ == '__main__':
+    # frozen (PyInstaller) build: a spawned child process must not start the server
+    multiprocessing.freeze_support()
+
     print("\n" + "="*70)
     print("  🎬 AUTOMATIC QURAN REELS GENERATOR")
     print("  Fully Automated | No Manual Intervention")
@@ -1079,6 +1474,9 @@ if __name__ == '__main__':
     print("  Health: http://localhost:5000/health")
     print("="*70 + "\n")
     
+    # Proxies for new / changed backgrounds, built while the server is idle
+    ensure_background_proxies()
+
     # Auto-open browser after 1.5s
     Timer(1.5, open_browser).start()
     
@@ -0,0 +1,245 @@
+"""
+MP3 duration from frame headers, without decoding.
+
+    1. skip an ID3v2 tag, find the first valid MPEG audio frame
+    2. Xing/Info (or VBRI) tag in that frame: frame count -> duration,
+       minus the LAME encoder delay/padding (what gapless decoders drop)
+    3. no tag: walk frame headers to the end (CBR files from most encoders)
+
+Results are memoized per (path, size, mtime). duration() returns None when the
+file is not a parseable MP3, so callers can fall back to a decoder.
+"""
+import os
+import struct
+
+# bitrate (kbps) tables indexed by [version is MPEG-1][layer index]
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+# Frames that must parse back-to-back before a sync word is trusted
+_CONFIRM_FRAMES = 3
+_SCAN_LIMIT = 256 * 1024
+
+_cache = {}
+
+
+def _header(data, pos):
+    """Parses the frame header at pos: (frame_length, samples_per_frame, sample_rate, header) or None."""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version = (b1 >> 3) & 3       # 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+    layer = 4 - ((b1 >> 1) & 3)   # 1, 2, 3
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or mpeg1) else 576
+        length = (samples // 8) * bitrate // sample_rate + padding
+    return length, samples, sample_rate, (mpeg1, b3 >> 6)
+
+
+def _first_frame(data, start):
+    """Offset of the first frame confirmed by _CONFIRM_FRAMES consecutive headers."""
+    end = min(len(data), start + _SCAN_LIMIT)
+    pos = data.find(b'\xff', start, end)
+    while pos != -1:
+        frame = _header(data, pos)
+        if frame:
+            nxt, ok = pos, True
+            for _ in range(_CONFIRM_FRAMES):
+                current = _header(data, nxt)
+                if not current:
+                    ok = nxt >= len(data)  # a short file may end right after
+                    break
+                nxt += current[0]
+            if ok:
+                return pos, frame
+        pos = data.find(b'\xff', pos + 1, end)
+    return None, None
+
+
+def _id3v2_size(data):
+    if data[:3] != b'ID3' or len(data) < 10:
+        return 0
+    size = 0
+    for b in data[6:10]:
+        size = (size << 7) | (b & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _vbr_tag(data, pos, frame):
+    """(frame_count, encoder_delay, encoder_padding, kind) from a Xing/Info or VBRI tag, or None."""
+    length, samples, _, (mpeg1, channel_mode) = frame
+    mono = channel_mode == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+
+    xing = pos + 4 + side_info
+    tag = data[xing:xing + 4]
+    if tag in (b'Xing', b'Info'):
+        if xing + 12 > len(data):
+            return None  # truncated inside the tag
+        flags = struct.unpack_from('>I', data, xing + 4)[0]
+        if not flags & 1:
+            return None
+        frames = struct.unpack_from('>I', data, xing + 8)[0]
+        offset = xing + 8
+        for bit in (1, 2, 4):  # frames, bytes, TOC
+            if flags & bit:
+                offset += 100 if bit == 4 else 4
+        if flags & 8:          # quality
+            offset += 4
+        delay = padding = 0
+        # LAME extension: 9-byte encoder string ... delay/padding at +21 (12 bits each)
+        if data[offset:offset + 4] in (b'LAME', b'Lavf', b'Lavc') and offset + 24 <= min(pos + length, len(data)):
+            a, b, c = data[offset + 21:offset + 24]
+            delay = (a << 4) | (b >> 4)
+            padding = ((b & 0x0F) << 8) | c
+        return frames, delay, padding, 'xing'
+
+    vbri = pos + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI' and vbri + 18 <= len(data):
+        delay = struct.unpack_from('>H', data, vbri + 6)[0]
+        frames = struct.unpack_from('>I', data, vbri + 14)[0]
+        return frames, delay, 0, 'vbri'
+    return None
+
+
+def probe(data):
+    """
+    Parses MP3 bytes. Returns {'duration', 'sample_rate', 'frames', 'method'} or None.
+    duration is in seconds, without encoder delay/padding when the file says so.
+    """
+    pos, frame = _first_frame(data, _id3v2_size(data))
+    if frame is None:
+        return None
+    samples, sample_rate = frame[1], frame[2]
+
+    tag = _vbr_tag(data, pos, frame)
+    if tag and tag[0]:
+        frames, delay, padding, kind = tag
+        total = frames * samples - delay - padding
+        # The tag frame is silent; decoders skip it and the LAME delay (+529 decoder delay
+        # they compensate internally), so the sample count is exactly the above.
+        return {
+            'duration': max(total, 0) / sample_rate,
+            'sample_rate': sample_rate,
+            'frames': frames,
+            'method': kind,
+        }
+
+    # No tag: walk the frames (stops at trailing ID3v1/APE tags or garbage)
+    frames, total = 0, 0
+    size = len(data)
+    while pos < size:
+        current = _header(data, pos)
+        if not current:
+            break
+        frames += 1
+        total += current[1]
+        pos += current[0]
+    if not frames:
+        return None
+    return {
+        'duration': total / sample_rate,
+        'sample_rate': sample_rate,
+        'frames': frames,
+        'method': 'walk',
+    }
+
+
+def is_complete(data):
+    """
+    True when data's frames run back to back from the first one to the end
+    (a trailing ID3v1 / APE tag allowed), and, with a Xing/Info or VBRI tag,
+    there are at least as many as it announces. A download cut off
+    mid-file fails this even though its header still probes to the full
+    duration.
+    """
+    pos, frame = _first_frame(data, _id3v2_size(data))
+    if frame is None:
+        return False
+    tag = _vbr_tag(data, pos, frame)
+    frames, size = 0, len(data)
+    while pos < size:
+        current = _header(data, pos)
+        if not current:
+            break
+        if pos + current[0] > size:
+            return False  # last frame cut short
+        frames += 1
+        pos += current[0]
+    if pos < size and not data.startswith((b'TAG', b'APETAGEX', b'LYRICSBEGIN'), pos):
+        return False
+    # the tag frame itself is not counted in the tag
+    return not tag or frames - 1 >= tag[0]
+
+
+def duration(path):
+    """Duration in seconds of an MP3 file (memoized per path/size/mtime), or None."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    if key in _cache:
+        return _cache[key]
+
+    try:
+        with open(path, 'rb') as f:
+            info = probe(f.read())
+    except (OSError, struct.error):
+        info = None
+    result = info['duration'] if info else None
+    _cache[key] = result
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    import glob
+    import time
+    import subprocess
+
+    # Compare against a full ffmpeg decode: python mp3_probe.py [files...]
+    files = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'audio', '*.mp3')))
+    worst, probe_time, decode_time = 0.0, 0.0, 0.0
+    for path in files:
+        t = time.perf_counter()
+        with open(path, 'rb') as f:
+            info = probe(f.read())
+        probe_time += time.perf_counter() - t
+
+        t = time.perf_counter()
+        pcm = subprocess.run(['ffmpeg', '-v', 'error', '-i', path, '-f', 's16le', '-ac', '1', '-'],
+                             capture_output=True, check=True).stdout
+        decode_time += time.perf_counter() - t
+        rate = info['sample_rate'] if info else 44100
+        decoded = len(pcm) / 2 / rate
+
+        diff = abs(info['duration'] - decoded) * 1000 if info else float('inf')
+        worst = max(worst, diff)
+        mark = "✓" if diff <= 5 else "✗"
+        method = info['method'] if info else 'none'
+        print(f"  {mark} {os.path.basename(path)}  probe {info['duration'] if info else 0:.3f}s ({method})  decode {decoded:.3f}s  Δ {diff:.1f} ms")
+    if files:
+        print(f"[INFO] {len(files)} files, worst Δ {worst:.1f} ms, "
+              f"probe {probe_time * 1000:.1f} ms vs decode {decode_time * 1000:.0f} ms total")
@@ -1,94 +1,632 @@
 import os
-
-# Path to the single source of truth
 import sys
+import mmap
+import bisect
+import struct
+from array import array
 
 # Path to the single source of truth
 if getattr(sys, 'frozen', False):
-    QURAN_FILE = os.path.join(sys._MEIPASS, 'quran_text', 'quran-uthmani.txt')
+    QURAN_DIR = os.path.join(sys._MEIPASS, 'quran_text')
 else:
-    QURAN_FILE = os.path.join(os.path.dirname(__file__), '..', 'quran_text', 'quran-uthmani.txt')
+    QURAN_DIR = os.path.join(os.path.dirname(__file__), '..', 'quran_text')
 
-# Cache: { (sura, ayah): text }
-_QURAN_CACHE = {}
-# Cache: { sura: { ayah: text } } for faster full surah access
-_SURAH_CACHE = {}
+QURAN_FILE = os.path.join(QURAN_DIR, 'quran-uthmani.txt')
+# Precompiled copy of QURAN_FILE (see compile_quran). Rebuilt automatically when stale.
+QURAN_BIN = os.path.join(QURAN_DIR, 'quran-uthmani.bin')
+# Simple (undecorated) edition, used for search only - never rendered
+SIMPLE_FILE = os.path.join(QURAN_DIR, 'quran-simple.txt')
+SIMPLE_BIN = os.path.join(QURAN_DIR, 'quran-simple.bin')
 
-def load_quran():
-    """Parses quran-uthmani.txt into memory."""
-    global _QURAN_CACHE, _SURAH_CACHE
-    if _QURAN_CACHE:
-        return
+# Compiled corpus layout (little-endian):
+#   header      : magic, version, source size, source mtime_ns, ayah count, surah count
+#   surah_start : (surah_count + 2) x uint32 -> global index of ayah 1 of each surah
+#                 (entry 0 unused, last entry = ayah count)
+#   offsets     : (ayah_count + 1) x uint32 -> byte offsets of each ayah in the blob
+#   blob        : all ayah texts, UTF-8, back to back
+_MAGIC = b'QRNB'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIQQII')
 
-    if not os.path.exists(QURAN_FILE):
-        # Fallback check for simple text just to give a better error, or mistakenly renamed file
-        return
+# Loaded corpora (mmap of the .bin, or in-memory bytes if it cannot be written)
+_CORPUS = None
+_SIMPLE_CORPUS = None
 
-    try:
-        count = 0
-        with open(QURAN_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
+
+class _CompiledCorpus:
+    """Read-only view over a compiled corpus buffer. Ayahs are sliced on demand."""
+
+    def __init__(self, buffer, source=None):
+        self.buffer = buffer
+        self.source = source
+        magic, version, _, _, self.ayah_count, self.surah_count = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a compiled Quran corpus")
+
+        view = memoryview(buffer)
+        pos = _HEADER.size
+        n_starts = self.surah_count + 2
+        self.surah_start = view[pos:pos + n_starts * 4].cast('I')
+        pos += n_starts * 4
+        self.offsets = view[pos:pos + (self.ayah_count + 1) * 4].cast('I')
+        pos += (self.ayah_count + 1) * 4
+        self.blob = view[pos:]
+
+    def ayah_count_of(self, sura):
+        if not 1 <= sura <= self.surah_count:
+            return 0
+        return self.surah_start[sura + 1] - self.surah_start[sura]
+
+    def index_of(self, sura, ayah):
+        if not 1 <= ayah <= self.ayah_count_of(sura):
+            return None
+        return self.surah_start[sura] + ayah - 1
+
+    def key_of(self, index):
+        """Inverse of index_of: global ayah index -> (sura, ayah)."""
+        sura = bisect.bisect_right(self.surah_start, index, 1, self.surah_count + 1) - 1
+        return sura, index - self.surah_start[sura] + 1
+
+    def text(self, index):
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+
+def _source_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _parse_source(path):
+    """Parses a Tanzil 'sura|ayah|text' file into { sura: { ayah: text } }."""
+    surahs = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            parts = line.split('|')
+            if len(parts) >= 3:
+                try:
+                    sura = int(parts[0])
+                    ayah = int(parts[1])
+                except ValueError:
                     continue
-                
-                parts = line.split('|')
-                if len(parts) >= 3:
-                    try:
-                        sura = int(parts[0])
-                        ayah = int(parts[1])
-                        text = parts[2]
-                        
-                        # Store in flat cache
-                        _QURAN_CACHE[(sura, ayah)] = text
-                        
-                        # Store in surah cache
-                        if sura not in _SURAH_CACHE:
-                            _SURAH_CACHE[sura] = {}
-                        _SURAH_CACHE[sura][ayah] = text
-                        
-                        count += 1
-                    except ValueError:
-                        continue
-        print(f"[INFO] Loaded {count} ayahs from quran-uthmani.txt")
+                surahs.setdefault(sura, {})[ayah] = parts[2]
+    return surahs
+
+
+def compile_quran(src=QURAN_FILE, dst=None):
+    """
+    Compiles a Tanzil text file into the binary corpus format.
+    Returns the compiled bytes; also writes them to dst (atomically) when given.
+    """
+    surahs = _parse_source(src)
+    surah_count = max(surahs) if surahs else 0
 
+    surah_start = [0] * (surah_count + 2)
+    offsets = [0]
+    blob = bytearray()
+    for sura in range(1, surah_count + 1):
+        surah_start[sura] = len(offsets) - 1
+        ayahs = surahs.get(sura, {})
+        if sorted(ayahs) != list(range(1, len(ayahs) + 1)):
+            raise ValueError(f"Surah {sura} has non-contiguous ayah numbering")
+        for ayah in range(1, len(ayahs) + 1):
+            blob += ayahs[ayah].encode('utf-8')
+            offsets.append(len(blob))
+    ayah_count = len(offsets) - 1
+    surah_start[surah_count + 1] = ayah_count
+
+    size, mtime_ns = _source_signature(src)
+    data = b''.join([
+        _HEADER.pack(_MAGIC, _VERSION, size, mtime_ns, ayah_count, surah_count),
+        struct.pack(f'<{len(surah_start)}I', *surah_start),
+        struct.pack(f'<{len(offsets)}I', *offsets),
+        bytes(blob),
+    ])
+
+    if dst:
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, dst)
+    return data
+
+
+def _is_fresh(bin_path, src_path):
+    """A compiled file is fresh if it matches the source size/mtime (or the source is gone)."""
+    try:
+        with open(bin_path, 'rb') as f:
+            header = f.read(_HEADER.size)
+        magic, version, size, mtime_ns, _, _ = _HEADER.unpack(header)
+    except (OSError, struct.error):
+        return False
+    if magic != _MAGIC or version != _VERSION:
+        return False
+    if not os.path.exists(src_path):
+        return True
+    return (size, mtime_ns) == _source_signature(src_path)
+
+
+def _map_file(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _load_corpus(src, dst):
+    """Maps the compiled corpus for src, rebuilding it first if missing or stale."""
+    if _is_fresh(dst, src):
+        return _CompiledCorpus(_map_file(dst), source=dst)
+
+    if not os.path.exists(src):
+        return None
+
+    try:
+        data = compile_quran(src, dst)
+    except OSError as e:
+        # Read-only install (e.g. frozen build): keep the compiled form in memory
+        print(f"[WARN] Could not write {os.path.basename(dst)} ({e}), using in-memory corpus")
+        return _CompiledCorpus(compile_quran(src), source=src)
+
+    try:
+        return _CompiledCorpus(_map_file(dst), source=dst)
+    except OSError:
+        return _CompiledCorpus(data, source=src)
+
+
+def load_quran():
+    """Maps the compiled Uthmani corpus, compiling quran-uthmani.txt first if needed."""
+    global _CORPUS
+    if _CORPUS:
+        return
+
+    try:
+        _CORPUS = _load_corpus(QURAN_FILE, QURAN_BIN)
+        if _CORPUS:
+            print(f"[INFO] Loaded {_CORPUS.ayah_count} ayahs from {os.path.basename(_CORPUS.source)}")
     except Exception as e:
         print(f"[ERROR] Failed to load Quran file: {e}")
 
+
 def get_ayah_text(sura, ayah):
     """Returns single ayah text."""
-    if not _QURAN_CACHE:
+    if not _CORPUS:
         load_quran()
-    return _QURAN_CACHE.get((sura, ayah))
+        if not _CORPUS:
+            return None
+    index = _CORPUS.index_of(sura, ayah)
+    return _CORPUS.text(index) if index is not None else None
 
 def get_surah(sura):
     """
     Returns a list of all ayah texts for a given surah, in order.
     Returns [] if surah not found.
     """
-    if not _QURAN_CACHE:
+    if not _CORPUS:
         load_quran()
-        
-    if sura not in _SURAH_CACHE:
+        if not _CORPUS:
+            return []
+
+    count = _CORPUS.ayah_count_of(sura)
+    if not count:
         return []
-        
-    # Sort by ayah number to ensure order
-    ayahs = _SURAH_CACHE[sura]
-    return [ayahs[k] for k in sorted(ayahs.keys())]
+    first = _CORPUS.surah_start[sura]
+    return [_CORPUS.text(i) for i in range(first, first + count)]
 
 def get_range(sura, start, end):
     """
     Returns a list of ayah texts for the range [start, end] inclusive.
     """
-    if not _QURAN_CACHE:
+    if not _CORPUS:
         load_quran()
-        
-    texts = []
-    for i in range(start, end + 1):
-        t = _QURAN_CACHE.get((sura, i))
-        if t:
-            texts.append(t)
-    return texts
+        if not _CORPUS:
+            return []
+
+    count = _CORPUS.ayah_count_of(sura)
+    start = max(start, 1)
+    end = min(end, count)
+    if start > end:
+        return []
+    first = _CORPUS.surah_start[sura]
+    return [_CORPUS.text(i) for i in range(first + start - 1, first + end)]
+
+def get_ayah_count(sura):
+    """Returns the number of ayahs in a surah (0 if unknown)."""
+    if not _CORPUS:
+        load_quran()
+        if not _CORPUS:
+            return 0
+    return _CORPUS.ayah_count_of(sura)
+
+def ayah_index(sura, ayah):
+    """Returns the 0-based position of an ayah in the whole Quran (None if unknown)."""
+    if not _CORPUS:
+        load_quran()
+        if not _CORPUS:
+            return None
+    return _CORPUS.index_of(sura, ayah)
+
+def ayah_key(index):
+    """Returns (sura, ayah) for a 0-based global ayah index."""
+    if not _CORPUS:
+        load_quran()
+    return _CORPUS.key_of(index)
+
+def total_ayahs():
+    if not _CORPUS:
+        load_quran()
+        if not _CORPUS:
+            return 0
+    return _CORPUS.ayah_count
+
+def load_simple():
+    """Maps the compiled simple edition (quran-simple.txt), compiling it first if needed."""
+    global _SIMPLE_CORPUS
+    if _SIMPLE_CORPUS:
+        return _SIMPLE_CORPUS
+
+    try:
+        _SIMPLE_CORPUS = _load_corpus(SIMPLE_FILE, SIMPLE_BIN)
+    except Exception as e:
+        print(f"[ERROR] Failed to load simple Quran file: {e}")
+    return _SIMPLE_CORPUS
+
+def get_simple_text(index):
+    """Returns the simple-edition text of a 0-based global ayah index."""
+    corpus = load_simple()
+    if not corpus or not 0 <= index < corpus.ayah_count:
+        return None
+    return corpus.text(index)
 
 def is_source_available():
-    return os.path.exists(QURAN_FILE)
+    return os.path.exists(QURAN_FILE) or _is_fresh(QURAN_BIN, QURAN_FILE)
+
+
+# --- Structural divisions (juz / hizb / manzil / page / ruku) ---
+
+# First ayah of each rub' al-hizb (hizb quarter), Tanzil numbering. Every 4th
+# entry starts a hizb, every 8th a juz.
+HIZB_QUARTER_STARTS = (
+    (1, 1), (2, 26), (2, 44), (2, 60), (2, 75), (2, 92), (2, 106), (2, 124),  # juz 1
+    (2, 142), (2, 158), (2, 177), (2, 189), (2, 203), (2, 219), (2, 233), (2, 243),  # juz 2
+    (2, 253), (2, 263), (2, 272), (2, 283), (3, 15), (3, 33), (3, 52), (3, 75),  # juz 3
+    (3, 93), (3, 113), (3, 133), (3, 153), (3, 171), (3, 186), (4, 1), (4, 12),  # juz 4
+    (4, 24), (4, 36), (4, 58), (4, 74), (4, 88), (4, 100), (4, 114), (4, 135),  # juz 5
+    (4, 148), (4, 163), (5, 1), (5, 12), (5, 27), (5, 41), (5, 51), (5, 67),  # juz 6
+    (5, 82), (5, 97), (5, 109), (6, 13), (6, 36), (6, 59), (6, 74), (6, 95),  # juz 7
+    (6, 111), (6, 127), (6, 141), (6, 151), (7, 1), (7, 31), (7, 47), (7, 65),  # juz 8
+    (7, 88), (7, 117), (7, 142), (7, 156), (7, 171), (7, 189), (8, 1), (8, 22),  # juz 9
+    (8, 41), (8, 61), (9, 1), (9, 19), (9, 34), (9, 46), (9, 60), (9, 75),  # juz 10
+    (9, 93), (9, 111), (9, 122), (10, 11), (10, 26), (10, 53), (10, 71), (10, 90),  # juz 11
+    (11, 6), (11, 24), (11, 41), (11, 61), (11, 84), (11, 108), (12, 7), (12, 30),  # juz 12
+    (12, 53), (12, 77), (12, 101), (13, 5), (13, 19), (13, 35), (14, 10), (14, 28),  # juz 13
+    (15, 1), (15, 50), (16, 1), (16, 30), (16, 51), (16, 75), (16, 90), (16, 111),  # juz 14
+    (17, 1), (17, 23), (17, 50), (17, 70), (17, 99), (18, 17), (18, 32), (18, 51),  # juz 15
+    (18, 75), (18, 99), (19, 22), (19, 59), (20, 1), (20, 55), (20, 83), (20, 111),  # juz 16
+    (21, 1), (21, 29), (21, 51), (21, 83), (22, 1), (22, 19), (22, 38), (22, 60),  # juz 17
+    (23, 1), (23, 36), (23, 75), (24, 1), (24, 21), (24, 35), (24, 53), (25, 1),  # juz 18
+    (25, 21), (25, 53), (26, 1), (26, 52), (26, 111), (26, 181), (27, 1), (27, 27),  # juz 19
+    (27, 56), (27, 82), (28, 12), (28, 29), (28, 51), (28, 76), (29, 1), (29, 26),  # juz 20
+    (29, 46), (30, 1), (30, 31), (30, 54), (31, 22), (32, 11), (33, 1), (33, 18),  # juz 21
+    (33, 31), (33, 51), (33, 60), (34, 10), (34, 24), (34, 46), (35, 15), (35, 41),  # juz 22
+    (36, 28), (36, 60), (37, 22), (37, 83), (37, 145), (38, 21), (38, 52), (39, 8),  # juz 23
+    (39, 32), (39, 53), (40, 1), (40, 21), (40, 41), (40, 66), (41, 9), (41, 25),  # juz 24
+    (41, 47), (42, 13), (42, 27), (42, 51), (43, 24), (43, 57), (44, 17), (45, 12),  # juz 25
+    (46, 1), (46, 21), (47, 10), (47, 33), (48, 18), (49, 1), (49, 14), (50, 27),  # juz 26
+    (51, 31), (52, 24), (53, 26), (54, 9), (55, 1), (56, 1), (56, 75), (57, 16),  # juz 27
+    (58, 1), (58, 14), (59, 11), (60, 7), (62, 1), (63, 4), (65, 1), (66, 1),  # juz 28
+    (67, 1), (68, 1), (69, 1), (70, 19), (72, 1), (73, 20), (75, 1), (76, 19),  # juz 29
+    (78, 1), (80, 1), (82, 1), (84, 1), (87, 1), (90, 1), (94, 1), (100, 9),  # juz 30
+)
+MANZIL_STARTS = ((1, 1), (5, 1), (10, 1), (17, 1), (26, 1), (37, 1), (50, 1))
+# First ayah of each page of the 604-page Madani mushaf (King Fahd Complex print,
+# as in Tanzil's metadata).
+PAGE_STARTS = (
+    (1, 1), (2, 1), (2, 6), (2, 17), (2, 25), (2, 30), (2, 38), (2, 49), (2, 58), (2, 62),  # pages 1-10
+    (2, 70), (2, 77), (2, 84), (2, 89), (2, 94), (2, 102), (2, 106), (2, 113), (2, 120), (2, 127),  # pages 11-20
+    (2, 135), (2, 142), (2, 146), (2, 154), (2, 164), (2, 170), (2, 177), (2, 182), (2, 187), (2, 191),  # pages 21-30
+    (2, 197), (2, 203), (2, 211), (2, 216), (2, 220), (2, 225), (2, 231), (2, 234), (2, 238), (2, 246),  # pages 31-40
+    (2, 249), (2, 253), (2, 257), (2, 260), (2, 265), (2, 270), (2, 275), (2, 282), (2, 283), (3, 1),  # pages 41-50
+    (3, 10), (3, 16), (3, 23), (3, 30), (3, 38), (3, 46), (3, 53), (3, 62), (3, 71), (3, 78),  # pages 51-60
+    (3, 84), (3, 92), (3, 101), (3, 109), (3, 116), (3, 122), (3, 133), (3, 141), (3, 149), (3, 154),  # pages 61-70
+    (3, 158), (3, 166), (3, 174), (3, 181), (3, 187), (3, 195), (4, 1), (4, 7), (4, 12), (4, 15),  # pages 71-80
+    (4, 20), (4, 24), (4, 27), (4, 34), (4, 38), (4, 45), (4, 52), (4, 60), (4, 66), (4, 75),  # pages 81-90
+    (4, 80), (4, 87), (4, 92), (4, 95), (4, 102), (4, 106), (4, 114), (4, 122), (4, 128), (4, 135),  # pages 91-100
+    (4, 141), (4, 148), (4, 155), (4, 163), (4, 171), (4, 176), (5, 3), (5, 6), (5, 10), (5, 14),  # pages 101-110
+    (5, 18), (5, 24), (5, 32), (5, 37), (5, 42), (5, 46), (5, 51), (5, 58), (5, 65), (5, 71),  # pages 111-120
+    (5, 77), (5, 83), (5, 90), (5, 96), (5, 104), (5, 109), (5, 114), (6, 1), (6, 9), (6, 19),  # pages 121-130
+    (6, 28), (6, 36), (6, 45), (6, 53), (6, 60), (6, 69), (6, 74), (6, 82), (6, 91), (6, 95),  # pages 131-140
+    (6, 102), (6, 111), (6, 119), (6, 125), (6, 132), (6, 138), (6, 143), (6, 147), (6, 152), (6, 158),  # pages 141-150
+    (7, 1), (7, 12), (7, 23), (7, 31), (7, 38), (7, 44), (7, 52), (7, 58), (7, 68), (7, 74),  # pages 151-160
+    (7, 82), (7, 88), (7, 96), (7, 105), (7, 121), (7, 131), (7, 138), (7, 144), (7, 150), (7, 156),  # pages 161-170
+    (7, 160), (7, 164), (7, 171), (7, 179), (7, 188), (7, 196), (8, 1), (8, 9), (8, 17), (8, 26),  # pages 171-180
+    (8, 34), (8, 41), (8, 46), (8, 53), (8, 62), (8, 70), (9, 1), (9, 7), (9, 14), (9, 21),  # pages 181-190
+    (9, 27), (9, 32), (9, 37), (9, 41), (9, 48), (9, 55), (9, 62), (9, 69), (9, 73), (9, 80),  # pages 191-200
+    (9, 87), (9, 94), (9, 100), (9, 107), (9, 112), (9, 118), (9, 123), (10, 1), (10, 7), (10, 15),  # pages 201-210
+    (10, 21), (10, 26), (10, 34), (10, 43), (10, 54), (10, 62), (10, 71), (10, 79), (10, 89), (10, 98),  # pages 211-220
+    (10, 107), (11, 6), (11, 13), (11, 20), (11, 29), (11, 38), (11, 46), (11, 54), (11, 63), (11, 72),  # pages 221-230
+    (11, 82), (11, 89), (11, 98), (11, 109), (11, 118), (12, 5), (12, 15), (12, 23), (12, 31), (12, 38),  # pages 231-240
+    (12, 44), (12, 53), (12, 64), (12, 70), (12, 79), (12, 87), (12, 96), (12, 104), (13, 1), (13, 6),  # pages 241-250
+    (13, 14), (13, 19), (13, 29), (13, 35), (13, 43), (14, 6), (14, 11), (14, 19), (14, 25), (14, 34),  # pages 251-260
+    (14, 43), (15, 1), (15, 16), (15, 32), (15, 52), (15, 71), (15, 91), (16, 7), (16, 15), (16, 27),  # pages 261-270
+    (16, 35), (16, 43), (16, 55), (16, 65), (16, 73), (16, 80), (16, 88), (16, 94), (16, 103), (16, 111),  # pages 271-280
+    (16, 119), (17, 1), (17, 8), (17, 18), (17, 28), (17, 39), (17, 50), (17, 59), (17, 67), (17, 76),  # pages 281-290
+    (17, 87), (17, 97), (17, 105), (18, 5), (18, 16), (18, 21), (18, 28), (18, 35), (18, 46), (18, 54),  # pages 291-300
+    (18, 62), (18, 75), (18, 84), (18, 98), (19, 1), (19, 12), (19, 26), (19, 39), (19, 52), (19, 65),  # pages 301-310
+    (19, 77), (19, 96), (20, 13), (20, 38), (20, 52), (20, 65), (20, 77), (20, 88), (20, 99), (20, 114),  # pages 311-320
+    (20, 126), (21, 1), (21, 11), (21, 25), (21, 36), (21, 45), (21, 58), (21, 73), (21, 82), (21, 91),  # pages 321-330
+    (21, 102), (22, 1), (22, 6), (22, 16), (22, 24), (22, 31), (22, 39), (22, 47), (22, 56), (22, 65),  # pages 331-340
+    (22, 73), (23, 1), (23, 18), (23, 28), (23, 43), (23, 60), (23, 75), (23, 90), (23, 105), (24, 1),  # pages 341-350
+    (24, 11), (24, 21), (24, 28), (24, 32), (24, 37), (24, 44), (24, 54), (24, 59), (24, 62), (25, 3),  # pages 351-360
+    (25, 12), (25, 21), (25, 33), (25, 44), (25, 56), (25, 68), (26, 1), (26, 20), (26, 40), (26, 61),  # pages 361-370
+    (26, 84), (26, 112), (26, 137), (26, 160), (26, 184), (26, 207), (27, 1), (27, 14), (27, 23), (27, 36),  # pages 371-380
+    (27, 45), (27, 56), (27, 64), (27, 77), (27, 89), (28, 6), (28, 14), (28, 22), (28, 29), (28, 36),  # pages 381-390
+    (28, 44), (28, 51), (28, 60), (28, 71), (28, 78), (28, 85), (29, 7), (29, 15), (29, 24), (29, 31),  # pages 391-400
+    (29, 39), (29, 46), (29, 53), (29, 64), (30, 6), (30, 16), (30, 25), (30, 33), (30, 42), (30, 51),  # pages 401-410
+    (31, 1), (31, 12), (31, 20), (31, 29), (32, 1), (32, 12), (32, 21), (33, 1), (33, 7), (33, 16),  # pages 411-420
+    (33, 23), (33, 31), (33, 36), (33, 44), (33, 51), (33, 55), (33, 63), (34, 1), (34, 8), (34, 15),  # pages 421-430
+    (34, 23), (34, 32), (34, 40), (35, 1), (35, 5), (35, 15), (35, 25), (35, 33), (35, 41), (36, 1),  # pages 431-440
+    (36, 13), (36, 28), (36, 41), (36, 55), (36, 71), (37, 1), (37, 25), (37, 52), (37, 77), (37, 103),  # pages 441-450
+    (37, 127), (37, 154), (38, 1), (38, 17), (38, 27), (38, 43), (38, 62), (38, 84), (39, 6), (39, 11),  # pages 451-460
+    (39, 22), (39, 32), (39, 41), (39, 48), (39, 57), (39, 68), (39, 75), (40, 8), (40, 17), (40, 26),  # pages 461-470
+    (40, 34), (40, 41), (40, 50), (40, 59), (40, 67), (40, 78), (41, 1), (41, 12), (41, 21), (41, 30),  # pages 471-480
+    (41, 39), (41, 47), (42, 1), (42, 11), (42, 16), (42, 23), (42, 32), (42, 45), (42, 52), (43, 11),  # pages 481-490
+    (43, 23), (43, 34), (43, 48), (43, 61), (43, 74), (44, 1), (44, 19), (44, 40), (45, 1), (45, 14),  # pages 491-500
+    (45, 23), (45, 33), (46, 6), (46, 15), (46, 21), (46, 29), (47, 1), (47, 12), (47, 20), (47, 30),  # pages 501-510
+    (48, 1), (48, 10), (48, 16), (48, 24), (48, 29), (49, 5), (49, 12), (50, 1), (50, 16), (50, 36),  # pages 511-520
+    (51, 7), (51, 31), (51, 52), (52, 15), (52, 32), (53, 1), (53, 27), (53, 45), (54, 7), (54, 28),  # pages 521-530
+    (54, 50), (55, 17), (55, 41), (55, 68), (56, 17), (56, 51), (56, 77), (57, 4), (57, 12), (57, 19),  # pages 531-540
+    (57, 25), (58, 1), (58, 7), (58, 12), (58, 22), (59, 4), (59, 10), (59, 17), (60, 1), (60, 6),  # pages 541-550
+    (60, 12), (61, 6), (62, 1), (62, 9), (63, 5), (64, 1), (64, 10), (65, 1), (65, 6), (66, 1),  # pages 551-560
+    (66, 8), (67, 1), (67, 13), (67, 27), (68, 16), (68, 43), (69, 9), (69, 35), (70, 11), (70, 40),  # pages 561-570
+    (71, 11), (72, 1), (72, 14), (73, 1), (73, 20), (74, 18), (74, 48), (75, 20), (76, 6), (76, 26),  # pages 571-580
+    (77, 20), (78, 1), (78, 31), (79, 16), (80, 1), (81, 1), (82, 1), (83, 7), (83, 35), (85, 1),  # pages 581-590
+    (86, 1), (87, 16), (89, 1), (89, 24), (91, 1), (92, 15), (95, 1), (97, 1), (98, 8), (100, 10),  # pages 591-600
+    (103, 1), (106, 1), (109, 1), (112, 1),  # pages 601-604
+)
+# Ayahs where each ruku' starts, per surah (Indo-Pak marking, 558 ruku's).
+_RUKU_AYAHS = (
+    (1,),  # 1
+    (1, 8, 21, 30, 40, 47, 60, 62, 72, 83, 87, 97, 104, 113, 122, 130, 142, 148, 153, 164, 168,  # 2
+     177, 183, 189, 197, 211, 217, 222, 229, 232, 236, 243, 249, 254, 258, 261, 267, 274, 282,
+     284),
+    (1, 10, 21, 31, 42, 55, 64, 72, 81, 92, 102, 110, 121, 130, 144, 149, 156, 172, 181, 190),  # 3
+    (1, 11, 15, 23, 26, 36, 43, 51, 60, 71, 77, 88, 92, 97, 101, 105, 113, 116, 127, 135, 142,  # 4
+     153, 163, 172),
+    (1, 6, 12, 20, 27, 35, 44, 51, 57, 67, 78, 87, 94, 101, 109, 116),  # 5
+    (1, 11, 21, 31, 42, 51, 56, 61, 71, 83, 91, 95, 101, 111, 122, 130, 141, 145, 151, 155),  # 6
+    (1, 11, 26, 32, 40, 48, 54, 59, 65, 73, 85, 94, 100, 109, 127, 130, 142, 148, 152, 158,  # 7
+     163, 172, 182, 189),
+    (1, 11, 20, 29, 38, 45, 49, 59, 65, 70),  # 8
+    (1, 7, 17, 25, 30, 38, 43, 60, 67, 73, 81, 90, 100, 111, 119, 123),  # 9
+    (1, 11, 21, 31, 41, 54, 61, 71, 83, 93, 104),  # 10
+    (1, 9, 25, 36, 50, 61, 69, 84, 96, 110),  # 11
+    (1, 7, 21, 30, 36, 43, 50, 58, 69, 80, 94, 105),  # 12
+    (1, 8, 19, 27, 32, 38),  # 13
+    (1, 7, 13, 22, 28, 35, 42),  # 14
+    (1, 16, 26, 45, 61, 80),  # 15
+    (1, 10, 22, 26, 35, 41, 51, 61, 66, 71, 77, 84, 90, 101, 111, 120),  # 16
+    (1, 11, 23, 31, 41, 53, 61, 71, 78, 85, 94, 101),  # 17
+    (1, 13, 18, 23, 32, 45, 50, 54, 60, 71, 83, 99),  # 18
+    (1, 16, 41, 51, 66, 83),  # 19
+    (1, 25, 55, 77, 90, 99, 116, 129),  # 20
+    (1, 11, 30, 42, 51, 76, 94),  # 21
+    (1, 11, 23, 26, 34, 39, 49, 58, 65, 73),  # 22
+    (1, 23, 33, 51, 78, 93),  # 23
+    (1, 11, 21, 27, 35, 41, 51, 58, 62),  # 24
+    (1, 10, 21, 35, 45, 61),  # 25
+    (1, 10, 34, 53, 69, 105, 123, 141, 160, 176, 192),  # 26
+    (1, 15, 32, 45, 59, 67, 83),  # 27
+    (1, 14, 22, 29, 43, 51, 61, 76, 83),  # 28
+    (1, 14, 23, 31, 45, 52, 64),  # 29
+    (1, 11, 20, 28, 41, 54),  # 30
+    (1, 12, 20, 31),  # 31
+    (1, 12, 23),  # 32
+    (1, 9, 21, 28, 35, 41, 53, 59, 69),  # 33
+    (1, 10, 22, 31, 37, 46),  # 34
+    (1, 8, 15, 27, 38),  # 35
+    (1, 13, 33, 51, 68),  # 36
+    (1, 22, 75, 114, 139),  # 37
+    (1, 15, 27, 41, 65),  # 38
+    (1, 10, 22, 32, 42, 53, 64, 71),  # 39
+    (1, 10, 21, 28, 38, 51, 61, 69, 78),  # 40
+    (1, 9, 19, 26, 33, 45),  # 41
+    (1, 10, 20, 30, 44),  # 42
+    (1, 16, 26, 36, 46, 57, 68),  # 43
+    (1, 30, 43),  # 44
+    (1, 12, 22, 27),  # 45
+    (1, 11, 21, 27),  # 46
+    (1, 12, 20, 29),  # 47
+    (1, 11, 18, 27),  # 48
+    (1, 11),  # 49
+    (1, 16, 30),  # 50
+    (1, 24, 47),  # 51
+    (1, 29),  # 52
+    (1, 26, 33),  # 53
+    (1, 23, 41),  # 54
+    (1, 26, 46),  # 55
+    (1, 39, 75),  # 56
+    (1, 11, 20, 26),  # 57
+    (1, 7, 14),  # 58
+    (1, 11, 18),  # 59
+    (1, 7),  # 60
+    (1, 10),  # 61
+    (1, 9),  # 62
+    (1, 9),  # 63
+    (1, 11),  # 64
+    (1, 8),  # 65
+    (1, 8),  # 66
+    (1, 15),  # 67
+    (1, 34),  # 68
+    (1, 38),  # 69
+    (1, 36),  # 70
+    (1, 21),  # 71
+    (1, 20),  # 72
+    (1, 20),  # 73
+    (1, 32),  # 74
+    (1, 31),  # 75
+    (1, 23),  # 76
+    (1, 41),  # 77
+    (1, 31),  # 78
+    (1, 27),  # 79
+    (1,),  # 80
+    (1,),  # 81
+    (1,),  # 82
+    (1,),  # 83
+    (1,),  # 84
+    (1,),  # 85
+    (1,),  # 86
+    (1,),  # 87
+    (1,),  # 88
+    (1,),  # 89
+    (1,),  # 90
+    (1,),  # 91
+    (1,),  # 92
+    (1,),  # 93
+    (1,),  # 94
+    (1,),  # 95
+    (1,),  # 96
+    (1,),  # 97
+    (1,),  # 98
+    (1,),  # 99
+    (1,),  # 100
+    (1,),  # 101
+    (1,),  # 102
+    (1,),  # 103
+    (1,),  # 104
+    (1,),  # 105
+    (1,),  # 106
+    (1,),  # 107
+    (1,),  # 108
+    (1,),  # 109
+    (1,),  # 110
+    (1,),  # 111
+    (1,),  # 112
+    (1,),  # 113
+    (1,),  # 114
+)
+RUKU_STARTS = tuple((sura, aya) for sura, ayahs in enumerate(_RUKU_AYAHS, 1) for aya in ayahs)
+
+# Optional Tanzil metadata (https://tanzil.net/docs/quran_metadata). When present its
+# boundaries replace the built-in tables above, kind by kind; a kind whose entries
+# do not fit the Quran text keeps the built-in table.
+QURAN_DATA_FILE = os.path.join(QURAN_DIR, 'quran-data.xml')
+_XML_DIVISIONS = {'juz': 'juz', 'quarter': 'quarter', 'manzil': 'manzil', 'page': 'page', 'ruku': 'ruku'}
+
+# { kind: array of global ayah indices where each division starts, plus an end sentinel }
+_DIVISIONS = None
+
+
+def _read_data_file():
+    """{kind: [(sura, aya)]} from QURAN_DATA_FILE, or {} when it is missing or unreadable."""
+    if not os.path.exists(QURAN_DATA_FILE):
+        return {}
+    import xml.etree.ElementTree as ET
+    starts = {}
+    try:
+        root = ET.parse(QURAN_DATA_FILE).getroot()
+        for kind, tag in _XML_DIVISIONS.items():
+            entries = sorted(
+                (int(e.get('index')), int(e.get('sura')), int(e.get('aya')))
+                for e in root.iter(tag)
+            )
+            if entries:
+                starts[kind] = [(sura, aya) for _, sura, aya in entries]
+    except (ET.ParseError, TypeError, ValueError) as e:
+        print(f"[WARN] Ignoring invalid {os.path.basename(QURAN_DATA_FILE)}: {e}")
+        return {}
+    return starts
+
+
+def _bounds(starts):
+    """Division starts as global ayah indices plus the end sentinel. Raises ValueError on a bad table."""
+    bounds = array('H')
+    for sura, ayah in starts:
+        index = _CORPUS.index_of(sura, ayah)
+        if index is None:
+            raise ValueError(f"no ayah {sura}:{ayah}")
+        if bounds and index <= bounds[-1]:
+            raise ValueError(f"{sura}:{ayah} is not after the previous start")
+        bounds.append(index)
+    if not bounds or bounds[0] != 0:
+        raise ValueError("the first division must start at 1:1")
+    bounds.append(_CORPUS.ayah_count)
+    return bounds
+
+
+def load_divisions():
+    """Precomputes division boundaries as global ayah indices (O(1) lookups afterwards)."""
+    global _DIVISIONS
+    if _DIVISIONS is not None:
+        return _DIVISIONS
+    if not _CORPUS:
+        load_quran()
+        if not _CORPUS:
+            return {}
+
+    builtin = {
+        'juz': HIZB_QUARTER_STARTS[::8],
+        'quarter': HIZB_QUARTER_STARTS,
+        'manzil': MANZIL_STARTS,
+        'page': PAGE_STARTS,
+        'ruku': RUKU_STARTS,
+    }
+    divisions = {kind: _bounds(starts) for kind, starts in builtin.items()}
+    for kind, starts in _read_data_file().items():
+        try:
+            divisions[kind] = _bounds(starts)
+        except ValueError as e:
+            print(f"[WARN] {os.path.basename(QURAN_DATA_FILE)}: {kind} table ignored ({e})")
+    divisions['hizb'] = divisions['quarter'][:-1][::4] + divisions['quarter'][-1:]
+    _DIVISIONS = divisions
+    return _DIVISIONS
+
+
+DIVISION_KINDS = ('juz', 'hizb', 'quarter', 'manzil', 'page', 'ruku')
+
+
+def division_kinds():
+    """The DIVISION_KINDS that have boundary data (all of them once the Quran text is loaded)."""
+    divisions = load_divisions()
+    return tuple(kind for kind in DIVISION_KINDS if kind in divisions)
+
+
+def division_count(kind):
+    """Number of divisions of a kind ('juz', 'hizb', 'quarter', 'manzil', 'page', 'ruku')."""
+    bounds = load_divisions().get(kind)
+    return len(bounds) - 1 if bounds else 0
+
+
+def get_division(kind, number):
+    """
+    Returns the ayahs of division `number` (1-based) as [(sura, ayah_from, ayah_to), ...].
+    A division may span several surahs. Returns [] if unknown.
+    """
+    bounds = load_divisions().get(kind)
+    if not bounds or not 1 <= number < len(bounds):
+        return []
+
+    segments = []
+    index, end = bounds[number - 1], bounds[number]
+    while index < end:
+        sura, ayah = _CORPUS.key_of(index)
+        last = min(end, _CORPUS.surah_start[sura + 1]) - 1
+        segments.append((sura, ayah, ayah + last - index))
+        index = last + 1
+    return segments
+
+
+def get_division_ayahs(kind, number):
+    """Returns [(sura, ayah, text), ...] for every ayah of a division, in order."""
+    return [
+        (sura, ayah, _CORPUS.text(_CORPUS.index_of(sura, ayah)))
+        for sura, first, last in get_division(kind, number)
+        for ayah in range(first, last + 1)
+    ]
+
+if __name__ == "__main__":
+    # Build step: python src/quran_provider.py
+    for src, dst in [(QURAN_FILE, QURAN_BIN), (SIMPLE_FILE, SIMPLE_BIN)]:
+        data = compile_quran(src, dst)
+        print(f"[OK] Compiled {src} -> {dst} ({len(data)} bytes)")
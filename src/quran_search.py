@@ -0,0 +1,278 @@
+"""
+Diacritic-insensitive full-text search over the Quran.
+
+The index is built from quran-simple.txt (via quran_provider) and maps
+normalized tokens to postings of global word positions, so phrase queries
+are a positional intersection. Character n-grams over the vocabulary serve
+partial (infix) matches. The index is pickled next to the Quran text and
+rebuilt only when the source changes.
+
+Results carry surah/ayah_from/ayah_to so they can be sent straight to /generate.
+"""
+import os
+import bisect
+import heapq
+import pickle
+from collections import Counter
+from array import array
+
+import quran_provider
+
+INDEX_FILE = os.path.join(quran_provider.QURAN_DIR, 'quran-search.idx')
+INDEX_VERSION = 1
+NGRAM = 3
+
+# Tashkeel, Quranic annotation marks, tatweel and small letters are dropped.
+_STRIP = set(range(0x064B, 0x0660)) | {0x0640, 0x0670} | set(range(0x06D6, 0x06EE))
+# Letter variants folded together so spelling differences do not matter.
+_FOLD = {
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+}
+_TABLE = {cp: None for cp in _STRIP}
+_TABLE.update({ord(k): v for k, v in _FOLD.items()})
+
+_INDEX = None
+
+
+def normalize(text):
+    """Strips tashkeel/marks and folds letter variants."""
+    return text.translate(_TABLE)
+
+
+def tokenize(text):
+    """Normalized tokens of a text; standalone pause/sajdah marks are dropped."""
+    return [t for t in normalize(text).split() if t]
+
+
+def _contains(positions, value):
+    i = bisect.bisect_left(positions, value)
+    return i < len(positions) and positions[i] == value
+
+
+def _ngrams(term):
+    return {term[i:i + NGRAM] for i in range(len(term) - NGRAM + 1)}
+
+
+class SearchIndex:
+    """
+    vocab        : sorted list of normalized terms (term id = position)
+    postings     : term id -> array of global word positions (ascending)
+    word_ayah    : global word position -> global ayah index
+    ngrams       : n-gram -> array of term ids containing it
+    """
+
+    def __init__(self, vocab, postings, word_ayah, ngrams, signature=None):
+        self.vocab = vocab
+        self.postings = postings
+        self.word_ayah = word_ayah
+        self.ngrams = ngrams
+        self.signature = signature
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        # global ayah index -> position of its first word (plus a final sentinel)
+        self.ayah_start = array('I', [0] * (word_ayah[-1] + 2 if word_ayah else 1))
+        for pos in range(len(word_ayah) - 1, -1, -1):
+            self.ayah_start[word_ayah[pos]] = pos
+        self.ayah_start[-1] = len(word_ayah)
+
+    def to_dict(self):
+        return {
+            'vocab': self.vocab,
+            'postings': self.postings,
+            'word_ayah': self.word_ayah,
+            'ngrams': self.ngrams,
+            'signature': self.signature,
+        }
+
+    @classmethod
+    def build(cls, signature=None):
+        positions = {}
+        word_ayah = array('H')
+        for index in range(quran_provider.total_ayahs()):
+            text = quran_provider.get_simple_text(index) or ''
+            for token in tokenize(text):
+                positions.setdefault(token, array('I')).append(len(word_ayah))
+                word_ayah.append(index)
+
+        vocab = sorted(positions)
+        postings = [positions[term] for term in vocab]
+
+        grams = {}
+        for term_id, term in enumerate(vocab):
+            for gram in _ngrams(term):
+                grams.setdefault(gram, array('I')).append(term_id)
+
+        return cls(vocab, postings, word_ayah, grams, signature)
+
+    def _count_in_ayah(self, positions, ayah):
+        lo = bisect.bisect_left(positions, self.ayah_start[ayah])
+        return bisect.bisect_left(positions, self.ayah_start[ayah + 1], lo) - lo
+
+    # --- term expansion ---
+
+    def prefix_terms(self, prefix):
+        lo = bisect.bisect_left(self.vocab, prefix)
+        hi = bisect.bisect_left(self.vocab, prefix + '\U0010ffff')
+        return range(lo, hi)
+
+    def partial_terms(self, fragment):
+        """Term ids containing fragment anywhere (n-gram candidates, then verified)."""
+        if len(fragment) < NGRAM:
+            return list(self.prefix_terms(fragment))
+        candidates = None
+        for gram in _ngrams(fragment):
+            ids = self.ngrams.get(gram)
+            if not ids:
+                return []
+            candidates = set(ids) if candidates is None else candidates.intersection(ids)
+            if not candidates:
+                return []
+        return sorted(t for t in candidates if fragment in self.vocab[t])
+
+    def expand(self, token, prefix=False):
+        """Term ids a query token may match: exact, else prefix, else partial."""
+        exact = self.term_ids.get(token)
+        if exact is not None:
+            return [exact]
+        terms = list(self.prefix_terms(token)) if prefix else []
+        if not terms:
+            terms = self.partial_terms(token)
+        return terms
+
+    # --- query ---
+
+    def search(self, query, limit=20, prefix=True):
+        """
+        Ranked ayahs containing every query token (any order).
+        Consecutive occurrences (a phrase match) rank first. Tokens that are
+        not whole words fall back to prefix (last token) or partial matches,
+        so half-typed queries still find something.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        # positions matched by each query token
+        token_positions = []
+        for i, token in enumerate(tokens):
+            terms = self.expand(token, prefix=prefix and i == len(tokens) - 1)
+            if not terms:
+                return []
+            if len(terms) == 1:
+                token_positions.append(self.postings[terms[0]])
+            else:
+                merged = set()
+                for t in terms:
+                    merged.update(self.postings[t])
+                token_positions.append(sorted(merged))
+
+        if len(tokens) == 1:
+            # every occurrence is a (one-word) phrase hit
+            counts = Counter(map(self.word_ayah.__getitem__, token_positions[0]))
+            scored = [(-2.0 - min(hits, 3) * 0.1, a, hits) for a, hits in counts.items()]
+            return self._results(heapq.nsmallest(limit, scored))
+
+        # candidate ayahs come from the rarest token; the others are checked by bisection
+        rarest = min(range(len(tokens)), key=lambda i: len(token_positions[i]))
+        others = [p for i, p in enumerate(token_positions) if i != rarest]
+        ayahs = [
+            a for a in sorted(set(map(self.word_ayah.__getitem__, token_positions[rarest])))
+            if all(self._count_in_ayah(p, a) for p in others)
+        ]
+
+        # occurrences of the whole phrase (token 0 followed by 1, 2, ...) per ayah
+        first = token_positions[0]
+        rest = list(enumerate(token_positions[1:], 1))
+        scored = []
+        for a in ayahs:
+            lo = bisect.bisect_left(first, self.ayah_start[a])
+            hi = bisect.bisect_left(first, self.ayah_start[a + 1], lo)
+            hits = 0
+            for j in range(lo, hi):
+                start = first[j]
+                if start + len(tokens) <= self.ayah_start[a + 1] and all(
+                    _contains(p, start + k) for k, p in rest
+                ):
+                    hits += 1
+            scored.append((-(2.0 if hits else 1.0) - min(hits, 3) * 0.1, a, hits))
+
+        # phrase matches first, then more occurrences, then mushaf order
+        return self._results(heapq.nsmallest(limit, scored))
+
+    def _results(self, ranked):
+        results = []
+        for neg_score, ayah, hits in ranked:
+            sura, number = quran_provider.ayah_key(ayah)
+            results.append({
+                'surah': sura,
+                'ayah': number,
+                'ayah_from': number,
+                'ayah_to': number,
+                'score': round(-neg_score, 4),
+                'phrase': hits > 0,
+                'text': quran_provider.get_ayah_text(sura, number),
+            })
+        return results
+
+
+def _signature():
+    try:
+        st = os.stat(quran_provider.SIMPLE_FILE)
+        return (INDEX_VERSION, st.st_size, st.st_mtime_ns)
+    except OSError:
+        return (INDEX_VERSION, None, None)
+
+
+def load_index():
+    """Loads the cached index, rebuilding (and re-caching) it when missing or stale."""
+    global _INDEX
+    if _INDEX:
+        return _INDEX
+
+    signature = _signature()
+    try:
+        with open(INDEX_FILE, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['signature'] == signature or signature[1] is None:
+            _INDEX = SearchIndex(**cached)
+            return _INDEX
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+
+    if not quran_provider.load_simple():
+        print("[ERROR] quran-simple.txt not found, search unavailable")
+        return None
+
+    print("[INFO] Building Quran search index...")
+    index = SearchIndex.build(signature)
+    try:
+        tmp = f"{INDEX_FILE}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(index.to_dict(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, INDEX_FILE)
+    except OSError as e:
+        print(f"[WARN] Could not cache search index: {e}")
+
+    print(f"[INFO] Search index: {len(index.vocab)} terms, {len(index.word_ayah)} words")
+    _INDEX = index
+    return _INDEX
+
+
+def search(query, limit=20, prefix=True):
+    index = load_index()
+    if not index:
+        return []
+    return index.search(query, limit=limit, prefix=prefix)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    load_index()
+    q = ' '.join(sys.argv[1:]) or 'الرحمن الرحيم'
+    t = time.perf_counter()
+    hits = search(q)
+    print(f"{len(hits)} results in {(time.perf_counter() - t) * 1000:.2f} ms")
+    for hit in hits[:10]:
+        print(f"  {hit['surah']}:{hit['ayah']}  {hit['score']}  {hit['text'][:60]}")
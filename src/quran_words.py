@@ -0,0 +1,240 @@
+"""
+Word-level table aligning the Uthmani (rendered) and simple (searchable) editions.
+
+All ~77k Uthmani words are stored in flat arrays - no per-word objects:
+
+    ayah_word_start  : global ayah index -> index of its first word (+ end sentinel)
+    uthmani_offsets  : 2 per word, [start, end) character offsets in the Uthmani ayah text
+    simple_offsets   : 2 per word, [start, end) character offsets in the simple ayah text
+    simple_word      : simple token position (as used by quran_search) -> word index
+
+The two editions do not always split words the same way (the Uthmani script
+joins the vocative "يا" to the next word, for example), so each ayah is aligned
+with a small dynamic program over consonant skeletons. The table is built once,
+cached next to the Quran text and loaded lazily.
+"""
+import os
+import re
+import bisect
+import pickle
+from array import array
+
+import quran_provider
+import quran_search
+
+WORDS_FILE = os.path.join(quran_provider.QURAN_DIR, 'quran-words.idx')
+WORDS_VERSION = 1
+
+# Long vowels / hamza carriers are spelled differently between the editions,
+# so alignment compares consonant skeletons only.
+_SKELETON = str.maketrans('', '', 'اويء')
+# Alignment steps: (uthmani words, simple tokens, penalty)
+_STEPS = ((1, 1, 0.0), (1, 2, 0.1), (2, 1, 0.1), (1, 3, 0.2))
+
+_TABLE = None
+
+
+def _skeleton(text):
+    return quran_search.normalize(text).translate(_SKELETON)
+
+
+def _words(text):
+    """[(start, end)] of whitespace-separated tokens that contain letters."""
+    return [m.span() for m in re.finditer(r'\S+', text) if quran_search.normalize(m.group())]
+
+
+def _align(u_text, u_spans, s_text, s_spans):
+    """
+    Groups simple tokens under Uthmani words.
+    Returns, per Uthmani word, the (first, last) simple token indices it covers.
+    """
+    if len(u_spans) == len(s_spans):
+        return [(i, i) for i in range(len(u_spans))]
+
+    u_skel = [_skeleton(u_text[a:b]) for a, b in u_spans]
+    s_skel = [_skeleton(s_text[a:b]) for a, b in s_spans]
+    n, m = len(u_skel), len(s_skel)
+    inf = float('inf')
+    cost = [[inf] * (m + 1) for _ in range(n + 1)]
+    back = [[None] * (m + 1) for _ in range(n + 1)]
+    cost[0][0] = 0.0
+    for i in range(n + 1):
+        for j in range(m + 1):
+            if cost[i][j] == inf:
+                continue
+            for du, ds, penalty in _STEPS:
+                if i + du > n or j + ds > m:
+                    continue
+                u = ''.join(u_skel[i:i + du])
+                s = ''.join(s_skel[j:j + ds])
+                c = cost[i][j] + penalty + (0 if u == s else 1 + abs(len(u) - len(s)))
+                if c < cost[i + du][j + ds]:
+                    cost[i + du][j + ds] = c
+                    back[i + du][j + ds] = (du, ds)
+
+    if cost[n][m] == inf:
+        # No alignment possible: spread simple tokens proportionally
+        return [(i * m // n, max(i * m // n, (i + 1) * m // n - 1)) for i in range(n)]
+
+    groups = []
+    i, j = n, m
+    while i or j:
+        du, ds = back[i][j]
+        i, j = i - du, j - ds
+        # a 2:1 step leaves the second Uthmani word sharing the same simple token
+        for _ in range(du):
+            groups.append((j, j + ds - 1))
+    groups.reverse()
+    return groups
+
+
+def build_table():
+    ayah_word_start = array('I')
+    uthmani_offsets = array('H')
+    simple_offsets = array('H')
+    simple_word = array('I')
+
+    for index in range(quran_provider.total_ayahs()):
+        sura, ayah = quran_provider.ayah_key(index)
+        u_text = quran_provider.get_ayah_text(sura, ayah)
+        s_text = quran_provider.get_simple_text(index) or ''
+        u_spans = _words(u_text)
+        s_spans = _words(s_text)
+
+        first_word = len(uthmani_offsets) // 2
+        ayah_word_start.append(first_word)
+        token_word = [None] * len(s_spans)
+        for w, ((ua, ub), (first, last)) in enumerate(zip(u_spans, _align(u_text, u_spans, s_text, s_spans))):
+            uthmani_offsets.extend((ua, ub))
+            simple_offsets.extend((s_spans[first][0], s_spans[last][1]) if s_spans else (0, 0))
+            for t in range(first, last + 1):
+                if token_word[t] is None:
+                    token_word[t] = first_word + w
+        # tokens never claimed (should not happen) map to the previous word
+        previous = first_word
+        for w in token_word:
+            previous = w if w is not None else previous
+            simple_word.append(previous)
+    ayah_word_start.append(len(uthmani_offsets) // 2)
+
+    return {
+        'ayah_word_start': ayah_word_start,
+        'uthmani_offsets': uthmani_offsets,
+        'simple_offsets': simple_offsets,
+        'simple_word': simple_word,
+    }
+
+
+def _signature():
+    sig = [WORDS_VERSION]
+    for path in (quran_provider.QURAN_FILE, quran_provider.SIMPLE_FILE):
+        try:
+            st = os.stat(path)
+            sig.extend((st.st_size, st.st_mtime_ns))
+        except OSError:
+            sig.extend((None, None))
+    return tuple(sig)
+
+
+def load_table():
+    """Loads the cached word table, rebuilding it when missing or stale."""
+    global _TABLE
+    if _TABLE:
+        return _TABLE
+
+    signature = _signature()
+    try:
+        with open(WORDS_FILE, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.pop('signature') == signature or signature[1] is None:
+            _TABLE = cached
+            return _TABLE
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    if not quran_provider.total_ayahs() or not quran_provider.load_simple():
+        print("[ERROR] Quran text files not found, word table unavailable")
+        return None
+
+    print("[INFO] Building Quran word table...")
+    table = build_table()
+    try:
+        tmp = f"{WORDS_FILE}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(dict(table, signature=signature), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, WORDS_FILE)
+    except OSError as e:
+        print(f"[WARN] Could not cache word table: {e}")
+
+    print(f"[INFO] Word table: {len(table['uthmani_offsets']) // 2} words")
+    _TABLE = table
+    return _TABLE
+
+
+def word_count(sura, ayah):
+    table = load_table()
+    index = quran_provider.ayah_index(sura, ayah)
+    if not table or index is None:
+        return 0
+    return table['ayah_word_start'][index + 1] - table['ayah_word_start'][index]
+
+
+def get_word_spans(sura, ayah):
+    """[(start, end)] character offsets of each word in the Uthmani ayah text."""
+    table = load_table()
+    index = quran_provider.ayah_index(sura, ayah)
+    if not table or index is None:
+        return []
+    offsets = table['uthmani_offsets']
+    first, last = table['ayah_word_start'][index], table['ayah_word_start'][index + 1]
+    return [(offsets[2 * w], offsets[2 * w + 1]) for w in range(first, last)]
+
+
+def get_words(sura, ayah):
+    """
+    Returns the words of an ayah in order:
+    [{'word': n, 'uthmani': ..., 'simple': ..., 'start': ..., 'end': ...}, ...]
+    where start/end are character offsets into the Uthmani ayah text.
+    """
+    table = load_table()
+    index = quran_provider.ayah_index(sura, ayah)
+    if not table or index is None:
+        return []
+
+    u_text = quran_provider.get_ayah_text(sura, ayah)
+    s_text = quran_provider.get_simple_text(index)
+    u_off, s_off = table['uthmani_offsets'], table['simple_offsets']
+    first, last = table['ayah_word_start'][index], table['ayah_word_start'][index + 1]
+    return [
+        {
+            'word': w - first + 1,
+            'uthmani': u_text[u_off[2 * w]:u_off[2 * w + 1]],
+            'simple': s_text[s_off[2 * w]:s_off[2 * w + 1]],
+            'start': u_off[2 * w],
+            'end': u_off[2 * w + 1],
+        }
+        for w in range(first, last)
+    ]
+
+
+def locate(simple_token):
+    """
+    Finds every occurrence of a word (diacritics optional) as [(sura, ayah, word), ...],
+    word being the 1-based position in the Uthmani ayah.
+    """
+    table = load_table()
+    index = quran_search.load_index()
+    if not table or not index:
+        return []
+    term = index.term_ids.get(quran_search.normalize(simple_token).strip())
+    if term is None:
+        return []
+
+    starts = table['ayah_word_start']
+    words = sorted({table['simple_word'][p] for p in index.postings[term]})
+    results = []
+    for w in words:
+        ayah_idx = bisect.bisect_right(starts, w) - 1
+        sura, ayah = quran_provider.ayah_key(ayah_idx)
+        results.append((sura, ayah, w - starts[ayah_idx] + 1))
+    return results
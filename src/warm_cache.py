@@ -0,0 +1,272 @@
+"""
+Offline cache warming: fetch whole reciters / surahs / juz ahead of time so
+/generate never touches the network.
+
+    python warm_cache.py --reciter husary --reciter alafasy --surah 1-5,18
+    python warm_cache.py --reciter sudais --juz 30 --captions
+
+Audio goes through the same path as /generate (download_audio_with_fallback:
+fallback chain, availability manifest, loose cache or packs per AUDIO_STORE),
+AUDIO_WORKERS at a time. Every file is checked by walking its MP3 frames
+(mp3_probe): a file that does not parse, or stops short of the frames its
+header announces (a truncated download), is dropped and fetched once more.
+Its analysis (R128 loudness, pause map) is done in the same pass
+(--no-analyze skips it), so renders of warmed ayahs only read cached stats.
+Ayahs a fallback reciter had to serve are listed at the end with that
+reciter, and stay pending for the requested one.
+
+Progress is saved to cache/warm/<job>.json, so an interrupted run resumes
+where it stopped (--restart ignores it). --captions also renders the caption
+PNGs for the same ayahs and builds the precomputed font-size table.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import contextlib
+
+import main
+import audio_cache
+import audio_fetch
+import audio_pack
+import caption_fit
+import caption_pool
+import caption_renderer
+import mp3_probe
+import quran_provider
+
+WARM_DIR = main.CACHE_DIR / 'warm'
+SAVE_EVERY = 5.0  # seconds between progress-manifest writes
+
+
+def parse_numbers(spec, highest):
+    """'1-3,18' -> [1, 2, 3, 18]"""
+    numbers = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        first, last = int(first), int(last or first)
+        if not 1 <= first <= last <= highest:
+            raise ValueError(f"out of range 1..{highest}: {part}")
+        numbers.extend(range(first, last + 1))
+    return numbers
+
+
+def select_ayahs(surahs=None, juz=None):
+    """[(surah, ayah, text)] for the selectors, in Quran order without duplicates."""
+    ayahs = {}
+    for surah in parse_numbers(surahs, 114) if surahs else []:
+        for i, text in enumerate(quran_provider.get_surah(surah)):
+            ayahs[(surah, i + 1)] = text
+    for number in parse_numbers(juz, quran_provider.division_count('juz')) if juz else []:
+        for surah, ayah, text in quran_provider.get_division_ayahs('juz', number):
+            ayahs[(surah, ayah)] = text
+    return [(s, a, ayahs[(s, a)]) for s, a in sorted(ayahs)]
+
+
+def read_audio(source):
+    if audio_pack.is_spec(source):
+        return audio_pack.read_spec(source)
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def verify_audio(source):
+    """
+    Bytes of the file if its MP3 frames parse to a non-empty duration and run
+    complete to the end of the file (mp3_probe.is_complete), else None.
+    """
+    try:
+        data = read_audio(source)
+    except OSError:
+        return None
+    info = mp3_probe.probe(data)
+    if not info or info['duration'] <= 0 or not mp3_probe.is_complete(data):
+        return None
+    return data
+
+
+def source_reciter(source):
+    """Reciter a stored file (loose or packed) belongs to, or None."""
+    if audio_pack.is_spec(source):
+        parsed = audio_pack.parse_name(os.path.basename(audio_pack.spec_path(source)))
+    else:
+        parsed = audio_cache.parse_name(os.path.basename(source))
+    return parsed[0] if parsed else None
+
+
+def discard(source, surah, ayah):
+    """Drops a bad file (loose or packed) from its store so the next call downloads it again."""
+    reciter = source_reciter(source)
+    if not reciter:
+        return False
+    store = main.AUDIO_PACKS if audio_pack.is_spec(source) else main.AUDIO_CACHE
+    store.discard(reciter, surah, ayah)
+    return True
+
+
+class Progress:
+    """Resume manifest + throughput / ETA reporting."""
+
+    def __init__(self, job, keys, restart=False):
+        self.path = WARM_DIR / f"{job}.json"
+        self.done = set()
+        if not restart:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.done = set(json.load(f)['done'])
+            except (OSError, ValueError, KeyError):
+                pass
+        self.failed = []
+        self.fallbacks = {}  # key -> reciter that served it instead
+        self.total = len(keys)
+        self.todo = [key for key in keys if key not in self.done]
+        self.count = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self.saved = self.start
+
+    def record(self, key, size, served_by=None):
+        """
+        One finished key. Served by a fallback reciter, it is not done: a
+        resumed run asks the requested reciter again (cheap when the manifest
+        knows it is missing).
+        """
+        if size is None:
+            self.failed.append(key)
+        else:
+            if served_by and served_by != key.split(':')[0]:
+                self.fallbacks[key] = served_by
+            else:
+                self.done.add(key)
+            self.bytes += size
+        self.count += 1
+        now = time.perf_counter()
+        if now - self.saved >= SAVE_EVERY:
+            self.save()
+            self.saved = now
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.count / elapsed
+        eta = (len(self.todo) - self.count) / rate if rate else 0
+        print(f"\r[WARM] {len(self.done)}/{self.total}  {rate:.1f} files/s  "
+              f"{self.bytes / elapsed / 1e6:.2f} MB/s  ETA {eta:.0f}s  fallback {len(self.fallbacks)}  "
+              f"failed {len(self.failed)}   ",
+              end='', file=sys.__stdout__, flush=True)
+
+    def save(self):
+        os.makedirs(WARM_DIR, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'done': sorted(self.done), 'fallbacks': self.fallbacks, 'failed': self.failed}, f)
+        os.replace(tmp, self.path)
+
+
+def warm_audio(reciters, ayahs, restart=False, workers=None, verbose=False, analyze=True):
+    keys = [f"{reciter}:{s}:{a}" for reciter in reciters for s, a, _ in ayahs]
+    job = hashlib.sha1("\n".join(keys).encode('utf-8')).hexdigest()[:16]
+    progress = Progress(job, keys, restart)
+    if len(progress.todo) < len(keys):
+        print(f"[INFO] Resuming job {job}: {len(keys) - len(progress.todo)} of {len(keys)} already done")
+
+    def fetch(key):
+        """(size, reciter that served it), or None."""
+        reciter, surah, ayah = key.split(':')
+        surah, ayah = int(surah), int(ayah)
+        for _ in range(2):
+            source = main.download_audio_with_fallback(reciter, surah, ayah)
+            if not source:
+                return None
+            data = verify_audio(source)
+            if data is not None:
+                if analyze:
+                    main.AUDIO_ANALYSIS.analyse(source)
+                return len(data), source_reciter(source)
+            print(f"[WARN] {key}: not a valid MP3, refetching")
+            if not discard(source, surah, ayah):
+                return None
+        return None
+
+    try:
+        with contextlib.ExitStack() as quiet:
+            if not verbose:
+                # per-ayah download logs are noise next to the progress line
+                devnull = quiet.enter_context(open(os.devnull, 'w'))
+                quiet.enter_context(contextlib.redirect_stdout(devnull))
+            for i, result in audio_fetch.as_resolved(progress.todo, fetch, workers=workers):
+                progress.record(progress.todo[i], *(result or (None,)))
+    finally:
+        progress.save()
+        main.AUDIO_CACHE.flush()
+        main.AUDIO_PACKS.flush()
+        main.AUDIO_MANIFEST.flush()
+        main.AUDIO_ANALYSIS.flush()
+        print()
+
+    elapsed = time.perf_counter() - progress.start
+    print(f"[OK] Audio: {len(progress.done)}/{progress.total} ayahs cached, {progress.count} fetched/verified "
+          f"in {elapsed:.1f}s ({progress.bytes / 1e6:.1f} MB), {len(progress.fallbacks)} from a fallback reciter, "
+          f"{len(progress.failed)} failed")
+    for key, served_by in sorted(progress.fallbacks.items()):
+        print(f"  ⚠ {key}: served by {served_by}")
+    for key in progress.failed:
+        print(f"  ✗ {key}")
+    return not progress.failed
+
+
+def warm_captions(ayahs, effects=None):
+    font_path = main.find_quran_font()
+    if not font_path:
+        print("[ERROR] Amiri-Quran.ttf not found, skipping captions")
+        return False
+    _, _, box_width, box_height = caption_fit.CANVAS_PRESETS['reel']
+    renderer = caption_renderer.get_renderer(font_path)
+    if not caption_fit.has_fit_table(renderer, box_width, box_height):
+        print(f"[INFO] Precomputing font sizes ({box_width}x{box_height})")
+        caption_fit.precompute_fits(renderer, box_width, box_height)
+
+    style = {'width': 1080, 'height': 1920, 'effects': effects}
+    jobs = [(f"{s}:{a}", text, style) for s, a, text in ayahs]
+    results = caption_pool.render_captions(jobs, font_path, main.CAPTION_CACHE)
+    main.CAPTION_CACHE.flush()
+    failed = sum(1 for r in results if not r)
+    print(f"[OK] Captions: {len(results) - failed}/{len(results)} cached")
+    return not failed
+
+
+if __name__ == "__main__":
+    import caption_effects
+
+    parser = argparse.ArgumentParser(description="Pre-fetch reciter audio (and captions) into the caches")
+    parser.add_argument('--reciter', action='append', required=True,
+                        help="reciter key (repeatable), or 'all' for every verified reciter")
+    parser.add_argument('--surah', help="surahs, e.g. 1-5,18")
+    parser.add_argument('--juz', help="juz numbers, e.g. 29-30")
+    parser.add_argument('--workers', type=int, help="concurrent downloads (default AUDIO_WORKERS)")
+    parser.add_argument('--captions', action='store_true', help="also render captions and the font-size table")
+    parser.add_argument('--effects', help="caption effects preset (default: as /generate)")
+    parser.add_argument('--no-analyze', action='store_true', help="skip audio analysis (loudness, pauses)")
+    parser.add_argument('--restart', action='store_true', help="ignore saved progress for this selection")
+    parser.add_argument('--verbose', action='store_true', help="show per-ayah download logs")
+    args = parser.parse_args()
+
+    reciters = list(main.VERIFIED_RECITERS) if 'all' in args.reciter else args.reciter
+    unknown = [r for r in reciters if r not in main.VERIFIED_RECITERS]
+    if unknown:
+        parser.error(f"unknown reciter(s): {', '.join(unknown)}")
+    if not (args.surah or args.juz):
+        parser.error("select at least one --surah or --juz")
+    try:
+        ayahs = select_ayahs(args.surah, args.juz)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f"[INFO] Warming {len(reciters)} reciter(s) x {len(ayahs)} ayahs")
+    ok = warm_audio(reciters, ayahs, restart=args.restart, workers=args.workers,
+                    verbose=args.verbose, analyze=not args.no_analyze)
+    if args.captions:
+        ok = warm_captions(ayahs, caption_effects.normalize_effects(args.effects)) and ok
+    sys.exit(0 if ok else 1)
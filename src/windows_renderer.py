@@ -2,6 +2,7 @@
 import ctypes
 from ctypes import wintypes
 import struct
+import threading
 from PIL import Image
 
 # Windows GDI Constants
@@ -78,166 +79,165 @@ def load_private_font(font_path):
         return False
     return True
 
-def render_text_to_image(text, font_name, font_size, width, height, text_color=(255, 255, 255)):
-    """
-    Render text using Windows GDI to a PIL Image.
-    This handles complex scripts (Arabic) natively with correct shaping and GPOS.
-    """
-    print(f"[DEBUG] GDI Render: Font='{font_name}', Charset=178, Quality=ClearType")
-    
-    # 1. Create Device Contexts
-    hwin = user32.GetDesktopWindow()
-    hdc_screen = user32.GetDC(hwin)
-    hdc_mem = gdi32.CreateCompatibleDC(hdc_screen)
-    
-    # 2. Create Bitmap
-    hbitmap = gdi32.CreateCompatibleBitmap(hdc_screen, width, height)
-    old_bitmap = gdi32.SelectObject(hdc_mem, hbitmap)
-    
-    # 3. Create Font
+def _create_font(font_name, font_size):
     # Height = -MulDiv(PointSize, GetDeviceCaps(hDC, LOGPIXELSY), 72)
     # Approx: height in pixels
-    
     # Note: UthmanTNB might need large size
-    lfHeight = -int(font_size) 
-    
-    hfont = gdi32.CreateFontW(
+    lfHeight = -int(font_size)
+    return gdi32.CreateFontW(
         lfHeight, 0, 0, 0, 
         FW_NORMAL, 0, 0, 0, 
-        ARABIC_CHARSET, 
+        ARABIC_CHARSET, # Needed for correct Arabic shaping
         OUT_TT_PRECIS, 
         CLIP_DEFAULT_PRECIS, 
         CLEARTYPE_QUALITY, 
         DEFAULT_PITCH | FF_DONTCARE, 
         font_name
     )
-    
-    old_font = gdi32.SelectObject(hdc_mem, hfont)
-    
-    # 4. Setup Graphics
-    # Clear background (Transparent is easier if we use black bg then convert to alpha?)
-    # GDI DrawText doesn't handle Alpha channel in RGB easily.
-    # Approach: Draw white text on black background. Use result as Alpha mask?
-    # Or text_color on transparent?
-    # Simple approach: Draw text on black. Luma = Alpha.
-    
-    # Fill Black
-    bk_rect = wintypes.RECT(0, 0, width, height)
-    # GetStockObject(BLACK_BRUSH) = 4
-    fill_brush = gdi32.GetStockObject(4) 
-    user32.FillRect(hdc_mem, ctypes.byref(bk_rect), fill_brush)
-    
-    # Set Text properties
-    gdi32.SetBkMode(hdc_mem, TRANSPARENT)
-    gdi32.SetTextColor(hdc_mem, 0x00FFFFFF) # White BGR
-    
-    # Calculate vertical position
-    # DT_VCENTER only works with DT_SINGLELINE. For multiline, we must measure.
-    rect_measure = wintypes.RECT(10, 10, width - 10, height - 10) # Initial constraints
-    flags_base = DT_CENTER | DT_WORDBREAK | DT_RTLREADING | DT_NOPREFIX
-    
-    # Measure
-    gdi32.SetBkMode(hdc_mem, TRANSPARENT) # Ensure setup
-    gdi32.SetTextColor(hdc_mem, 0x00FFFFFF)
-    
-    # Copy rect for measurement
-    rect_calc = wintypes.RECT(rect_measure.left, rect_measure.top, rect_measure.right, rect_measure.bottom)
-    user32.DrawTextW(hdc_mem, text, -1, ctypes.byref(rect_calc), flags_base | 0x00000400) # DT_CALCRECT = 0x400
-    
-    text_height = rect_calc.bottom - rect_calc.top
-    avail_height = height - 20 # Margins
-    
-    y_offset = (avail_height - text_height) // 2
-    if y_offset < 0: y_offset = 0
-    
-    # Final Draw
-    rect_draw = wintypes.RECT(rect_measure.left, 10 + y_offset, rect_measure.right, 10 + y_offset + text_height)
-    user32.DrawTextW(hdc_mem, text, -1, ctypes.byref(rect_draw), flags_base)
-    
-    # 6. Extract Bits
-    bmi = BITMAPINFO()
-    bmi.bmiHeader.biSize = ctypes.sizeof(BITMAPINFOHEADER)
-    bmi.bmiHeader.biWidth = width
-    bmi.bmiHeader.biHeight = -height # Top-down
-    bmi.bmiHeader.biPlanes = 1
-    bmi.bmiHeader.biBitCount = 32
-    bmi.bmiHeader.biCompression = 0 # BI_RGB
-    
-    buffer = ctypes.create_string_buffer(width * height * 4)
-    gdi32.GetDIBits(hdc_mem, hbitmap, 0, height, buffer, ctypes.byref(bmi), 0)
-    
-    # 7. Create PIL Image
-    # Image is BGRA (on little endian Windows 32-bit bitmap)
-    try:
-        image = Image.frombytes("RGBA", (width, height), buffer.raw, "raw", "BGRA")
-    except:
-        # Fallback if mode differs
-        image = Image.frombytes("RGB", (width, height), buffer.raw, "raw", "BGRX")
-    
-    # 8. Cleanup
-    gdi32.SelectObject(hdc_mem, old_bitmap)
-    gdi32.SelectObject(hdc_mem, old_font)
-    gdi32.DeleteObject(hbitmap)
-    gdi32.DeleteObject(hfont)
-    gdi32.DeleteDC(hdc_mem)
-    user32.ReleaseDC(hwin, hdc_screen)
-    
-    # Post-processing:
-    # We drew white text on black.
-    # Convert to user color with transparency.
-    # Take the Blue channel (or Grayscale) as Alpha.
-    
-    alpha = image.convert("L")
-    
-    # Create final image
-    final_img = Image.new("RGBA", (width, height), text_color)
-    final_img.putalpha(alpha)
-    
-    return final_img
-
-    return final_img
 
-def measure_text_height(text, font_name, font_size, width):
+class GdiRenderContext:
     """
-    Measure the height of the text for a given width and font size.
-    Returns the calculated height in pixels.
+    Long-lived GDI state for one thread: a memory DC, HFONTs per (face, size),
+    a bitmap for the current canvas size and a reusable pixel buffer.
+    Creating and destroying these on every call dominated caption time.
     """
-    # 1. Create Device Contexts
-    hwin = user32.GetDesktopWindow()
-    hdc_screen = user32.GetDC(hwin)
-    hdc_mem = gdi32.CreateCompatibleDC(hdc_screen)
-    
-    # 2. Create Font
-    lfHeight = -int(font_size)
-    
-    hfont = gdi32.CreateFontW(
-        lfHeight, 0, 0, 0, 
-        FW_NORMAL, 0, 0, 0, 
-        ARABIC_CHARSET, # Changed for better shaping
-        OUT_TT_PRECIS, 
-        CLIP_DEFAULT_PRECIS, 
-        CLEARTYPE_QUALITY, 
-        DEFAULT_PITCH | FF_DONTCARE, 
-        font_name
-    )
-    
-    old_font = gdi32.SelectObject(hdc_mem, hfont)
-    
-    # 3. Measure
-    rect = wintypes.RECT(0, 0, width, 0) # Height ignored for calculation usually, but we need meaningful width
-    flags_base = DT_CENTER | DT_WORDBREAK | DT_RTLREADING | DT_NOPREFIX | 0x00000400 # DT_CALCRECT
-    
-    user32.DrawTextW(hdc_mem, text, -1, ctypes.byref(rect), flags_base)
-    
-    measured_height = rect.bottom - rect.top
-    
-    # 4. Cleanup
-    gdi32.SelectObject(hdc_mem, old_font)
-    gdi32.DeleteObject(hfont)
-    gdi32.DeleteDC(hdc_mem)
-    user32.ReleaseDC(hwin, hdc_screen)
-    
-    return measured_height
+
+    def __init__(self):
+        self.hwin = user32.GetDesktopWindow()
+        self.hdc_screen = user32.GetDC(self.hwin)
+        self.hdc_mem = gdi32.CreateCompatibleDC(self.hdc_screen)
+        self.fonts = {}     # (font_name, size) -> HFONT
+        self.bitmap = None  # (width, height, HBITMAP)
+        self.buffer = None  # ctypes buffer matching self.bitmap
+        self.default_font = None
+        self.default_bitmap = None
+
+    def select_font(self, font_name, font_size):
+        key = (font_name, int(font_size))
+        hfont = self.fonts.get(key)
+        if hfont is None:
+            hfont = _create_font(font_name, font_size)
+            self.fonts[key] = hfont
+        old = gdi32.SelectObject(self.hdc_mem, hfont)
+        if self.default_font is None:
+            self.default_font = old
+
+    def select_bitmap(self, width, height):
+        if self.bitmap and self.bitmap[:2] == (width, height):
+            return self.bitmap[2]
+        hbitmap = gdi32.CreateCompatibleBitmap(self.hdc_screen, width, height)
+        old = gdi32.SelectObject(self.hdc_mem, hbitmap)
+        if self.default_bitmap is None:
+            self.default_bitmap = old
+        if self.bitmap:
+            gdi32.DeleteObject(self.bitmap[2])
+        self.bitmap = (width, height, hbitmap)
+        self.buffer = ctypes.create_string_buffer(width * height * 4)
+        return hbitmap
+
+    def measure_text_height(self, text, font_name, font_size, width):
+        """
+        Measure the height of the text for a given width and font size.
+        Returns the calculated height in pixels.
+        """
+        self.select_font(font_name, font_size)
+
+        rect = wintypes.RECT(0, 0, width, 0) # Height ignored for calculation usually, but we need meaningful width
+        flags_base = DT_CENTER | DT_WORDBREAK | DT_RTLREADING | DT_NOPREFIX | 0x00000400 # DT_CALCRECT
+        user32.DrawTextW(self.hdc_mem, text, -1, ctypes.byref(rect), flags_base)
+
+        return rect.bottom - rect.top
+
+    def render_text_to_image(self, text, font_name, font_size, width, height, text_color=(255, 255, 255)):
+        """
+        Render text using Windows GDI to a PIL Image.
+        This handles complex scripts (Arabic) natively with correct shaping and GPOS.
+        """
+        hbitmap = self.select_bitmap(width, height)
+        self.select_font(font_name, font_size)
+
+        # Draw white text on black background, then use luma as alpha.
+        bk_rect = wintypes.RECT(0, 0, width, height)
+        # GetStockObject(BLACK_BRUSH) = 4
+        fill_brush = gdi32.GetStockObject(4) 
+        user32.FillRect(self.hdc_mem, ctypes.byref(bk_rect), fill_brush)
+
+        gdi32.SetBkMode(self.hdc_mem, TRANSPARENT)
+        gdi32.SetTextColor(self.hdc_mem, 0x00FFFFFF) # White BGR
+
+        # Calculate vertical position
+        # DT_VCENTER only works with DT_SINGLELINE. For multiline, we must measure.
+        rect_measure = wintypes.RECT(10, 10, width - 10, height - 10) # Initial constraints
+        flags_base = DT_CENTER | DT_WORDBREAK | DT_RTLREADING | DT_NOPREFIX
+
+        rect_calc = wintypes.RECT(rect_measure.left, rect_measure.top, rect_measure.right, rect_measure.bottom)
+        user32.DrawTextW(self.hdc_mem, text, -1, ctypes.byref(rect_calc), flags_base | 0x00000400) # DT_CALCRECT = 0x400
+
+        text_height = rect_calc.bottom - rect_calc.top
+        avail_height = height - 20 # Margins
+
+        y_offset = (avail_height - text_height) // 2
+        if y_offset < 0: y_offset = 0
+
+        # Final Draw
+        rect_draw = wintypes.RECT(rect_measure.left, 10 + y_offset, rect_measure.right, 10 + y_offset + text_height)
+        user32.DrawTextW(self.hdc_mem, text, -1, ctypes.byref(rect_draw), flags_base)
+
+        # Extract Bits
+        bmi = BITMAPINFO()
+        bmi.bmiHeader.biSize = ctypes.sizeof(BITMAPINFOHEADER)
+        bmi.bmiHeader.biWidth = width
+        bmi.bmiHeader.biHeight = -height # Top-down
+        bmi.bmiHeader.biPlanes = 1
+        bmi.bmiHeader.biBitCount = 32
+        bmi.bmiHeader.biCompression = 0 # BI_RGB
+
+        gdi32.GetDIBits(self.hdc_mem, hbitmap, 0, height, self.buffer, ctypes.byref(bmi), 0)
+
+        # Image is BGRA (on little endian Windows 32-bit bitmap)
+        try:
+            image = Image.frombytes("RGBA", (width, height), self.buffer.raw, "raw", "BGRA")
+        except:
+            # Fallback if mode differs
+            image = Image.frombytes("RGB", (width, height), self.buffer.raw, "raw", "BGRX")
+
+        # We drew white text on black: luma is the alpha mask.
+        alpha = image.convert("L")
+
+        final_img = Image.new("RGBA", (width, height), text_color)
+        final_img.putalpha(alpha)
+        return final_img
+
+    def close(self):
+        if self.default_font is not None:
+            gdi32.SelectObject(self.hdc_mem, self.default_font)
+        if self.default_bitmap is not None:
+            gdi32.SelectObject(self.hdc_mem, self.default_bitmap)
+        for hfont in self.fonts.values():
+            gdi32.DeleteObject(hfont)
+        if self.bitmap:
+            gdi32.DeleteObject(self.bitmap[2])
+        gdi32.DeleteDC(self.hdc_mem)
+        user32.ReleaseDC(self.hwin, self.hdc_screen)
+        self.fonts = {}
+        self.bitmap = None
+
+_local = threading.local()
+
+def _default_context():
+    ctx = getattr(_local, 'context', None)
+    if ctx is None:
+        ctx = GdiRenderContext()
+        _local.context = ctx
+    return ctx
+
+def render_text_to_image(text, font_name, font_size, width, height, text_color=(255, 255, 255)):
+    """Render text with this thread's GDI context (see GdiRenderContext)."""
+    return _default_context().render_text_to_image(text, font_name, font_size, width, height, text_color)
+
+def measure_text_height(text, font_name, font_size, width):
+    """Measure text height with this thread's GDI context (see GdiRenderContext)."""
+    return _default_context().measure_text_height(text, font_name, font_size, width)
 
 if __name__ == "__main__":
     # Self test
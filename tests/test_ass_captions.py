@@ -0,0 +1,39 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import ass_captions
+
+FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fonts', 'Amiri-Quran.ttf')
+
+
+def _has_libass():
+    if not shutil.which('ffmpeg'):
+        return False
+    out = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True, text=True).stdout
+    return any(line.split()[1:2] == ['ass'] for line in out.splitlines())
+
+
+def test_script_escapes_override_braces():
+    script = ass_captions.build_script([(0.0, 1.5, 'a {b} \\c', 40)], FONT)
+    assert script.splitlines()[-1].endswith('a \\{b\\} \\\\c')
+    assert 'Dialogue: 0,0:00:00.00,0:00:01.50,Ayah' in script
+
+
+def test_engines_agree():
+    """The libass captions must ink the same areas as the PNG engine."""
+    pytest.importorskip('numpy')
+    if not _has_libass():
+        pytest.skip("ffmpeg with libass not available")
+    import caption_renderer
+    try:
+        caption_renderer.get_renderer(FONT)
+    except RuntimeError as e:
+        pytest.skip(str(e))
+
+    results = ass_captions.compare_engines(sample=6, font_path=FONT)
+    assert results
+    failed = [(sura, ayah, round(iou, 3)) for sura, ayah, iou, _, _ in results if iou < ass_captions.MIN_IOU]
+    assert not failed
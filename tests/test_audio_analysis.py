@@ -0,0 +1,109 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip('numpy')
+import audio_aac
+import audio_analysis
+import audio_cache
+import audio_pack
+
+SAMPLE_MP3 = Path(__file__).resolve().parent.parent / 'audio' / 'alafasy_001_001.mp3'
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    """An audio cache, a pack store and an analysis cache wired as main.py does; no decoding."""
+    if not SAMPLE_MP3.exists():
+        pytest.skip("sample MP3 not available")
+    monkeypatch.setattr(audio_analysis, 'MEASURES', {'loudness': lambda pcm: {'lufs': -20.0, 'peak_db': -3.0}})
+    monkeypatch.setattr(audio_analysis, 'decode_pcm', lambda source: np.zeros((4800, 2), dtype=np.float32))
+
+    cache = audio_cache.AudioCache(tmp_path / 'audio', pins=())
+    packs = audio_pack.PackStore(tmp_path / 'packs')
+    analysis = audio_analysis.AnalysisCache(tmp_path / 'analysis')
+    cache.on_remove = lambda names: analysis.forget(f"{name}:" for name in names)
+    packs.on_remove = lambda specs: analysis.forget(f"{spec}:" for spec in specs)
+    return cache, packs, analysis
+
+
+def _add(cache, ayah):
+    shutil.copy(SAMPLE_MP3, cache.path_for('alafasy', 1, ayah))
+    return cache.record('alafasy', 1, ayah)
+
+
+def _measure(analysis, source):
+    analysis.analyse(source)
+    analysis.envelope(source, 30)
+    return audio_aac.source_id(source)
+
+
+def _envelopes(analysis):
+    return sorted(os.listdir(os.path.join(analysis.root, 'envelopes')))
+
+
+def test_discard_and_evict_drop_stats(stores):
+    cache, _, analysis = stores
+    keys = [_measure(analysis, _add(cache, ayah)) for ayah in (1, 2, 3)]
+    analysis.flush()
+    assert len(_envelopes(analysis)) == 3
+
+    cache.discard('alafasy', 1, 1)
+    cache.lookup('alafasy', 1, 3)  # ayah 2 is now the least recently used
+    cache.max_bytes = 2 * SAMPLE_MP3.stat().st_size
+    _add(cache, 4)
+    assert audio_cache.audio_name('alafasy', 1, 2) not in cache.entries
+    assert set(analysis.entries) == {keys[2]}
+    assert len(_envelopes(analysis)) == 1
+
+    analysis.flush()
+    assert set(audio_analysis.AnalysisCache(analysis.root).entries) == {keys[2]}
+
+
+def test_pack_discard_drops_stats(stores):
+    _, packs, analysis = stores
+    spec = packs.put('alafasy', 1, 1, SAMPLE_MP3.read_bytes())
+    key = _measure(analysis, spec)
+    assert key in analysis.entries
+    packs.discard('alafasy', 1, 1)
+    assert key not in analysis.entries
+
+
+def test_other_process_does_not_restore_dropped_entries(stores):
+    cache, _, analysis = stores
+    keys = [_measure(analysis, _add(cache, ayah)) for ayah in (1, 2)]
+    analysis.flush()
+
+    # a second process loaded the index before the discard and measures another file
+    other = audio_analysis.AnalysisCache(analysis.root)
+    cache.discard('alafasy', 1, 1)
+    analysis.flush()
+    third = _measure(other, _add(cache, 3))
+    other.flush()
+    assert set(audio_analysis.AnalysisCache(analysis.root).entries) == {keys[1], third}
+
+
+def test_prune_drops_removed_and_repacked_audio(stores):
+    cache, packs, analysis = stores
+    loose = [_measure(analysis, _add(cache, ayah)) for ayah in (1, 2)]
+    packed = _measure(analysis, packs.put('alafasy', 1, 5, SAMPLE_MP3.read_bytes()))
+    analysis.flush()
+
+    # changed behind this process's back: one file deleted, the pack compacted
+    os.remove(cache.path_for('alafasy', 1, 1))
+    old_pack = audio_pack.spec_path(packs.lookup('alafasy', 1, 5))
+    packs.pack('alafasy').compact()
+
+    restarted = audio_analysis.AnalysisCache(analysis.root)
+    stale = lambda keys: audio_aac.stale_keys(keys, cache.root)
+    assert restarted.prune(stale) == 1
+    assert set(restarted.entries) == {loose[1], packed}  # the retired generation is still readable
+
+    # ... until it is deleted after its grace period
+    for path in (old_pack, old_pack[:-len('pack')] + 'idx'):
+        os.remove(path)
+    assert restarted.prune(stale) == 1
+    assert set(restarted.entries) == {loose[1]}
+    assert len(_envelopes(restarted)) == 1
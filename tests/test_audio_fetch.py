@@ -0,0 +1,191 @@
+import http.server
+import threading
+import time
+import types
+
+import pytest
+
+import audio_fetch
+
+BODY = bytes(range(256)) * 20  # 5120 bytes, above fetch()'s min_bytes
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        hits = self.server.hits
+        hits[self.path] = hits.get(self.path, 0) + 1
+        route = self.path.split('/')[1]
+        if route == 'ok' or (route == 'flaky' and hits[self.path] > 2) or (route == 'cut' and hits[self.path] > 1):
+            self._reply(200, BODY)
+        elif route in ('flaky', 'down'):
+            self._reply(503, b'busy')
+        elif route in ('cut', 'cut-always'):
+            # Promise the whole body, send half of it, drop the connection
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY[:len(BODY) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+        elif route == 'tiny':
+            self._reply(200, b'x' * 10)
+        else:
+            self._reply(404, b'not found')
+
+    def do_HEAD(self):
+        route = self.path.split('/')[1]
+        self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        self.send_response({'ok': 200, 'down': 503}.get(route, 404))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.hits = {}
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_breaker(monkeypatch):
+    monkeypatch.setattr(audio_fetch, 'breaker', audio_fetch.CircuitBreaker(threshold=3, cooldown=30.0))
+    # Retries do not wait out their backoff
+    monkeypatch.setattr(audio_fetch, 'time', types.SimpleNamespace(monotonic=time.monotonic, sleep=lambda seconds: None))
+
+
+def _url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def _leftovers(tmp_path):
+    return sorted(p.name for p in tmp_path.iterdir())
+
+
+# --- backoff ---
+
+@pytest.mark.parametrize('attempt', range(8))
+def test_backoff_delay_bounds(attempt):
+    bound = min(audio_fetch.BACKOFF_CAP, audio_fetch.BACKOFF_BASE * 2 ** attempt)
+    delays = [audio_fetch.backoff_delay(attempt) for _ in range(200)]
+    assert all(0.0 <= d <= bound for d in delays)
+    assert max(delays) > bound / 2  # jitter spans the range, not a fixed value
+
+
+def test_backoff_delay_cap():
+    assert audio_fetch.backoff_delay(50, base=1.0, cap=2.0) <= 2.0
+    assert audio_fetch.backoff_delay(3, base=0.0) == 0.0
+
+
+# --- circuit breaker ---
+
+def test_breaker_open_half_open_close(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(audio_fetch, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    breaker = audio_fetch.CircuitBreaker(threshold=3, cooldown=10.0)
+
+    for _ in range(2):
+        breaker.record('h', False)
+    assert breaker.allow('h')  # closed: below the threshold
+    breaker.record('h', False)
+    assert not breaker.allow('h')  # open
+    assert breaker.stats()['h'] == {'failures': 3, 'open': True}
+    assert breaker.allow('other')  # per host
+
+    now[0] += 10.0
+    assert breaker.allow('h')  # half-open: one trial request
+    assert not breaker.allow('h')  # ... and only one
+    breaker.record('h', False)  # trial failed: open again for a full cooldown
+    assert not breaker.allow('h')
+    now[0] += 9.0
+    assert not breaker.allow('h')
+
+    now[0] += 1.0
+    assert breaker.allow('h')
+    breaker.record('h', True)  # trial succeeded: closed
+    assert breaker.allow('h') and breaker.allow('h')
+    assert breaker.stats()['h'] == {'failures': 0, 'open': False}
+
+
+def test_breaker_success_resets_count():
+    breaker = audio_fetch.CircuitBreaker(threshold=3)
+    for ok in (False, False, True, False, False):
+        breaker.record('h', ok)
+    assert breaker.allow('h')
+
+
+# --- fetch against a local server ---
+
+def test_fetch_ok(server, tmp_path):
+    dest = tmp_path / 'a.mp3'
+    assert audio_fetch.fetch(_url(server, '/ok/a'), dest) == audio_fetch.OK
+    assert dest.read_bytes() == BODY
+    assert _leftovers(tmp_path) == ['a.mp3']
+
+
+def test_fetch_404_is_final(server, tmp_path):
+    dest = tmp_path / 'a.mp3'
+    assert audio_fetch.fetch(_url(server, '/gone/a'), dest) == audio_fetch.MISSING
+    assert server.hits == {'/gone/a': 1}  # not retried
+    assert _leftovers(tmp_path) == []
+    assert audio_fetch.breaker.allow(f"127.0.0.1:{server.server_address[1]}")
+
+
+def test_fetch_too_small_is_missing(server, tmp_path):
+    assert audio_fetch.fetch(_url(server, '/tiny/a'), tmp_path / 'a.mp3') == audio_fetch.MISSING
+    assert _leftovers(tmp_path) == []
+
+
+def test_fetch_retries_5xx(server, tmp_path):
+    dest = tmp_path / 'a.mp3'
+    assert audio_fetch.fetch(_url(server, '/flaky/a'), dest) == audio_fetch.OK
+    assert server.hits == {'/flaky/a': 3}
+    assert dest.read_bytes() == BODY
+
+
+def test_fetch_5xx_gives_up(server, tmp_path):
+    assert audio_fetch.fetch(_url(server, '/down/a'), tmp_path / 'a.mp3', retries=2) == audio_fetch.FAILED
+    assert server.hits == {'/down/a': 2}
+    assert _leftovers(tmp_path) == []
+
+
+def test_fetch_partial_body_retried(server, tmp_path):
+    dest = tmp_path / 'a.mp3'
+    assert audio_fetch.fetch(_url(server, '/cut/a'), dest) == audio_fetch.OK
+    assert server.hits == {'/cut/a': 2}
+    assert dest.read_bytes() == BODY
+
+
+def test_fetch_partial_body_never_lands(server, tmp_path):
+    dest = tmp_path / 'a.mp3'
+    assert audio_fetch.fetch(_url(server, '/cut-always/a'), dest) == audio_fetch.FAILED
+    assert _leftovers(tmp_path) == []  # no truncated file, no stray .part
+
+
+def test_fetch_circuit_opens(server, tmp_path):
+    assert audio_fetch.fetch(_url(server, '/down/a'), tmp_path / 'a.mp3') == audio_fetch.FAILED
+    # threshold 3 reached by the three attempts: the host is now skipped
+    assert audio_fetch.fetch(_url(server, '/ok/b'), tmp_path / 'b.mp3') == audio_fetch.CIRCUIT_OPEN
+    assert '/ok/b' not in server.hits
+
+
+def test_head(server):
+    assert audio_fetch.head(_url(server, '/ok/a')) == audio_fetch.OK
+    assert audio_fetch.head(_url(server, '/gone/a')) == audio_fetch.MISSING
+    assert audio_fetch.head(_url(server, '/down/a'), retries=2) == audio_fetch.FAILED
+    assert server.hits['/down/a'] == 2
@@ -0,0 +1,124 @@
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+main = pytest.importorskip('main')
+import audio_cache
+import audio_fetch
+import audio_manifest
+import audio_pack
+
+SAMPLE_MP3 = Path(__file__).resolve().parent.parent / 'audio' / 'alafasy_001_001.mp3'
+
+SURAH = 2
+# Upstream answers per (reciter folder, ayah); anything else is a 404
+UPSTREAM = {
+    ('Husary_64kbps', 2): audio_fetch.OK,
+    ('Husary_64kbps', 4): audio_fetch.FAILED,
+    ('Alafasy_64kbps', 3): audio_fetch.OK,
+    ('Alafasy_64kbps', 4): audio_fetch.OK,
+}
+EXPECTED = {
+    1: ('cached', 'husary'),
+    2: ('available', 'husary'),
+    3: ('fallback', main.GUARANTEED_FALLBACK),
+    4: ('fallback', main.GUARANTEED_FALLBACK),
+    5: ('unavailable', None),
+}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    if not SAMPLE_MP3.exists():
+        pytest.skip("sample MP3 not available")
+    cache_dir = tmp_path / 'audio'
+    cache_dir.mkdir()
+    shutil.copy(SAMPLE_MP3, cache_dir / audio_cache.audio_name('husary', SURAH, 1))
+
+    monkeypatch.setattr(main, 'AUDIO_CACHE', audio_cache.AudioCache(cache_dir, pins=()))
+    monkeypatch.setattr(main, 'AUDIO_PACKS', audio_pack.PackStore(tmp_path / 'packs'))
+    monkeypatch.setattr(main, 'AUDIO_MANIFEST', audio_manifest.AvailabilityManifest(tmp_path / 'manifest.json'))
+
+    calls = []
+
+    def head(url, retries=audio_fetch.MAX_RETRIES):
+        folder, name = url.split('/')[-2:]
+        ayah = int(name[3:6])
+        calls.append((folder, ayah))
+        return UPSTREAM.get((folder, ayah), audio_fetch.MISSING)
+
+    monkeypatch.setattr(audio_fetch, 'head', head)
+    monkeypatch.setenv(audio_fetch.WORKERS_ENV, '5')
+    test_client = main.app.test_client()
+    test_client.head_calls = calls
+    return test_client
+
+
+def _validate(client, stream=False):
+    body = {'reciter': 'husary', 'surah': SURAH, 'ayah_from': 1, 'ayah_to': 5}
+    if stream:
+        body['stream'] = True
+    response = client.post('/validate', json=body)
+    assert response.status_code == 200
+    return response
+
+
+def test_validate_statuses(client):
+    data = _validate(client).get_json()
+    assert [r['ayah'] for r in data['results']] == [1, 2, 3, 4, 5]  # input order
+    assert {r['ayah']: (r['status'], r['reciter']) for r in data['results']} == EXPECTED
+    assert data['valid'] is False
+
+
+def test_validate_stream(client, monkeypatch):
+    # Make the ayahs resolve last to first, so stream order differs from input order
+    done = {ayah: threading.Event() for ayah in range(1, 7)}
+    done[6].set()
+    check = main.check_ayah_availability
+
+    def reversed_check(reciter_key, surah, ayah):
+        done[ayah + 1].wait(timeout=5)
+        time.sleep(0.02)
+        try:
+            return check(reciter_key, surah, ayah)
+        finally:
+            done[ayah].set()
+
+    monkeypatch.setattr(main, 'check_ayah_availability', reversed_check)
+    response = _validate(client, stream=True)
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    *results, summary = lines
+    assert [r['ayah'] for r in results] == [5, 4, 3, 2, 1]  # as each one resolves
+    assert {r['ayah']: (r['status'], r['reciter']) for r in results} == EXPECTED
+    assert summary == {'valid': False, 'message': 'Some audio may use fallback', 'done': True}
+
+
+def test_validate_shares_manifest(client):
+    _validate(client)
+    manifest = main.AUDIO_MANIFEST
+    assert manifest.state('husary', SURAH, 2) is True
+    assert manifest.state('husary', SURAH, 3) is False
+    assert manifest.state('husary', SURAH, 4) is None  # a transient failure is not recorded
+    assert manifest.state(main.GUARANTEED_FALLBACK, SURAH, 3) is True
+    assert manifest.state(main.GUARANTEED_FALLBACK, SURAH, 5) is False
+    assert ('Husary_64kbps', 1) not in client.head_calls  # cached, never probed
+
+    # The download path sees the same marks: husary is tried last for ayah 3
+    chain = main.get_fallback_chain('husary')
+    assert manifest.viable(chain, SURAH, 3)[-1] == 'husary'
+
+    # A second run answers known ayahs from the manifest; only the failed probe is repeated
+    client.head_calls.clear()
+    assert {r['ayah']: r['status'] for r in _validate(client).get_json()['results']} == \
+        {ayah: status for ayah, (status, _) in EXPECTED.items()}
+    assert sorted(client.head_calls) == [('Husary_64kbps', 4)]
+
+    # ... and the marks were flushed to the file for other processes
+    reloaded = audio_manifest.AvailabilityManifest(manifest.path)
+    assert reloaded.state('husary', SURAH, 3) is False